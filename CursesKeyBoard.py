@@ -2,12 +2,15 @@
 
 import curses
 from curses import wrapper
+import heapq
 import json
 import os
-import rtmidi
 from pathlib import Path
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from uiloop import UiLoop
+from midiout import openOutput, defaultOutput
+from arpeggiator import Arpeggiator, open_tempo, modes, rate_names, FixedTempo
 
 class Settings:
     def __init__(self):
@@ -24,6 +27,26 @@ class Settings:
             self.json_data: Dict = {"home": self.home, "lastworkingdirectory": os.getcwd(), "arpeggiator": False}
             self.create_settings_file()
 
+    def get_output(self) -> str:
+        return self.json_data.get("output", defaultOutput)
+
+    def get_gate(self) -> float:
+        return self.json_data.get("gate", 0.5)
+
+    def get_sustain(self) -> bool:
+        return self.json_data.get("sustain", False)
+
+    def get_arpeggiator(self) -> bool:
+        return self.json_data.get("arpeggiator", False)
+
+    def set_arpeggiator(self, on: bool) -> None:
+        self.json_data["arpeggiator"] = on
+        self.create_settings_file()
+
+    def get_arp_options(self) -> Dict:
+        """{"mode": "up", "rate": "1/16", "octaves": 1, "gate": 0.5, "bpm": 120, "sync": "internal"}"""
+        return self.json_data.get("arp", {})
+
     def set_current_working_directory(self, path: str) -> None:
         self.json_data["lastworkingdirectory"] = path
         self.create_settings_file()
@@ -33,10 +56,64 @@ class Settings:
             s = json.dumps(self.json_data)
             f.write(s)
 
+class NoteReleases:
+    """
+    Release deadlines of the sounding notes on a monotonic clock. Every note
+    sounds gate seconds from its own key press, a heap keeps the earliest
+    deadline on top so the loop wakes up once for it instead of polling.
+    While sustain is on nothing is released, notes past their deadline are
+    released as soon as it goes off.
+    """
+    def __init__(self, gate: float = 0.5, sustain: bool = False):
+        self.gate: float = gate
+        self.sustain: bool = sustain
+        self.deadlines: Dict[int, float] = {}
+        # (deadline, note), entries of restarted or cancelled notes are skipped when they come up
+        self.heap: List[tuple] = []
+
+    def start(self, note: int, now: float) -> None:
+        deadline = now + self.gate
+        self.deadlines[note] = deadline
+        heapq.heappush(self.heap, (deadline, note))
+
+    def cancel(self, note: int) -> None:
+        self.deadlines.pop(note, None)
+
+    def clear(self) -> None:
+        self.deadlines.clear()
+        self.heap.clear()
+
+    def next_deadline(self) -> Optional[float]:
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        if self.sustain or not heap:
+            return None
+        return heap[0][0]
+
+    def timeout(self, now: float) -> Optional[float]:
+        """seconds until the next release, None if there is none"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(0.0, deadline - now)
+
+    def due(self, now: float) -> List[int]:
+        """the notes to release now, forgotten here"""
+        notes = []
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return notes
+            note = heapq.heappop(self.heap)[1]
+            del self.deadlines[note]
+            notes.append(note)
+
+
 class App:
     def __init__(self):
         self.settings: Optional[Settings] = None
-        self.midi_out: Optional[rtmidi.MidiOut] = None
+        self.midi_out = None  # a midiout backend, opened in run()
         self.screen: curses.window = curses.initscr()
         self.screen.keypad(True)
         curses.noecho()
@@ -60,7 +137,9 @@ class App:
         self.velocity: int = 100
         self.reset_screen()
         self.active_notes: Dict[int, int] = {}
-        self.notes_off_counter: int = 0
+        self.releases: NoteReleases = NoteReleases()
+        self.arp: Optional[Arpeggiator] = None
+        self.ui_loop: Optional[UiLoop] = None
         self.octave: int = 3
         self.modwheel_value: int = 0
         self.pitchbend_value: int = 8192
@@ -70,6 +149,8 @@ class App:
   - Keys 1/2: Pitchbend down/up
   - Keys 3-8: Modwheel control (0-127)
   - C/V: Decrease/Increase velocity
+  - [/]: Shorter/longer notes (steps with the arpeggiator), Tab: Sustain on/off
+  - Z: Arpeggiator on/off, X: Mode, B/N: Rate, M: Octaves, ,/.: Tempo
   - Space: Panic (all notes off)
   - Esc: Exit
   - Keyboard keys (asdfghjkl;'wetyuop): Play notes
@@ -82,29 +163,84 @@ class App:
         self.screen.clear()
         self.screen.refresh()
 
+    def notes_off_timeout(self) -> Optional[float]:
+        return self.releases.timeout(time.monotonic())
+
     def tick_auto_notes_off(self) -> None:
-        if self.notes_off_counter > 0:
-            self.notes_off_counter -= 1
-            if self.notes_off_counter == 0:
-                for key, value in list(self.active_notes.items()):
-                    self.midi_out.send_message([0x80, self.baseNote + key, 64])
-                    del self.active_notes[key]
-                    self.keyboard_display[key] = '-'
-                self.update_keyboard_display()
+        notes = self.releases.due(time.monotonic())
+        for key in notes:
+            self.note_off(key)
+        if notes:
+            self.update_keyboard_display()
+
+    def note_off(self, h: int) -> None:
+        del self.active_notes[h]
+        self.midi_out.send_message([0x80, self.baseNote + h, 64])
+        self.keyboard_display[h] = '-'
 
     def handle_note_on(self, h: int) -> None:
         h += self.octave * 12
+        if self.arp.running:
+            self.hold_arp_note(h)
+            return
         if h in self.active_notes:
-            del self.active_notes[h]
-            self.midi_out.send_message([0x80, self.baseNote + h, 64])
+            # struck again: a new note of full length, not a shorter rest of the old one
+            self.note_off(h)
+            self.releases.cancel(h)
+        self.releases.start(h, time.monotonic())
+        self.midi_out.send_message([0x90, self.baseNote + h, self.velocity])
+        self.active_notes[h] = self.velocity
+        self.keyboard_display[h] = '#'
+        self.update_keyboard_display()
+
+    def set_gate(self, factor: float) -> None:
+        """from the next note on, sounding notes keep their release"""
+        if self.arp.running:
+            self.arp.gate = max(0.05, min(1.0, self.arp.gate * factor))
+            self.arp.changed()
+            return
+        self.releases.gate = max(0.02, min(10.0, self.releases.gate * factor))
+
+    def hold_arp_note(self, h: int) -> None:
+        """keys latch: the first press adds the note to the arpeggio, the second takes it out"""
+        notes = list(self.arp.notes)
+        note = self.baseNote + h
+        if note in notes:
+            notes.remove(note)
             self.keyboard_display[h] = '-'
         else:
-            self.notes_off_counter = 100000
-            self.midi_out.send_message([0x90, self.baseNote + h, self.velocity])
-            self.active_notes[h] = self.velocity
+            notes.append(note)
             self.keyboard_display[h] = '#'
+        self.arp.set_notes(notes)
         self.update_keyboard_display()
 
+    def toggle_arpeggiator(self) -> None:
+        if self.arp.running:
+            self.arp.stop()
+            for note in self.arp.notes:
+                self.keyboard_display[note - self.baseNote] = '-'
+            self.arp.set_notes(())
+        else:
+            # notes played by hand are not part of the arpeggio
+            for key in list(self.active_notes):
+                self.note_off(key)
+            self.releases.clear()
+            self.arp.start()
+        self.settings.set_arpeggiator(self.arp.running)
+
+    def change_arp(self, mode: int = 0, rate: int = 0, octaves: int = 0, bpm: float = 0.0) -> None:
+        """steps through the modes, rates and octave spans, bpm only for the internal tempo"""
+        arp = self.arp
+        arp.mode = modes[(modes.index(arp.mode) + mode) % len(modes)]
+        arp.rate = rate_names[max(0, min(len(rate_names) - 1, rate_names.index(arp.rate) + rate))]
+        arp.octaves = (arp.octaves - 1 + octaves) % 4 + 1
+        if bpm and isinstance(arp.tempo, FixedTempo):
+            arp.tempo.set_bpm(arp.tempo.bpm + bpm)
+        arp.changed()
+
+    def toggle_sustain(self) -> None:
+        self.releases.sustain = not self.releases.sustain
+
     def send_note(self, k: str):
         key_note_map = {
             'a': 0, 'w': 1, 's': 2, 'e': 3, 'd': 4, 'f': 5, 't': 6, 'g': 7,
@@ -116,14 +252,33 @@ class App:
             self.handle_note_on(h)
 
     def update_keyboard_display(self) -> None:
+        try:
+            self.draw_keyboard()
+        except curses.error:
+            # a terminal too small for all of it shows what fits
+            pass
+        self.screen.refresh()
+
+    def draw_keyboard(self) -> None:
         keyboard_str = ''.join(self.keyboard_display[self.octave*12:(self.octave+2)*12])
         self.screen.addstr(2, 1, f"Keyboard: {keyboard_str}")
         self.screen.addstr(3, 1, f"Octave: {self.octave}-{self.octave+1}")
         self.screen.addstr(4, 1, f"Velocity: {self.velocity}")
         self.screen.addstr(5, 1, f"Modwheel: {self.modwheel_value}")
         self.screen.addstr(6, 1, f"Pitchbend: {self.pitchbend_value}")
-        self.screen.addstr(8, 1, self.legend)
-        self.screen.refresh()
+        sustain = "on" if self.releases.sustain else "off"
+        self.screen.addstr(7, 1, f"Gate: {self.releases.gate * 1000:.0f} ms  Sustain: {sustain}    ")
+        arp = self.arp
+        if arp is not None:
+            state = "on" if arp.running else "off"
+            self.screen.addstr(8, 1, f"Arp: {state} {arp.mode} {arp.rate} x{arp.octaves} gate {arp.gate:.0%} "
+                                     f"{arp.tempo.describe()}        ")
+        # the legend stops above the last row, where the keys are echoed
+        height = self.screen.getmaxyx()[0]
+        for row, line in enumerate(self.legend.split("\n"), 9):
+            if row >= height - 1:
+                break
+            self.screen.addstr(row, 0, line)
 
     def send_modwheel(self, key: int) -> None:
         value = (key - 3) * 127 // 5
@@ -146,14 +301,20 @@ class App:
         self.update_keyboard_display()
 
     def panic(self) -> None:
+        self.arp.set_notes(())
         for note in range(128):
             self.midi_out.send_message([0x80, note, 0])
         self.active_notes.clear()
+        self.releases.clear()
         self.keyboard_display = [' '] * 88
         self.update_keyboard_display()
 
     def interpret_key(self, key: str) -> bool:
-        self.screen.addstr(self.rows + 1, 0, f'{key}          ')
+        try:
+            self.screen.addstr(self.rows + 1, 0, f'{key}          ')
+        except curses.error:
+            # no row left for the echo, the key still counts
+            pass
         self.screen.refresh()
         match key:
             case 'KEY_UP':
@@ -168,8 +329,30 @@ class App:
                 self.send_modwheel(int(key))
             case 'c' | 'C':
                 self.velocity = max(1, self.velocity - 5)
+                self.arp.velocity = self.velocity
             case 'v' | 'V':
                 self.velocity = min(127, self.velocity + 5)
+                self.arp.velocity = self.velocity
+            case '[':
+                self.set_gate(0.8)
+            case ']':
+                self.set_gate(1.25)
+            case '\t':
+                self.toggle_sustain()
+            case 'z' | 'Z':
+                self.toggle_arpeggiator()
+            case 'x' | 'X':
+                self.change_arp(mode=1)
+            case 'b' | 'B':
+                self.change_arp(rate=-1)
+            case 'n' | 'N':
+                self.change_arp(rate=1)
+            case 'm' | 'M':
+                self.change_arp(octaves=1)
+            case ',':
+                self.change_arp(bpm=-5)
+            case '.':
+                self.change_arp(bpm=5)
             case ' ':
                 self.panic()
             case '\x1b':
@@ -180,6 +363,12 @@ class App:
         return True
 
     def clean_exit(self) -> None:
+        if self.arp is not None:
+            self.arp.stop()
+            self.arp.tempo.close()
+        if self.ui_loop is not None:
+            self.ui_loop.close()
+            self.ui_loop = None
         curses.nocbreak()
         self.screen.keypad(False)
         curses.echo()
@@ -194,34 +383,43 @@ class App:
             self.settings.set_current_working_directory(os.getcwd())
 
     def run(self) -> bool:
-        self.midi_out = rtmidi.MidiOut()
-        self.midi_out.open_virtual_port("midi-curse")
+        self.settings = Settings()
+        settings = self.settings
+        self.midi_out = openOutput(settings.get_output())
+        self.releases = NoteReleases(settings.get_gate(), settings.get_sustain())
+        options = settings.get_arp_options()
+        self.arp = Arpeggiator(self.midi_out, open_tempo(options.get("sync", "internal"), options.get("bpm", 120.0)),
+                               options.get("mode", "up"), options.get("rate", "1/16"), options.get("octaves", 1),
+                               options.get("gate", 0.5), self.velocity)
+        if settings.get_arpeggiator():
+            self.arp.start()
+        self.ui_loop = UiLoop(self.screen)
         self.update_keyboard_display()
         while True:
-            self.tick_auto_notes_off()
+            self.ui_loop.wait(self.notes_off_timeout())
+            running = True
             try:
-                time.sleep(0.001)
-                key = self.screen.getkey()
-                if key != -1:
+                self.tick_auto_notes_off()
+                for key in self.ui_loop.keys():
                     match key:
                         case 'KEY_RESIZE':
-                            self.clean_exit()
-                            return True
+                            self.reset_screen()
+                            self.update_keyboard_display()
                         case _:
-                            if not self.interpret_key(key):
-                                self.clean_exit()
-                                print("back to shell...")
-                                return False
-                else:
-                    self.reset_pitchbend()
-            except Exception:
-                time.sleep(0.001)
+                            running = self.interpret_key(key)
+                    if not running:
+                        break
+            except curses.error:
+                # drawing outside a too small terminal, ignored as before
+                pass
+            if not running:
+                self.clean_exit()
+                print("back to shell...")
+                return False
 
 def main(curses_window) -> None:
     app = App()
-    while app.run():
-        time.sleep(0.01)
-        app = App()
+    app.run()
 
 if __name__ == '__main__':
     wrapper(main)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+
+"""
+Arpeggiator of the keyboard player.
+
+    arp = Arpeggiator(midi_out, FixedTempo(120), mode="up", rate="1/16")
+    arp.start()
+    arp.set_notes((48, 52, 55))
+
+A thread plays the held notes one step at a time. Step n of a rate with k
+steps per quarter note is placed at beat n / k of the tempo source, and its
+time is worked out from the source for every step instead of adding up
+step lengths, so nothing drifts at any rate and the thread only wakes up
+for note ons and note offs. Which note a step plays also follows from n, a
+late wake-up never shifts the pattern.
+
+Tempo sources keep an anchor (clock time, quarter notes, bpm) that is
+replaced as a whole, None while there is nothing to follow:
+    FixedTempo(bpm)        free running on the monotonic clock
+    SongTempo(socket)      the song playing in curses-smf-player, from the
+                           status events of its control socket
+    MidiClockTempo(spec)   24 clocks a quarter note from rtmidi:PORTNAME (a
+                           virtual input port) or file:/dev/midi1, with
+                           start, stop and continue
+open_tempo() makes one from the "sync" setting: internal, song[:SOCKET] or
+clock:SPEC.
+"""
+
+import json
+import math
+import os
+import random
+import socket
+import time
+from collections import deque
+from threading import Thread, Event
+from typing import List, Optional
+
+modes: List[str] = ["up", "down", "random", "played"]
+# steps per quarter note
+rates = {"1/4": 1, "1/8": 2, "1/8T": 3, "1/16": 4, "1/16T": 6, "1/32": 8}
+rate_names: List[str] = list(rates)
+
+
+class FixedTempo:
+    def __init__(self, bpm: float = 120.0):
+        self.now = time.monotonic
+        self.on_change = None
+        self.anchor = (self.now(), 0.0, bpm)
+
+    @property
+    def bpm(self) -> float:
+        return self.anchor[2]
+
+    def set_bpm(self, bpm: float) -> None:
+        # the beat position carries on, only what follows moves
+        now = self.now()
+        at, beat, old = self.anchor
+        self.anchor = (now, beat + (now - at) * old / 60, max(20.0, min(300.0, bpm)))
+        if self.on_change is not None:
+            self.on_change()
+
+    def describe(self) -> str:
+        return f"{self.bpm:.0f} bpm"
+
+    def close(self) -> None:
+        pass
+
+
+class SongTempo:
+    """the player stamps every status with time.time(), so that is the clock here"""
+    def __init__(self, path: str):
+        self.path = path
+        self.now = time.time
+        self.on_change = None
+        self.anchor = None
+        self.running = True
+        self.sock = None
+        Thread(name='song tempo', target=self.follow, daemon=True).start()
+
+    def follow(self) -> None:
+        while self.running:
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.path)
+                self.sock.sendall(b'{"cmd": "subscribe"}\n')
+                with self.sock.makefile('rb') as f:
+                    for line in f:
+                        message = json.loads(line)
+                        if message.get("event") == "status":
+                            self.update(message["status"])
+            except (OSError, ValueError):
+                pass
+            self.set_anchor(None)
+            if self.sock is not None:
+                self.sock.close()
+            # no player (yet), look again in a second
+            time.sleep(1.0)
+
+    def update(self, status: Optional[dict]) -> None:
+        if not status or not status.get("playing") or "barQuarters" not in status:
+            self.set_anchor(None)
+            return
+        numerator, denominator = status["signature"]
+        # bars before this one at its own meter, the grid still starts on every bar
+        quarters = (status["bar"] - 1) * numerator * 4 / denominator + status["barQuarters"]
+        self.set_anchor((status["clock"], quarters, 60000000 / status["tempo"] * status["tempoFactor"]))
+
+    def set_anchor(self, anchor: Optional[tuple]) -> None:
+        previous = self.anchor
+        self.anchor = anchor
+        # a tempo change (the first status still has the tempo before the song's own) moves the next step
+        moved = anchor is not None and (previous is None or previous[2] != anchor[2])
+        if moved and self.on_change is not None:
+            self.on_change()
+
+    def describe(self) -> str:
+        if self.anchor is None:
+            return "song (waiting)"
+        return f"song {self.anchor[2]:.0f} bpm"
+
+    def close(self) -> None:
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+
+
+class MidiClockTempo:
+    def __init__(self, spec: str):
+        self.now = time.monotonic
+        self.on_change = None
+        self.anchor = None
+        self.ticks = 0
+        self.running = True
+        # the clocks of the last quarter note, their average evens out the jitter of single ones
+        self.times = deque(maxlen=25)
+        self.midi_in = None
+        self.fd = None
+        kind, _, argument = spec.partition(":")
+        if kind == "rtmidi":
+            import rtmidi
+            self.midi_in = rtmidi.MidiIn()
+            self.midi_in.ignore_types(sysex=True, timing=False, active_sense=True)
+            self.midi_in.open_virtual_port(argument or "midi-curse-clock")
+            self.midi_in.set_callback(lambda event, data: self.receive(event[0][0], self.now()))
+        elif kind == "file" and argument:
+            self.fd = os.open(argument, os.O_RDONLY)
+            Thread(name='midi clock', target=self.read, daemon=True).start()
+        else:
+            raise ValueError(f"unknown midi clock input: {spec}")
+
+    def read(self) -> None:
+        """real time bytes may sit anywhere in a raw stream, everything else is skipped"""
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, 256)
+            except OSError:
+                break
+            if not data:
+                # end of a plain file
+                break
+            now = self.now()
+            for status in data:
+                if status >= 0xF8:
+                    self.receive(status, now)
+
+    def receive(self, status: int, at: float) -> None:
+        if status == 0xFA:
+            self.ticks = 0
+            self.times.clear()
+            self.running = True
+        elif status == 0xFB:
+            self.times.clear()
+            self.running = True
+        elif status == 0xFC:
+            self.running = False
+            self.anchor = None
+        elif status == 0xF8 and self.running:
+            times = self.times
+            times.append(at)
+            self.ticks += 1
+            if len(times) < 3:
+                return
+            started = self.anchor is None
+            n = len(times)
+            interval = (times[-1] - times[0]) / (n - 1)
+            # the line through the recent clocks, anchored at their middle
+            self.anchor = (sum(times) / n, (self.ticks - 1 - (n - 1) / 2) / 24, 60 / (interval * 24))
+            if started and self.on_change is not None:
+                self.on_change()
+
+    def describe(self) -> str:
+        if self.anchor is None:
+            return "clock (waiting)"
+        return f"clock {self.anchor[2]:.0f} bpm"
+
+    def close(self) -> None:
+        if self.midi_in is not None:
+            self.midi_in.close_port()
+            self.midi_in = None
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            os.close(fd)
+
+
+def open_tempo(sync: str = "internal", bpm: float = 120.0):
+    kind, _, argument = (sync or "internal").partition(":")
+    if kind == "internal":
+        return FixedTempo(bpm)
+    if kind == "song":
+        return SongTempo(os.path.expanduser(argument or "~/.cursedsmfplay/control.sock"))
+    if kind == "clock":
+        return MidiClockTempo(argument)
+    raise ValueError(f"unknown arpeggiator sync: {sync}")
+
+
+class Arpeggiator:
+    def __init__(self, midi_out, tempo, mode: str = "up", rate: str = "1/16", octaves: int = 1, gate: float = 0.5,
+                 velocity: int = 100, channel: int = 0):
+        if mode not in modes:
+            raise ValueError(f"unknown arpeggiator mode: {mode}")
+        if rate not in rates:
+            raise ValueError(f"unknown arpeggiator rate: {rate}")
+        self.midi_out = midi_out
+        self.tempo = tempo
+        self.mode: str = mode
+        self.rate: str = rate
+        self.octaves: int = octaves
+        self.gate: float = gate
+        self.velocity: int = velocity
+        self.channel: int = channel
+        # in the order they were played, replaced as a whole by set_notes()
+        self.notes: tuple = ()
+        self.random = random.Random()
+        self.wake = Event()
+        tempo.on_change = self.wake.set
+        self.running = False
+        self.thread: Optional[Thread] = None
+
+    def set_notes(self, notes) -> None:
+        self.notes = tuple(notes)
+        self.wake.set()
+
+    def changed(self) -> None:
+        """mode, rate, octaves or gate were set, the next step is placed again"""
+        self.wake.set()
+
+    def pattern(self, notes: tuple) -> list:
+        ordered = list(notes) if self.mode == "played" else sorted(notes)
+        span = [note + 12 * octave for octave in range(self.octaves) for note in ordered if note + 12 * octave < 128]
+        if self.mode == "down":
+            span.reverse()
+        return span
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(name='arpeggiator', target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+
+    def sleep_until(self, deadline: float) -> bool:
+        """False if woken early by a change or stop()"""
+        delay = deadline - self.tempo.now()
+        if delay <= 0:
+            return True
+        if self.wake.wait(delay):
+            self.wake.clear()
+            return False
+        return True
+
+    def next_step(self, anchor: tuple, steps: int, last: Optional[float]) -> int:
+        """the first step still to come, last is the beat of the step played before"""
+        at, beat, bpm = anchor
+        step = math.floor((beat + (self.tempo.now() - at) * bpm / 60) * steps) + 1
+        if last is not None:
+            after = math.floor(last * steps + 1e-6) + 1
+            if abs(step - after) <= 1:
+                # woken a little early for the last step or a little late for the next: none twice, none skipped
+                step = after
+        return step
+
+    def run(self) -> None:
+        last = None
+        while self.running:
+            anchor = self.tempo.anchor
+            if not self.notes or anchor is None:
+                # nothing to play or to follow, the next set_notes() or tempo start wakes us up
+                last = None
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            at, beat, bpm = anchor
+            steps = rates[self.rate]
+            step = self.next_step(anchor, steps, last)
+            deadline = at + (step / steps - beat) * 60 / bpm
+            if not self.sleep_until(deadline):
+                continue
+            pattern = self.pattern(self.notes)
+            if not pattern:
+                continue
+            if self.mode == "random":
+                note = self.random.choice(pattern)
+            else:
+                note = pattern[step % len(pattern)]
+            self.midi_out.send_message([0x90 | self.channel, note, self.velocity])
+            last = step / steps
+            release = deadline + min(1.0, self.gate) * 60 / bpm / steps
+            while self.running and not self.sleep_until(release):
+                # changes wait for the next step, this note keeps its length
+                pass
+            self.midi_out.send_message([0x80 | self.channel, note, 0])
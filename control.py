@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""
+Control socket of the curses player.
+
+Clients connect to a Unix domain socket and send one JSON object per line:
+    {"cmd": "play", "path": "/songs/a.mid"}
+    {"cmd": "stop"}  {"cmd": "seek", "seconds": 30}  {"cmd": "transpose", "value": -2}
+    {"cmd": "tempo", "factor": 1.05}  {"cmd": "loop", "value": true}
+    {"cmd": "load", "path": ...}  {"cmd": "status"}  {"cmd": "subscribe"}
+    {"cmd": "layer", "path": ..., "transpose": -12, "mute": "10", "port": "rtmidi:bass"}
+    {"cmd": "layer", "id": 2, "mute": ""}  {"cmd": "layer", "id": 2, "remove": true}  {"cmd": "layers"}
+Every command is answered with one line, {"ok": true, ...} or
+{"ok": false, "error": ...} whatever went wrong; subscribers also get
+{"event": "status", ...} lines while something plays.
+All sockets are non-blocking and live in one selector whose own file
+descriptor is waited on by the UI loop, so commands are handled on the UI
+thread through the same methods as keys, never by the playing thread.
+"""
+
+import json
+import math
+import os
+import selectors
+import socket
+
+maxLine = 65536
+
+trueWords = ('1', 'on', 'yes', 'true')
+falseWords = ('0', 'off', 'no', 'false')
+
+
+def numberValue(value) -> float:
+    """a number of a command, inf and nan are refused"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value!r}")
+    return number
+
+
+def flagValue(value) -> bool:
+    """true or false, 0 or 1, or one of the words smfctl.py takes for them"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    word = str(value).lower()
+    if word in trueWords:
+        return True
+    if word in falseWords:
+        return False
+    raise ValueError(f"not true or false: {value!r}")
+
+
+class ControlClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b""
+        self.outbuf = b""
+        self.subscribed = False
+
+
+def listenSocket(path: str) -> socket.socket:
+    """binds path, a stale socket file of a dead player is replaced"""
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            probe.close()
+            raise OSError(f"{path} is used by another player")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o600)
+    sock.listen(8)
+    sock.setblocking(False)
+    return sock
+
+
+class ControlServer:
+    def __init__(self, path: str, handler):
+        """handler(command: dict) returns the reply dict, what it raises is answered as an error"""
+        self.handler = handler
+        try:
+            self.listener = listenSocket(path)
+        except OSError:
+            # another player owns the default name
+            base, ext = os.path.splitext(path)
+            path = f"{base}-{os.getpid()}{ext}"
+            self.listener = listenSocket(path)
+        self.path = path
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.clients = []
+
+    def fileno(self):
+        return self.selector.fileno()
+
+    def poll(self):
+        """handles whatever is ready, never blocks"""
+        for key, mask in self.selector.select(0):
+            if key.data is None:
+                self.accept()
+                continue
+            client = key.data
+            if mask & selectors.EVENT_READ:
+                self.receive(client)
+            if mask & selectors.EVENT_WRITE and client in self.clients:
+                self.flush(client)
+
+    def accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = ControlClient(sock)
+        self.clients.append(client)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def receive(self, client: ControlClient):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(client)
+            return
+        client.inbuf += data
+        while b"\n" in client.inbuf:
+            line, client.inbuf = client.inbuf.split(b"\n", 1)
+            if line.strip():
+                self.send(client, self.execute(client, line))
+        if len(client.inbuf) > maxLine:
+            self.drop(client)
+
+    def execute(self, client: ControlClient, line: bytes) -> dict:
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise ValueError("a command is a JSON object")
+            if command.get("cmd") == "subscribe":
+                client.subscribed = True
+                return {"ok": True}
+            reply = self.handler(command)
+        except KeyError as e:
+            return {"ok": False, "error": f"missing {e}"}
+        except Exception as e:
+            # a bad command must not take the player down
+            return {"ok": False, "error": str(e) or type(e).__name__}
+        reply["ok"] = True
+        return reply
+
+    def send(self, client: ControlClient, message: dict):
+        client.outbuf += json.dumps(message).encode() + b"\n"
+        self.flush(client)
+
+    def flush(self, client: ControlClient):
+        try:
+            sent = client.sock.send(client.outbuf)
+            client.outbuf = client.outbuf[sent:]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.drop(client)
+            return
+        if len(client.outbuf) > 16 * maxLine:
+            # a subscriber that does not read
+            self.drop(client)
+            return
+        events = selectors.EVENT_READ
+        if client.outbuf:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(client.sock, events, client)
+
+    def broadcast(self, message: dict):
+        for client in list(self.clients):
+            if client.subscribed:
+                self.send(client, message)
+
+    def drop(self, client: ControlClient):
+        if client in self.clients:
+            self.clients.remove(client)
+            self.selector.unregister(client.sock)
+            client.sock.close()
+
+    def close(self):
+        for client in list(self.clients):
+            self.drop(client)
+        self.selector.close()
+        self.listener.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -6,8 +6,8 @@ from curses import wrapper
 import json
 import os
 
-import rtmidi
 from pathlib import Path
+from midiout import openOutput, defaultOutput
 
 import time
 
@@ -28,6 +28,9 @@ class Settings:
             self.json_data = {"home": self.home, "lastworkingdirectory": os.getcwd(), "arpeggiator": False}
             self.create_settings_file()
 
+    def get_output(self):
+        return self.json_data.get("output", defaultOutput)
+
     def set_current_working_directory(self, path: str):
         self.json_data["lastworkingdirectory"] = path
         self.create_settings_file()
@@ -139,8 +142,7 @@ class App:
 
     def run(self) -> bool:
 
-        self.midi_out = rtmidi.MidiOut()
-        self.midi_out.open_virtual_port("midi-curse")
+        self.midi_out = openOutput(Settings().get_output())
         # index = 0
         while True:
             self.tick_auto_notes_off()
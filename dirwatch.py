@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+Watch a directory for midi files being added, removed or renamed.
+
+On Linux the inotify syscalls are used through ctypes, everywhere else (or if
+inotify can't be initialised) the directory is polled. Both watchers return
+the same delta tuples from poll():
+    ('add', name, kind)
+    ('remove', name, kind)
+    ('rename', oldname, newname, kind)
+    ('modify', name, kind)
+kind is 'dir' or 'file' like in MidifileSet.
+"""
+
+import ctypes
+import os
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+eventHeader = struct.Struct("iIII")
+
+
+def kindOf(isdir: bool) -> str:
+    if isdir:
+        return 'dir'
+    return 'file'
+
+
+class InotifyWatcher:
+    def __init__(self):
+        # the symbols the interpreter is linked with include libc, find_library() would cost a subprocess
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd = -1
+        self.path = None
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def watch(self, path: str):
+        if self.wd >= 0:
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+        self.drain()
+        self.path = path
+        self.wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if self.wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+
+    def drain(self) -> bytes:
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def poll(self) -> list:
+        data = self.drain()
+        deltas = []
+        movedFrom = {}
+        offset = 0
+        while offset + eventHeader.size <= len(data):
+            wd, mask, cookie, length = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += length
+            if wd != self.wd:
+                continue
+            kind = kindOf(mask & IN_ISDIR)
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                deltas.append(('gone', self.path, 'dir'))
+            elif mask & IN_MOVED_FROM:
+                movedFrom[cookie] = len(deltas)
+                deltas.append(('remove', name, kind))
+            elif mask & IN_MOVED_TO:
+                if cookie in movedFrom:
+                    index = movedFrom.pop(cookie)
+                    deltas[index] = ('rename', deltas[index][1], name, kind)
+                else:
+                    deltas.append(('add', name, kind))
+            elif mask & IN_CREATE:
+                deltas.append(('add', name, kind))
+            elif mask & IN_DELETE:
+                deltas.append(('remove', name, kind))
+            elif mask & IN_CLOSE_WRITE:
+                deltas.append(('modify', name, kind))
+        return deltas
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.path = None
+        self.snapshot = {}
+        self.nextPoll = 0
+
+    def fileno(self):
+        return None
+
+    def listing(self) -> dict:
+        entries = {}
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                        entries[entry.name] = (kindOf(entry.is_dir()), st.st_mtime_ns, st.st_ino)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return entries
+
+    def watch(self, path: str):
+        self.path = path
+        self.snapshot = self.listing()
+        self.nextPoll = time.monotonic() + self.interval
+
+    def poll(self) -> list:
+        now = time.monotonic()
+        if self.path is None or now < self.nextPoll:
+            return []
+        self.nextPoll = now + self.interval
+        current = self.listing()
+        removed = {name: v for name, v in self.snapshot.items() if name not in current}
+        added = {name: v for name, v in current.items() if name not in self.snapshot}
+        deltas = []
+        removedByInode = {v[2]: name for name, v in removed.items()}
+        for name, (kind, mtime, inode) in added.items():
+            if inode in removedByInode:
+                oldname = removedByInode.pop(inode)
+                del removed[oldname]
+                deltas.append(('rename', oldname, name, kind))
+            else:
+                deltas.append(('add', name, kind))
+        for name, (kind, mtime, inode) in removed.items():
+            deltas.append(('remove', name, kind))
+        for name, (kind, mtime, inode) in current.items():
+            if name in self.snapshot and self.snapshot[name][1] != mtime:
+                deltas.append(('modify', name, kind))
+        self.snapshot = current
+        return deltas
+
+    def close(self):
+        self.path = None
+
+
+def createWatcher(pollInterval: float = 1.0):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(pollInterval)
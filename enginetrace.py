@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Timeline of the engine for chrome://tracing and https://ui.perfetto.dev
+
+    trace = EngineTrace("/tmp/player-trace.json")
+    ring = trace.ring("player")
+    start = ring.now()
+    ...
+    ring.span(SPAN_SEND, start, lateness, events)
+    trace.save()
+
+Every thread records into its own ring of preallocated arrays: a span costs
+a clock read and five array stores, nothing is allocated, formatted or
+locked while playing, so it can stay on for a whole rehearsal. When a ring
+is full the oldest spans are overwritten. save() (called when the player
+stops) copies the rings and writes them as Chrome trace event JSON from a
+thread, replacing the previous file, close() writes the last one in place.
+Lateness of the wake-ups is also written as a counter track.
+"""
+
+import json
+import os
+import time
+from array import array
+from itertools import islice
+from threading import Thread, Lock
+
+SPAN_WAIT = 0    # sleeping until a deadline, a: lateness of the wake-up (s)
+SPAN_SEND = 1    # one group of events sent, a: lateness (s), b: number of events
+SPAN_MTC = 2     # one quarter frame, a: lateness (s), b: quarter frames since start
+SPAN_STATUS = 3  # status update handed to the UI
+SPAN_REPAINT = 4 # UI frame drawn
+
+spanNames = {SPAN_WAIT: "wait", SPAN_SEND: "send", SPAN_MTC: "mtc", SPAN_STATUS: "status", SPAN_REPAINT: "repaint"}
+# names of a and b in the args of the trace events
+spanArgs = {SPAN_WAIT: ("late_ms", None), SPAN_SEND: ("late_ms", "events"), SPAN_MTC: ("late_ms", "frame"),
+            SPAN_STATUS: (None, None), SPAN_REPAINT: (None, None)}
+# spans formatted between two chances for the playing thread to run, about half a millisecond
+chunkSpans = 200
+
+
+class SpanRing:
+    """spans of one thread, oldest overwritten first"""
+    def __init__(self, name: str, capacity: int, now):
+        self.name = name
+        self.capacity = capacity
+        self.now = now
+        # bytes() touches every page now instead of on the first lap
+        self.starts = array('d', bytes(8 * capacity))
+        self.durations = array('f', bytes(4 * capacity))
+        self.a = array('f', bytes(4 * capacity))
+        self.b = array('f', bytes(4 * capacity))
+        self.kinds = array('B', bytes(capacity))
+        self.next = 0
+        self.count = 0
+
+    def span(self, kind: int, start: float, a: float = 0.0, b: float = 0.0):
+        """a span from start (a now() value) to now"""
+        i = self.next
+        self.starts[i] = start
+        self.durations[i] = self.now() - start
+        self.a[i] = a
+        self.b[i] = b
+        self.kinds[i] = kind
+        self.count += 1
+        self.next = 0 if i + 1 == self.capacity else i + 1
+
+    def snapshot(self) -> tuple:
+        """copies of the columns, oldest span first"""
+        columns = (self.starts, self.durations, self.kinds, self.a, self.b)
+        i = self.next
+        if self.count <= self.capacity:
+            return tuple(column[:i] for column in columns)
+        return tuple(column[i:] + column[:i] for column in columns)
+
+
+class EngineTrace:
+    def __init__(self, path: str = "/tmp/player-trace.json", capacity: int = 1 << 20, now=time.time):
+        self.path = path
+        self.capacity = capacity
+        self.now = now
+        self.rings = []
+        self.lock = Lock()
+        self.writer = None
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'EngineTrace':
+        """settings file form: {"path": "/tmp/player-trace.json", "capacity": 1048576}"""
+        return cls(os.path.expanduser(data.get("path", "/tmp/player-trace.json")), data.get("capacity", 1 << 20))
+
+    def ring(self, name: str) -> SpanRing:
+        """a ring for one thread, each thread must use its own"""
+        ring = SpanRing(name, self.capacity, self.now)
+        with self.lock:
+            self.rings.append(ring)
+        return ring
+
+    def snapshot(self) -> list:
+        with self.lock:
+            rings = list(self.rings)
+        return [(ring.name, ring.count, ring.snapshot()) for ring in rings]
+
+    def events(self, snapshot: list, first: float):
+        """trace events as JSON text, times in microseconds from first"""
+        for tid, (name, count, columns) in enumerate(snapshot, 1):
+            yield json.dumps({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+            for start, duration, kind, a, b in zip(*columns):
+                ts = (start - first) * 1e6
+                names = spanArgs.get(kind, (None, None))
+                args = []
+                if names[0] is not None:
+                    args.append(f'"{names[0]}":{a * 1000:.3f}')
+                if names[1] is not None:
+                    args.append(f'"{names[1]}":{b:.0f}')
+                yield (f'{{"name":"{spanNames.get(kind, kind)}","cat":"{name}","ph":"X","ts":{ts:.3f},'
+                       f'"dur":{duration * 1e6:.3f},"pid":1,"tid":{tid},"args":{{{",".join(args)}}}}}')
+                if kind == SPAN_WAIT:
+                    yield f'{{"name":"lateness","ph":"C","ts":{ts + duration * 1e6:.3f},"pid":1,"args":{{"ms":{a * 1000:.3f}}}}}'
+
+    def write(self, snapshot: list = None, path: str = None):
+        """writes the spans (a snapshot() or the rings now), readers never see a half written file"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        path = path or self.path
+        first = min((columns[0][0] for name, count, columns in snapshot if columns[0]), default=0.0)
+        other = {"start": first, "spans": {name: count for name, count, columns in snapshot}}
+        temp = f"{path}.tmp"
+        try:
+            with open(temp, "w") as f:
+                f.write('{"displayTimeUnit":"ms","otherData":' + json.dumps(other) + ',"traceEvents":[\n')
+                events = self.events(snapshot, first)
+                separator = ""
+                while True:
+                    chunk = list(islice(events, chunkSpans))
+                    if not chunk:
+                        break
+                    f.write(separator + ",\n".join(chunk))
+                    separator = ",\n"
+                    # a song playing meanwhile gets the interpreter back within a chunk
+                    time.sleep(0)
+                f.write("\n]}\n")
+            os.replace(temp, path)
+        except OSError:
+            pass
+
+    def save(self):
+        """writes the spans so far from a thread, the caller is not held up"""
+        self.writer = Thread(name='trace', target=self.writeAfter, args=(self.writer, self.snapshot()), daemon=True)
+        self.writer.start()
+
+    def writeAfter(self, previous: Thread, snapshot: list):
+        if previous is not None:
+            previous.join()
+        self.write(snapshot)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        self.write()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Lyrics pane for karaoke (.kar) and lyric meta events.
+
+The syllables are found by binary search of the playback position in the
+song's smflyrics, the pane is only redrawn when the syllable changes.
+"""
+
+import curses
+
+
+class LyricsPane:
+    def __init__(self, wh):
+        self.wh = wh
+        self.rows = 0
+        self.cols = 0
+        self.shown = None
+
+    def resize(self, rows: int, cols: int, y: int):
+        self.rows = rows
+        self.cols = cols
+        self.wh.resize(rows, cols)
+        self.wh.mvwin(y, 0)
+        self.shown = None
+
+    def nextChange(self, player):
+        """seconds until the next syllable, None if nothing is sung"""
+        song = player.song
+        if song is None or not player.playing or not len(song.lyrics):
+            return None
+        index = song.lyrics.syllableAt(player.songSeconds())
+        if index + 1 >= len(song.lyrics):
+            return None
+        return max(0.0, song.lyrics.times[index + 1] - player.songSeconds())
+
+    def render(self, player):
+        song = player.song
+        if song is None or not len(song.lyrics):
+            if self.shown is not None:
+                self.wh.erase()
+                self.wh.noutrefresh()
+                curses.doupdate()
+            self.shown = None
+            return
+        lyrics = song.lyrics
+        index = lyrics.syllableAt(player.songSeconds())
+        if (song, index) == self.shown:
+            return
+        self.shown = (song, index)
+        width = self.cols - 1
+        if index < 0:
+            line = 0
+            sung = ""
+        else:
+            line = lyrics.lineOf[index]
+            sung = lyrics.lineText(line, index + 1)
+        self.wh.erase()
+        self.wh.addnstr(0, 1, sung, width - 1, curses.color_pair(2) | curses.A_BOLD)
+        rest = lyrics.lineText(line)[len(sung):]
+        if len(sung) < width - 1:
+            self.wh.addnstr(0, 1 + len(sung), rest, width - 1 - len(sung))
+        if self.rows > 1 and line + 1 < len(lyrics.lines):
+            self.wh.addnstr(1, 1, lyrics.lineText(line + 1), width - 1, curses.A_DIM)
+        self.wh.noutrefresh()
+        curses.doupdate()
@@ -6,45 +6,160 @@ from curses import wrapper
 import json
 import os
 import re
-import rtmidi
-from pathlib import Path
+from bisect import bisect_left
 from threading import Thread, Event
 import time
-from mido import MidiFile
-from smfplayout import smfplayout
+from midiout import openOutput, defaultOutput
+from realtime import RealtimeOptions, describe
+from dirwatch import createWatcher
+from uiloop import UiLoop
+from pianoroll import PianoRoll
+from lyrics import LyricsPane
+from playerlog import PlayerLog
+from enginetrace import EngineTrace, SPAN_REPAINT
 
-flog = open("/tmp/player.log", "w")
+
+# what the profile control command may set, see profiles.py
+profileFields = {"transpose", "tempo", "loop", "remap", "mute"}
+
+# seconds after startup the library index is built, it would compete with the first song for the interpreter
+indexDelay = 1.0
 
 class MidifileSet:
     def __init__(self):
         self.cwd = os.getcwd()
         self.midifiles = list()
+        self.regex = re.compile(r".*\.(midi?|kar)$")
+        self.stale = set()
+        self.watcher = createWatcher()
+        self.scanned = None
+        self.loading = False
 
     def changedir(self, newdir:str):
         os.chdir(newdir)
 
-    def scanDir(self):
-        self.cwd = os.getcwd()
-        self.midifiles = list()
-        regex = re.compile(".*\.(midi?|kar)$")
-        sdir = os.listdir(self.cwd)
+    def listDir(self, path: str) -> list:
+        midifiles = list()
+        sdir = os.listdir(path)
         sdir.sort()
         for file in sdir:
-            if os.path.isdir(file):
+            if os.path.isdir(os.path.join(path, file)):
                 if file[0] != '.':
-                    self.midifiles.append([file,'dir'])
+                    midifiles.append([file,'dir'])
         for file in sdir:
-            if os.path.isfile(file):
-                if regex.match(file):
-                    self.midifiles.append([file, 'file'])
+            if os.path.isfile(os.path.join(path, file)):
+                if self.regex.match(file):
+                    midifiles.append([file, 'file'])
+        return midifiles
+
+    def setListing(self, cwd: str, midifiles: list):
+        self.cwd = cwd
+        self.midifiles = midifiles
+        try:
+            self.watcher.watch(self.cwd)
+        except OSError:
+            pass
+
+    def scanDir(self):
+        cwd = os.getcwd()
+        self.setListing(cwd, self.listDir(cwd))
+
+    def scanInBackground(self, done):
+        """lists the current directory in a thread that calls done() when takeScan() has the result"""
+        self.cwd = cwd = os.getcwd()
+        self.loading = True
+
+        def scan():
+            self.scanned = (cwd, self.listDir(cwd))
+            done()
+        Thread(name='scandir', target=scan, daemon=True).start()
+
+    def takeScan(self) -> bool:
+        """installs a finished background scan, False if there is none or the directory has changed since"""
+        scanned, self.scanned = self.scanned, None
+        if scanned is None:
+            return False
+        self.loading = False
+        if scanned[0] != self.cwd:
+            return False
+        self.setListing(*scanned)
+        return True
 
     def fetch(self):
         return self.midifiles
 
+    def accepts(self, name: str, kind: str) -> bool:
+        if kind == 'dir':
+            return name[0] != '.'
+        return self.regex.match(name) is not None
+
+    def indexOf(self, name: str, kind: str):
+        for index, entry in enumerate(self.midifiles):
+            if entry[0] == name and entry[1] == kind:
+                return index
+        return None
+
+    def insertEntry(self, name: str, kind: str):
+        if not self.accepts(name, kind) or self.indexOf(name, kind) is not None:
+            return None
+        keys = [(e[1] != 'dir', e[0]) for e in self.midifiles]
+        index = bisect_left(keys, (kind != 'dir', name))
+        self.midifiles.insert(index, [name, kind])
+        return index
+
+    def removeEntry(self, name: str, kind: str):
+        index = self.indexOf(name, kind)
+        if index is not None:
+            del self.midifiles[index]
+        return index
+
+    def markStale(self, name: str):
+        path = os.path.join(self.cwd, name)
+        self.stale.add(path)
+
+    def applyDelta(self, delta: tuple):
+        """returns the first row that changed or None"""
+        action, kind = delta[0], delta[-1]
+        if action == 'add':
+            self.markStale(delta[1])
+            return self.insertEntry(delta[1], kind)
+        if action == 'remove':
+            self.markStale(delta[1])
+            return self.removeEntry(delta[1], kind)
+        if action == 'rename':
+            self.markStale(delta[1])
+            self.markStale(delta[2])
+            changed = [i for i in (self.removeEntry(delta[1], kind), self.insertEntry(delta[2], kind)) if i is not None]
+            if changed:
+                return min(changed)
+            return None
+        if action == 'modify':
+            self.markStale(delta[1])
+            return self.indexOf(delta[1], kind)
+        return None
+
+    def pollChanges(self):
+        """applies pending directory changes, returns the first changed row or None"""
+        first = None
+        for delta in self.watcher.poll():
+            if delta[0] == 'gone':
+                while not os.path.isdir(self.cwd):
+                    self.cwd = os.path.dirname(self.cwd)
+                self.changedir(self.cwd)
+                self.scanDir()
+                return 0
+            index = self.applyDelta(delta)
+            if index is not None and (first is None or index < first):
+                first = index
+        return first
+
 
 class InfoScreen:
-    def __init__(self, wh):
+    def __init__(self, wh, fps: float = 25):
         self.wh = wh
+        self.fps = fps
+        self.frame = dict()
+        self.nextFrame = 0
         self.bpm = 120
         self.mtc = True
         self.bar = 0
@@ -61,49 +176,101 @@ class InfoScreen:
         self.loop = False
         self.playing = False
         self.transpose = 0
+        self.audition = 0
+        self.layers = 0
+        self.wire = None
+        self.realtime = None
         self.hasNewValues = False
 
-    def showValues(self):
-        self.hasNewValues = False
+    def cells(self) -> list:
+        """the fields of one frame as (row, col, text, attributes)"""
+        cells = []
         if self.playing:
-            self.wh.addnstr(1, 1, "PLAYING", self.cols, curses.color_pair(2) | curses.A_BOLD)
-            self.wh.addnstr(4, 1, f"Pos: ", self.cols)
-            self.wh.addnstr(4, 6, f"{self.bar}.{self.beat}    ", self.cols, curses.color_pair(2) | curses.A_BOLD)
+            cells.append((1, 1, "PLAYING", curses.color_pair(2) | curses.A_BOLD))
+            cells.append((4, 1, f"Pos: ", curses.A_NORMAL))
+            cells.append((4, 6, f"{self.bar}.{self.beat}    ", curses.color_pair(2) | curses.A_BOLD))
         else:
-            self.wh.addnstr(1, 1, "STOPPED", self.cols, curses.color_pair(5))
-            self.wh.addnstr(4, 1, f"Pos: {self.bar}.{self.beat}    ", self.cols)
-        self.wh.addnstr(3, 1, f"Bpm: {self.bpm}      ", self.cols)
-        self.wh.addnstr(5, 1, f"Len: {int(self.lenSeconds / 60):02}'{int(self.lenSeconds) % 60:02}''     ", self.cols)
-        self.wh.addnstr(6, 1, f"Key: {self.key}      ", self.cols)
-        self.wh.addnstr(7, 1, f"Sig: {self.numerator}/{self.denominator}      ", self.cols)
+            cells.append((1, 1, "STOPPED", curses.color_pair(5)))
+            cells.append((4, 1, f"Pos: {self.bar}.{self.beat}    ", curses.A_NORMAL))
+        cells.append((3, 1, f"Bpm: {self.bpm}      ", curses.A_NORMAL))
+        cells.append((5, 1, f"Len: {int(self.lenSeconds / 60):02}'{int(self.lenSeconds) % 60:02}''     ", curses.A_NORMAL))
+        cells.append((6, 1, f"Key: {self.key}      ", curses.A_NORMAL))
+        cells.append((7, 1, f"Sig: {self.numerator}/{self.denominator}      ", curses.A_NORMAL))
         if self.mtc:
             tag = "MTC"
         else:
             tag = "t  "
 
-        self.wh.addnstr(2, 1, f"{tag}: {self.h:2}.{self.m:02}.{self.s:02}.{self.f:02} @ {self.rate}/s    ", self.cols)
+        cells.append((2, 1, f"{tag}: {self.h:2}.{self.m:02}.{self.s:02}.{self.f:02} @ {self.rate}/s    ", curses.A_NORMAL))
         if self.loop:
             loopMode = "yes"
         else:
             loopMode = "no"
-        self.wh.addnstr(8, 1, f"Loop: {loopMode:10}", self.cols)
-        self.wh.addnstr(9, 1, f"Transpose: {self.transpose}      ", self.cols)
-        self.wh.refresh()
+        cells.append((8, 1, f"Loop: {loopMode:10}", curses.A_NORMAL))
+        cells.append((9, 1, f"Transpose: {self.transpose}      ", curses.A_NORMAL))
+        if self.audition:
+            auditionMode = f"{self.audition} bars"
+        else:
+            auditionMode = "off"
+        cells.append((10, 1, f"Audition: {auditionMode:10}", curses.A_NORMAL))
+        cells.append((11, 1, f"Layers: {self.layers:<10}", curses.A_NORMAL))
+        if self.wire is not None:
+            wire = f"{self.wire['load'] * 100:3.0f}% +{self.wire['noteDelay']:.1f}ms"
+            cells.append((12, 1, f"Wire: {wire:14}", curses.A_NORMAL))
+        if self.realtime is not None:
+            cells.append((13, 1, f"RT: {self.realtime:20}", curses.A_NORMAL))
+        return cells
+
+    def showValues(self):
+        """draws only the cells that differ from the previous frame"""
+        self.hasNewValues = False
+        self.nextFrame = time.monotonic() + 1 / self.fps
+        frame = dict()
+        changed = False
+        # rows that would fall on the bottom border or below a short window are left out
+        height = self.wh.getmaxyx()[0] - 1
+        for row, col, text, attr in self.cells():
+            if row >= height:
+                continue
+            frame[(row, col)] = (text, attr)
+            if self.frame.get((row, col)) != (text, attr):
+                self.wh.addnstr(row, col, text, self.cols, attr)
+                changed = True
+        self.frame = frame
+        if changed:
+            self.wh.noutrefresh()
+            curses.doupdate()
+
+    def frameDue(self) -> float:
+        """seconds until the frame rate cap allows the next frame"""
+        return max(0.0, self.nextFrame - time.monotonic())
+
+    def render(self):
+        if self.hasNewValues and self.frameDue() == 0:
+            self.showValues()
 
     def refresh(self):
         self.wh.refresh()
 
     def setLoop(self, value: bool):
         self.loop = value
-        self.showValues()
+        self.hasNewValues = True
 
     def setTimeCode(self, value: bool):
         self.mtc = value
-        self.showValues()
+        self.hasNewValues = True
 
     def setTranspose(self, value):
         self.transpose = value
-        self.showValues()
+        self.hasNewValues = True
+
+    def setAudition(self, bars: int):
+        self.audition = bars
+        self.hasNewValues = True
+
+    def setLayers(self, count: int):
+        self.layers = count
+        self.hasNewValues = True
 
     def updateValues(self, m: dict):
         self.bpm = round(6000000000 / m['tempo']) / 100
@@ -118,21 +285,27 @@ class InfoScreen:
             self.s = m['mtc']['sec']
             self.f = m['mtc']['frame']
             self.rate = m['mtc']['rate']
+        self.wire = m.get('wire')
+        if 'realtime' in m:
+            self.realtime = describe(m['realtime'])
         self.playing = m['playing']
         self.hasNewValues = True
         #self.showValues()
 
-    def resize(self, rows: int, cols: int):
+    def resize(self, rows: int, cols: int, x: int = None):
         self.cols = cols - 2
         self.wh.resize(rows, cols)
+        if x is not None:
+            self.wh.mvwin(0, x)
         self.wh.clear()
         self.wh.border()
+        self.frame = dict()
         self.showValues()
 
 class Settings:
 
     def __init__(self):
-        self.home = str(Path.home())
+        self.home = os.path.expanduser("~")
         self.homedir = f"{self.home}/.cursedsmfplay/"
         if not os.path.isdir(self.homedir):
             os.mkdir(self.homedir, 0o700)
@@ -165,22 +338,96 @@ class Settings:
         self.jsonData["mtc"] = mode
         self.createSettingsFile()
 
+    def getAuditionBars(self):
+        if "auditionbars" in self.jsonData:
+            return self.jsonData["auditionbars"]
+        else:
+            return 4
+
+    def getMaxFps(self):
+        if "fps" in self.jsonData:
+            return self.jsonData["fps"]
+        else:
+            return 25
+
+    def getOutput(self):
+        if "output" in self.jsonData:
+            return self.jsonData["output"]
+        else:
+            return defaultOutput
+
+    def getLog(self):
+        if "log" in self.jsonData:
+            return self.jsonData["log"]
+        else:
+            return {}
+
+    def getTrace(self):
+        if "trace" in self.jsonData:
+            return EngineTrace.fromDict(self.jsonData["trace"])
+        else:
+            return None
+
+    def getRealtime(self):
+        if "realtime" in self.jsonData:
+            return RealtimeOptions.fromDict(self.jsonData["realtime"])
+        else:
+            return None
+
+    def getControlSocket(self):
+        if "controlsocket" in self.jsonData:
+            return os.path.expanduser(self.jsonData["controlsocket"])
+        else:
+            return f"{self.homedir}control.sock"
+
+    def getLibraryPath(self):
+        if "library" in self.jsonData:
+            return self.jsonData["library"]
+        else:
+            return self.jsonData["lastworkingdirectory"]
+
     def setCurrentWorkingDirectory(self, path:str):
         self.jsonData["lastworkingdirectory"] = path
         self.createSettingsFile()
 
     def createSettingsFile(self):
-        with open(self.settingsFileName, "w") as f:
+        # a crash while writing leaves the previous settings, not an empty file
+        with open(f"{self.settingsFileName}.tmp", "w") as f:
             s = json.dumps(self.jsonData)
             f.write(s)
+        os.replace(f"{self.settingsFileName}.tmp", self.settingsFileName)
 
 
 
 class App:
-    def __init__(self):
+    def __init__(self, log: PlayerLog):
+        self.log = log
+        # the engine is imported and opened while curses and the first frame are set up
+        self.engine = None
+        self.uiloop = None
+        Thread(name='engine', target=self.loadEngine, args=(Settings(),), daemon=True).start()
         self.eventStop = None
+        self.playerThread = None
+        self.control = None
+        self.lastStatus = None
+        self.statusChanged = False
+        self.loadedFile = None
+        # the file playing or played last, +/- and the loop point keys change its profile
+        self.playingFile = None
+        # set by startEngine() from what loadEngine() has prepared
+        self.midiout = None
+        self.smfPlayer = None
+        self.prefetcher = None
+        self.layers = None
+        # output ports of layers by spec, opened on the first layer routed there
+        self.layerOutputs = dict()
+        self.profiles = None
+        # the engine trace if the settings ask for one, the UI thread records its frames into uiTrace
+        self.trace = None
+        self.uiTrace = None
+        self.audition = False
+        self.auditionBars = 4
         self.mfset = MidifileSet()
-        self.mfset.scanDir()
         self.screen = curses.initscr()
         self.screen.keypad(True)
         curses.noecho()
@@ -200,9 +447,16 @@ class App:
         self.wdir = self.cols - self.infow
         self.infoscreen = InfoScreen(curses.newwin(self.rows, self.infow, 0, self.wdir))
         self.winDirectory = curses.newwin(self.rows-3, self.wdir, 0, 0)
+        self.pianoRoll = PianoRoll(self.winDirectory)
+        self.lyricsPane = LyricsPane(curses.newwin(2, self.cols, self.rows - 1, 0))
+        self.showRoll = False
 
         self.transpose = 0
-        self.resetScreen()
+        self.library = None
+        self.libraryDue = None
+        self.searchQuery = None
+        self.searchResult = None
+        self.handleResize()
 
 
     def resetScreen(self):
@@ -210,80 +464,419 @@ class App:
         self.rows, self.cols = self.screen.getmaxyx()
         self.wdir = self.cols - self.infow
         self.rows -= 2
-        self.infoscreen.resize(self.rows-2, self.infow)
+        self.infoscreen.resize(self.rows-2, self.infow, self.wdir)
         self.winDirectory.resize(self.rows-2, self.wdir)
         self.winDirectory.clear()
+        if self.indexfile > self.topindex + (self.rows - 5):
+            self.topindex = max(0, self.indexfile - int(self.rows / 2))
+        self.pianoRoll.resize(self.rows-2, self.wdir)
+        self.lyricsPane.resize(2, self.cols, self.rows - 1)
         self.showDirectory()
 
+    def handleResize(self):
+        """recomputes the layout, the midi port, the player and the directory scan are kept"""
+        self.screen.erase()
+        self.screen.noutrefresh()
+        try:
+            self.resetScreen()
+            self.infoscreen.showValues()
+        except curses.error:
+            # the terminal is too small for the layout, wait for the next resize
+            pass
+
     def update(self, msgDict: dict):
         self.infoscreen.updateValues(msgDict)
+        self.lastStatus = msgDict
+        self.statusChanged = True
+        if self.uiloop is not None:
+            self.uiloop.wakeup()
+
+    def listing(self):
+        if self.searchQuery is not None:
+            return self.searchResult
+        return self.mfset.fetch()
+
+    def showDirectoryRow(self, i: int, ls):
+        if i + self.topindex < len(ls):
+            if i + self.topindex == self.indexfile:
+                color = curses.color_pair(curses.COLOR_BLUE + 8)
+            else:
+                color = curses.color_pair(curses.COLOR_BLACK)
+            entry = ls[i + self.topindex]
+            if isinstance(entry, str):
+                # search results are paths relative to the library
+                entry = [entry, 'file']
+            if entry[1] == 'dir':
+                dirStr = '>'
+            else:
+                dirStr = ' '
+            self.winDirectory.addnstr(i + 1, 1, f"{dirStr} {str(entry[0]):200}", self.wdir - 2, color)
+        else:
+            self.winDirectory.addnstr(i + 1, 1, " " * 200, self.wdir - 2, curses.color_pair(curses.COLOR_BLACK))
 
     def showDirectory(self):
-        self.winDirectory.clear()
+        if self.showRoll:
+            # the piano roll owns the window
+            return
+        try:
+            self.drawDirectory()
+        except curses.error:
+            # rows below a short window, laid out again by the next resize
+            pass
+
+    def drawDirectory(self):
+        # erase() instead of clear(), clear() makes curses resend the whole terminal
+        self.winDirectory.erase()
         self.winDirectory.border()
-        ls = self.mfset.fetch()
+        ls = self.listing()
         for i in range(self.rows - 4):
             if i + self.topindex < len(ls):
-                if i + self.topindex == self.indexfile:
-                    color = curses.color_pair(curses.COLOR_BLUE + 8)
-                else:
-                    color = curses.color_pair(curses.COLOR_BLACK)
-                if ls[i+self.topindex][1] == 'dir':
-                    dirStr = '>'
-                else:
-                    dirStr = ' '
-                self.winDirectory.addnstr(i + 1, 1, f"{dirStr} {str(ls[i + self.topindex][0]):200}", self.wdir - 2, color)
-        cwd = f"{os.getcwd()}/"
+                self.showDirectoryRow(i, ls)
         self.winDirectory.refresh()
-        self.screen.addnstr(self.rows-2, 1, f"{cwd:200}", self.cols - 2, curses.color_pair(curses.COLOR_BLACK))
+        if self.searchQuery is not None:
+            self.showSearchLine()
+        else:
+            cwd = f"{os.getcwd()}/"
+            self.screen.addnstr(self.rows-2, 1, f"{cwd:200}", self.cols - 2, curses.color_pair(curses.COLOR_BLACK))
+            self.screen.refresh()
+
+    def showSearchLine(self):
+        if self.library.building:
+            state = "indexing..."
+        else:
+            more = "" if self.searchResult.exact() else "+"
+            state = f"{len(self.searchResult)}{more} of {len(self.library.snapshot)}"
+        line = f"/{self.searchQuery}_  [{state}]"
+        self.screen.addnstr(self.rows-2, 1, f"{line:200}", self.cols - 2, curses.color_pair(curses.COLOR_YELLOW))
         self.screen.refresh()
 
+    def showDirectoryRows(self, first: int):
+        """repaints the visible rows from list index first downwards, rows above stay untouched"""
+        if self.showRoll:
+            return
+        ls = self.listing()
+        try:
+            for i in range(max(0, first - self.topindex), self.rows - 4):
+                self.showDirectoryRow(i, ls)
+            self.winDirectory.refresh()
+        except curses.error:
+            pass
+
+    def checkDirectory(self):
+        files = self.mfset.fetch()
+        selected = None
+        if 0 <= self.indexfile < len(files):
+            selected = list(files[self.indexfile])
+        cwd = self.mfset.cwd
+        first = self.mfset.pollChanges()
+        if self.mfset.stale and self.library is not None:
+            self.library.refreshInBackground(self.mfset.stale)
+            self.mfset.stale.clear()
+        if first is None or self.searchQuery is not None:
+            return
+        if cwd != self.mfset.cwd:
+            self.indexfile = 0
+            self.topindex = 0
+            self.showDirectory()
+            return
+        files = self.mfset.fetch()
+        newIndex = self.indexfile
+        if selected is not None and selected in files:
+            newIndex = files.index(selected)
+        newIndex = max(0, min(newIndex, len(files) - 1))
+        if newIndex != self.indexfile:
+            first = min(first, newIndex, self.indexfile)
+            self.indexfile = newIndex
+            if not self.topindex <= self.indexfile <= self.topindex + (self.rows - 5):
+                self.topindex = max(0, self.indexfile - int(self.rows / 2))
+                self.showDirectory()
+                return
+        self.showDirectoryRows(first)
+
     def toogleLoop(self):
         self.loop = not self.loop
         self.settings.setLoopMode(self.loop)
         self.infoscreen.setLoop(self.loop)
 
+    def setTranspose(self, transpose: int):
+        self.transpose = transpose
+        self.infoscreen.setTranspose(self.transpose)
+        self.smfPlayer.setTranspose(self.transpose)
+        self.updateProfile(transpose=transpose or None)
+
+    def setTempoFactor(self, factor: float):
+        self.smfPlayer.setTempoFactor(factor)
+        self.updateProfile(tempo=factor if factor != 1.0 else None)
+
+    def profilePath(self):
+        """the file a profile change is for: the one playing or played last, else the highlighted one"""
+        return self.playingFile or self.pathAt(self.indexfile)
+
+    def updateProfile(self, **changes):
+        path = self.profilePath()
+        if path is not None:
+            self.profiles.update(path, **changes)
+
+    def setLoopPoint(self, index: int):
+        """the playing position becomes the start (0) or end (1) of the loop from the next start on"""
+        path = self.profilePath()
+        if path is None or not self.smfPlayer.playing:
+            return
+        loop = list(self.profiles.get(path).get("loop", [0.0, None]))
+        loop[index] = round(self.smfPlayer.songSeconds(), 3)
+        if loop[1] is not None and loop[1] <= loop[0]:
+            # the other point was on the wrong side, it goes back to the start or end of the song
+            loop[1 - index] = [0.0, None][1 - index]
+        self.profiles.update(path, loop=loop)
+
+    def applyProfile(self, profile: dict):
+        """called on the player thread before a song starts"""
+        from smfplayout import channelList, channelMapping
+        player = self.smfPlayer
+        mute = channelList(profile.get("mute", ""))
+        channelMap = channelMapping(profile["remap"]) if profile.get("remap") else dict()
+        if mute != player.transform.mute or channelMap != player.transform.channelMap:
+            player.setTransform(player.transform.copy(mute=mute, channelMap=channelMap))
+        player.setTempoFactor(profile.get("tempo", 1.0))
+        player.setLoopPoints(*profile.get("loop", [0.0, None]))
+
     def toggleTimeCode(self):
         self.timeCode = not self.timeCode
         self.infoscreen.setTimeCode(self.timeCode)
         self.settings.setMtcMode(self.timeCode)
         self.smfPlayer.setSendMTC(self.timeCode)
 
+    def moveSelection(self, step: int):
+        files = self.listing()
+        self.indexfile += step
+        if self.indexfile >= len(files):
+            self.indexfile = len(files) - 1
+        if self.indexfile < 0:
+            self.indexfile = 0
+        if self.indexfile < self.topindex + 3:
+            self.topindex -= int(self.rows / 2)
+        if self.indexfile > self.topindex + (self.rows - 5):
+            self.topindex += int(self.rows / 2)
+        if self.topindex < 0:
+            self.topindex = 0
+        self.showDirectory()
+        self.selectionChanged()
+
+    def pathAt(self, row: int):
+        ls = self.listing()
+        if row < 0 or row >= len(ls):
+            return None
+        if self.searchQuery is not None:
+            return f"{self.library.root}/{ls[row]}"
+        if ls[row][1] == 'dir':
+            return None
+        return f"{self.mfset.cwd}/{ls[row][0]}"
+
+    def selectionChanged(self):
+        """parses the files around the cursor ahead and auditions the highlighted one"""
+        rows = [self.indexfile]
+        for distance in range(1, 4):
+            rows += [self.indexfile + distance, self.indexfile - distance]
+        paths = [p for p in map(self.pathAt, rows) if p is not None]
+        self.prefetcher.want(paths)
+        if self.pathAt(self.indexfile) is not None:
+            # read now so starting it needs no lookup
+            self.profiles.get(self.pathAt(self.indexfile))
+        if self.audition and self.pathAt(self.indexfile) is not None:
+            self.playFile(self.pathAt(self.indexfile), self.auditionBars)
+
+    def togglePianoRoll(self):
+        self.showRoll = not self.showRoll
+        if self.showRoll:
+            self.pianoRoll.invalidate()
+            self.pianoRoll.render(self.smfPlayer, True)
+        else:
+            self.showDirectory()
+
+    def toggleAudition(self):
+        self.audition = not self.audition
+        if self.audition:
+            self.infoscreen.setAudition(self.auditionBars)
+            self.selectionChanged()
+        else:
+            self.infoscreen.setAudition(0)
+
+    def addLayer(self):
+        """stacks the highlighted file on the running layers, in sync with the song playing or the first layer"""
+        path = self.pathAt(self.indexfile)
+        if path is None:
+            return
+        self.loadLayer(path)
+
+    def loadLayer(self, path: str, transform=None, port: str = None, sync: bool = True):
+        """the file is compiled on the prefetch thread, the layer starts from there once it is ready"""
+        output = self.layerOutput(port)
+        loops = 99999 if self.loop else 1
+
+        def loaded(path, song):
+            if song is None:
+                self.log.warning("no layer from %s", path)
+            else:
+                self.layers.add(song, output, transform, loops=loops, sync=sync, name=path)
+            # the UI loop shows the new layer count
+            if self.uiloop is not None:
+                self.uiloop.wakeup()
+
+        self.prefetcher.load(path, loaded)
+
+    def layerOutput(self, port: str):
+        """the output port of a layer, the player's own one without a port"""
+        if not port:
+            return self.midiout
+        output = self.layerOutputs.get(port)
+        if output is None:
+            output = self.layerOutputs[port] = openOutput(port)
+        return output
+
+    def layerCommand(self, command: dict) -> dict:
+        """adds a layer from a path, or changes or removes the layer with the id"""
+        from control import numberValue, flagValue
+        from smfevents import smftransform
+        from smfplayout import channelList
+        port = command.get("port")
+        if "id" not in command:
+            path = os.path.abspath(os.path.expanduser(command["path"]))
+            if not os.path.isfile(path):
+                raise ValueError(f"no such file: {path}")
+            transform = smftransform(int(numberValue(command.get("transpose", 0))), channelList(command.get("mute", "")))
+            self.loadLayer(path, transform, port, flagValue(command.get("sync", True)))
+            return {"loading": path}
+        layer = self.layers.layer(int(numberValue(command["id"])))
+        if flagValue(command.get("remove", False)):
+            self.layers.remove(layer)
+            return {"removed": layer.number}
+        changes = dict()
+        if "transpose" in command:
+            changes["transpose"] = int(numberValue(command["transpose"]))
+        if "mute" in command:
+            changes["mute"] = channelList(command["mute"] or "")
+        if port is not None:
+            self.layers.setOutput(layer, self.layerOutput(port))
+        if changes:
+            self.layers.setTransform(layer, layer.transform.copy(**changes))
+        return {"layer": self.layerInfo(layer)}
+
+    def layerInfo(self, layer) -> dict:
+        ports = {id(output): port for port, output in self.layerOutputs.items()}
+        return {"id": layer.number, "file": layer.name, "transpose": layer.transform.transpose,
+                "mute": ",".join(str(c + 1) for c in sorted(layer.transform.mute)),
+                "port": ports.get(id(layer.output)), "sync": layer.sync}
+
+    def clearLayers(self):
+        self.layers.clear()
+        self.infoscreen.setLayers(0)
+
+    def checkLibrary(self, now: bool = False):
+        """starts building the library index once it is due"""
+        if self.libraryDue is not None and (now or time.monotonic() >= self.libraryDue):
+            self.libraryDue = None
+            self.library.buildInBackground()
+
+    def openSearch(self):
+        if self.library is None:
+            return
+        self.checkLibrary(True)
+        self.searchQuery = ""
+        self.updateSearch()
+
+    def closeSearch(self):
+        self.searchQuery = None
+        self.searchResult = None
+        self.indexfile = 0
+        self.topindex = 0
+        self.showDirectory()
+
+    def updateSearch(self):
+        self.searchResult = self.library.search(self.searchQuery)
+        self.indexfile = 0
+        self.topindex = 0
+        self.showDirectory()
+        self.selectionChanged()
+
+    def checkSearch(self):
+        if self.searchQuery is not None and self.searchResult.snapshot is not self.library.snapshot:
+            self.updateSearch()
+
+    def interpretSearchKey(self, key):
+        if key in ['\x1b']:
+            self.closeSearch()
+        elif key in ['KEY_BACKSPACE', '\x7f', '\b']:
+            self.searchQuery = self.searchQuery[:-1]
+            self.updateSearch()
+        elif 'KEY_UP' == key:
+            self.moveSelection(-1)
+        elif 'KEY_DOWN' == key:
+            # results are looked for a screen ahead of the selection
+            self.searchResult.find(self.indexfile + self.rows)
+            self.moveSelection(1)
+        elif key in ['KEY_ENTER', '\n', 'KEY_RIGHT']:
+            if self.indexfile < len(self.searchResult):
+                self.playFile(f"{self.library.root}/{self.searchResult[self.indexfile]}")
+        elif len(key) == 1 and key.isprintable():
+            self.searchQuery += key
+            self.updateSearch()
+        return True
+
+    def playSong(self, midifile: str, eventStop: Event, loopcnt: int, transpose: int, bars: int, profile: dict):
+        song = self.prefetcher.get(midifile)
+        if not eventStop.is_set():
+            self.applyProfile(profile)
+            self.smfPlayer.play_out(song, eventStop, self.update, loopcnt, transpose, bars)
+
+    def playFile(self, midifile: str, bars: int = None):
+        self.log.info("play %s%s", midifile, f" ({bars} bars)" if bars else "")
+        if self.eventStop is not None:
+            self.eventStop.set()
+        if self.playerThread is not None:
+            self.playerThread.join(0.5)
+
+        self.eventStop = Event()
+        profile = self.profiles.get(midifile)
+        self.playingFile = midifile
+        self.transpose = profile.get("transpose", 0)
+        self.infoscreen.setTranspose(self.transpose)
+        if self.loop and bars is None:
+            loopcnt = 99999
+        else:
+            loopcnt = 1
+        self.playerThread = Thread(name='player',
+                                   target=self.playSong,
+                                   args=(
+                                   midifile, self.eventStop, loopcnt, self.transpose, bars, profile))
+        self.playerThread.start()
+
     def interpretKey(self, key):
         #self.screen.addstr(self.rows + 1, 0, f'{key}          ')
         #self.screen.refresh()
+        if self.searchQuery is not None:
+            return self.interpretSearchKey(key)
         if 'KEY_UP' == key:
-            files = self.mfset.fetch()
-            self.indexfile -= 1
-            if self.indexfile < 0:
-                self.indexfile = 0
-            if self.indexfile < self.topindex + 3:
-                self.topindex -= int(self.rows / 2)
-            if self.topindex < 0:
-                self.topindex = 0
-            self.showDirectory()
+            self.moveSelection(-1)
         elif 'KEY_DOWN' == key:
-            files = self.mfset.fetch()
-            self.indexfile += 1
-            if self.indexfile >= len(files):
-                self.indexfile = len(files) - 1
-            if self.indexfile > self.topindex + (self.rows - 5):
-                self.topindex += int(self.rows / 2)
-            self.showDirectory()
-        elif key in ['r', 'R']: #'KEY_RESIZE',
-            curses.resizeterm(self.screen.getmaxyx())
-            self.resetScreen()
+            self.moveSelection(1)
+        elif key in ['/']:
+            self.openSearch()
+        elif key in ['r', 'R', 'KEY_RESIZE']:
+            self.handleResize()
         elif key in ['+']:
-            self.transpose += 1
-            self.infoscreen.setTranspose(self.transpose)
-            self.smfPlayer.setTranspose(self.transpose)
+            self.setTranspose(self.transpose + 1)
         elif key in ['-']:
-            self.transpose -= 1
-            self.infoscreen.setTranspose(self.transpose)
-            self.smfPlayer.setTranspose(self.transpose)
+            self.setTranspose(self.transpose - 1)
+        elif key in ['[']:
+            self.setLoopPoint(0)
+        elif key in [']']:
+            self.setLoopPoint(1)
+        elif key in ['\\']:
+            self.updateProfile(loop=None)
         elif key in [27, 'q', 'Q']:
             if self.eventStop is not None:
                 self.eventStop.set()
+            self.layers.stop()
             time.sleep(0.2)
             return False
         elif key in ['l', 'L']:
@@ -291,42 +884,35 @@ class App:
             self.toogleLoop()
         elif key in ['t', 'T']:
             self.toggleTimeCode()
+        elif key in ['a', 'A']:
+            self.toggleAudition()
+        elif key in ['v', 'V']:
+            self.togglePianoRoll()
+        elif key in ['o']:
+            self.addLayer()
+        elif key in ['O']:
+            self.clearLayers()
         elif key in ['KEY_LEFT', '\b']:
             self.mfset.changedir("..")
             self.mfset.scanDir()
             self.indexfile = 0
             self.topindex = 0
             self.showDirectory()
+            self.selectionChanged()
         elif key in ['KEY_ENTER','KEY_RIGHT']:
             files = self.mfset.fetch()
             if files[self.indexfile][1] == 'dir':
                 self.mfset.changedir(files[self.indexfile][0])
-                flog.write(f"   -> {os.getcwd()}\n")
+                self.log.debug("-> %s", os.getcwd())
 
                 self.mfset.scanDir()
-                flog.write(f"   -> {self.mfset.fetch()}\n")
+                self.log.debug("-> %s", list(self.mfset.fetch()))
                 self.indexfile = 0
                 self.topindex = 0
                 self.showDirectory()
+                self.selectionChanged()
             else:
-                try:
-                    if self.eventStop is not None:
-                        self.eventStop.set()
-                        time.sleep(0.1)
-                except:
-                    pass
-
-                self.eventStop = Event()
-                if self.loop:
-                    loopcnt = 99999
-                else:
-                    loopcnt = 1
-                midifile = f"{self.mfset.cwd}/{files[self.indexfile][0]}"
-                self.playerThread = Thread(name='player',
-                                           target=self.smfPlayer.play_file,
-                                           args=(
-                                           midifile, self.eventStop, self.update, loopcnt, self.transpose))
-                self.playerThread.start()
+                self.playFile(f"{self.mfset.cwd}/{files[self.indexfile][0]}")
                 self.settings.setCurrentWorkingDirectory(self.mfset.cwd)
 
         elif key in [' ', 's', 'S']:
@@ -337,11 +923,96 @@ class App:
         self.screen.move(1, self.wdir + self.rows - 2)
         return True
 
+    def controlCommand(self, command: dict) -> dict:
+        """a command from the control socket, see control.py"""
+        from control import numberValue, flagValue
+        cmd = command["cmd"]
+        if cmd == "load":
+            path = os.path.abspath(os.path.expanduser(command["path"]))
+            if not os.path.isfile(path):
+                raise ValueError(f"no such file: {path}")
+            self.loadedFile = path
+            self.prefetcher.want([path])
+        elif cmd == "play":
+            path = command.get("path")
+            if path is not None:
+                path = os.path.abspath(os.path.expanduser(path))
+            else:
+                path = self.loadedFile or self.pathAt(self.indexfile)
+            if path is None or not os.path.isfile(path):
+                raise ValueError(f"nothing to play: {path}")
+            self.loadedFile = path
+            self.playFile(path)
+        elif cmd == "stop":
+            if self.eventStop is not None:
+                self.eventStop.set()
+        elif cmd == "seek":
+            self.smfPlayer.requestSeek(numberValue(command["seconds"]))
+        elif cmd == "transpose":
+            self.setTranspose(int(numberValue(command["value"])))
+        elif cmd == "tempo":
+            self.setTempoFactor(numberValue(command["factor"]))
+        elif cmd == "loop":
+            if flagValue(command.get("value", not self.loop)) != self.loop:
+                self.toogleLoop()
+        elif cmd == "profile":
+            path = command.get("path")
+            path = os.path.abspath(os.path.expanduser(path)) if path is not None else self.profilePath()
+            if path is None:
+                raise ValueError("no file for a profile")
+            fields = command.get("fields", dict())
+            unknown = set(fields) - profileFields
+            if unknown:
+                raise ValueError(f"unknown profile fields: {', '.join(sorted(unknown))}")
+            from smfplayout import channelList, channelMapping
+            # checked here, the playing thread applies them without asking
+            if fields.get("transpose") is not None:
+                fields["transpose"] = int(numberValue(fields["transpose"]))
+            if fields.get("tempo") is not None:
+                fields["tempo"] = numberValue(fields["tempo"])
+            if fields.get("loop") is not None:
+                start, end = fields["loop"]
+                fields["loop"] = [numberValue(start), None if end is None else numberValue(end)]
+            if fields.get("mute"):
+                channelList(fields["mute"])
+            if fields.get("remap"):
+                channelMapping(fields["remap"])
+            self.profiles.update(path, **fields)
+            return {"file": path, "profile": self.profiles.get(path)}
+        elif cmd == "layer":
+            return self.layerCommand(command)
+        elif cmd == "layers":
+            return {"layers": [self.layerInfo(layer) for layer in list(self.layers.layers)]}
+        elif cmd != "status":
+            raise ValueError(f"unknown command: {cmd}")
+        return {"status": self.lastStatus, "file": self.loadedFile, "transpose": self.transpose, "loop": self.loop}
+
+    def checkControl(self):
+        if self.control is None:
+            return
+        self.control.poll()
+        if self.statusChanged:
+            self.statusChanged = False
+            self.control.broadcast({"event": "status", "status": self.lastStatus})
+
     def cleanExit(self):
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+        if self.uiloop is not None:
+            self.uiloop.close()
+            self.uiloop = None
         curses.nocbreak()
         self.screen.keypad(False)
         curses.echo()
         curses.endwin()
+        if self.profiles is not None:
+            self.profiles.close()
+        for output in self.layerOutputs.values():
+            output.close()
+        self.log.close()
+        if self.trace is not None:
+            self.trace.close()
 
     def loadSettings(self):
         self.settings = Settings()
@@ -352,43 +1023,139 @@ class App:
             self.settings.setCurrentWorkingDirectory(os.getcwd())
         self.loop = self.settings.getLoopMode()
         self.timeCode = self.settings.getMtcMode()
+        self.auditionBars = self.settings.getAuditionBars()
+        self.infoscreen.fps = self.settings.getMaxFps()
         self.infoscreen.loop = self.loop
         self.infoscreen.mtc = self.timeCode
+        self.log.configure(self.settings.getLog())
+
+    def loadEngine(self, settings):
+        """imports and opens what playing needs, runs in a thread while the first frame is drawn"""
+        try:
+            from smfplayout import smfplayout
+            from smflayers import smflayers
+            from prefetch import SongCache, Prefetcher
+            midiout = openOutput(settings.getOutput())
+            player = smfplayout(midiout)
+            player.setRealtime(settings.getRealtime())
+            self.trace = settings.getTrace()
+            player.setTrace(self.trace)
+            self.engine = (midiout, player, Prefetcher(SongCache(16)), smflayers(realtime=settings.getRealtime()))
+        except Exception as e:
+            self.engine = e
+        if self.uiloop is not None:
+            self.uiloop.wakeup()
+
+    def startEngine(self) -> bool:
+        """takes over what loadEngine() has prepared, False while it is still loading"""
+        if self.engine is None:
+            return False
+        if isinstance(self.engine, Exception):
+            raise self.engine
+        self.midiout, self.smfPlayer, self.prefetcher, self.layers = self.engine
+        self.layers.follow(self.smfPlayer)
         self.smfPlayer.setSendMTC(self.timeCode)
+        self.smfPlayer.setLog(self.log)
+        if self.trace is not None:
+            self.uiTrace = self.trace.ring("ui")
+        from smfindex import SmfIndex
+        from control import ControlServer
+        from profiles import ProfileStore
+        self.profiles = ProfileStore(f"{self.settings.homedir}profiles.sqlite")
+        self.library = SmfIndex(self.settings.getLibraryPath())
+        self.library.onPublish = self.uiloop.wakeup
+        self.libraryDue = time.monotonic() + indexDelay
+        try:
+            self.control = ControlServer(self.settings.getControlSocket(), self.controlCommand)
+            self.uiloop.register(self.control, 'control')
+        except OSError as e:
+            self.log.warning("no control socket: %s", e)
+        self.selectionChanged()
+        return True
 
-    def run(self) -> bool:
+    def idleTimeout(self):
+        """
+        the polling directory watcher has no file descriptor to wait on and
+        values held back by the frame rate cap are drawn when it allows
+        """
+        timeouts = []
+        if self.mfset.watcher.fileno() is None:
+            timeouts.append(self.mfset.watcher.interval)
+        if self.infoscreen.hasNewValues:
+            timeouts.append(self.infoscreen.frameDue())
+        if self.smfPlayer is None:
+            return min(timeouts) if timeouts else None
+        if self.libraryDue is not None:
+            timeouts.append(max(0.0, self.libraryDue - time.monotonic()))
+        if self.showRoll and self.smfPlayer.playing:
+            timeouts.append(self.pianoRoll.frameDue())
+        nextSyllable = self.lyricsPane.nextChange(self.smfPlayer)
+        if nextSyllable is not None:
+            timeouts.append(nextSyllable)
+        if timeouts:
+            return min(timeouts)
+        return None
+
+    def render(self, panes: bool = False):
+        """the info screen and with panes the piano roll and the lyrics, a pane too small for them keeps playing"""
+        try:
+            self.infoscreen.render()
+            if panes:
+                if self.showRoll:
+                    self.pianoRoll.render(self.smfPlayer)
+                self.lyricsPane.render(self.smfPlayer)
+        except curses.error:
+            pass
 
-        midiout = rtmidi.MidiOut()
-        midiout.open_virtual_port("midi-curse")
-        self.smfPlayer = smfplayout(midiout)
+    def run(self) -> bool:
+        self.uiloop = UiLoop(self.screen)
+        self.uiloop.register(self.mfset.watcher, 'directory')
         self.loadSettings()
-        self.resetScreen()
-        self.infoscreen.showValues()
+        # the first frame goes out before anything slow, the listing follows from a thread
+        self.handleResize()
+        self.mfset.scanInBackground(self.uiloop.wakeup)
+        # the engine may have been ready before there was a loop to wake up
+        self.uiloop.wakeup()
+        keys = []
         while True:
-            try:
-                time.sleep(0.02)
-                key = self.screen.getkey()
-                if key != -1:
-                    if key == 'KEY_RESIZE':
-                        self.cleanExit()
-                        return True
-                    elif not self.interpretKey(key):
-                        self.cleanExit()
-                        print("Terminating...")
-                        return False
-
-            except Exception as e:
-                #print("Exception raised:", e)
-                time.sleep(0.01)
-                if self.infoscreen.hasNewValues:
-                    self.infoscreen.showValues()
+            self.uiloop.wait(self.idleTimeout())
+            keys += self.uiloop.keys()
+            if self.mfset.takeScan():
+                self.showDirectory()
+                if self.smfPlayer is not None:
+                    self.selectionChanged()
+            if (self.smfPlayer is None and not self.startEngine()) or self.mfset.loading:
+                # keys wait until there is something to play and to choose from
+                self.render()
+                continue
+            for key in keys:
+                try:
+                    running = self.interpretKey(key)
+                except Exception:
+                    # e.g. enter in an empty directory, ignored as before
+                    running = True
+                if not running:
+                    self.cleanExit()
+                    print("Terminating...")
+                    return False
+            keys = []
+            if self.infoscreen.layers != len(self.layers):
+                # layers that have played out
+                self.infoscreen.setLayers(len(self.layers))
+            if self.uiTrace is not None:
+                painted = self.uiTrace.now()
+            self.render(True)
+            if self.uiTrace is not None:
+                self.uiTrace.span(SPAN_REPAINT, painted)
+            self.checkDirectory()
+            self.checkLibrary()
+            self.checkSearch()
+            self.checkControl()
 
 
 def main(cursesWindow):
-    app = App()
-    while(app.run()):
-        time.sleep(0.05)
-        app = App()
+    app = App(PlayerLog("/tmp/player.log"))
+    app.run()
 
 
 if __name__ == '__main__':
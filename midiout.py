@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""
+Midi output backends.
+
+Everything that sends midi only calls send_message(bytes or list of ints) and
+close(), the backend is picked at startup from a spec string:
+    rtmidi:midi-curse   virtual rtmidi port of that name (the default)
+    null                discards everything, for measuring the engine alone
+    record              keeps every message with its time in memory
+    file:/dev/midi1     writes the raw bytes to a file or device
+    file+rs:/dev/midi1  the same with running status (repeated status bytes left out)
+Backends with sendBurst(messages) get all messages due at one time in a
+single call, the raw backend writes them with one system call.
+A suffix @31250 puts the bandwidth model of a DIN link in front of the
+backend (see wirerate.py), e.g. file:/dev/midi1@31250.
+"""
+
+import time
+
+defaultOutput = "rtmidi:midi-curse"
+
+
+class RtMidiOutput:
+    def __init__(self, portName: str = "midi-curse"):
+        # imported here so the other backends work without ALSA/JACK and python-rtmidi
+        import rtmidi
+        self.midiOut = rtmidi.MidiOut()
+        self.midiOut.open_virtual_port(portName)
+        self.send_message = self.midiOut.send_message
+
+    def close(self):
+        self.midiOut.close_port()
+        del self.midiOut
+
+
+class NullOutput:
+    def __init__(self):
+        self.count = 0
+
+    def send_message(self, data):
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+class RecordingOutput:
+    """messages as (seconds since creation, bytes), the clock may be a virtualclock"""
+    def __init__(self, clock=None):
+        self.now = clock.now if clock is not None else time.perf_counter
+        self.origin = self.now()
+        self.messages = []
+
+    def send_message(self, data):
+        self.messages.append((self.now() - self.origin, bytes(data)))
+
+    def close(self):
+        pass
+
+
+class RawFileOutput:
+    def __init__(self, path: str, runningStatus: bool = False):
+        self.f = open(path, "wb", buffering=0)
+        self.runningStatus = runningStatus
+        self.lastStatus = None
+
+    def encode(self, data) -> bytes:
+        data = bytes(data)
+        if not self.runningStatus:
+            return data
+        status = data[0]
+        if status < 0xF0:
+            if status == self.lastStatus:
+                return data[1:]
+            self.lastStatus = status
+        elif status < 0xF8:
+            # sysex and system common cancel running status, real time does not
+            self.lastStatus = None
+        return data
+
+    def send_message(self, data):
+        self.f.write(self.encode(data))
+
+    def sendBurst(self, messages: list):
+        self.f.write(b"".join(map(self.encode, messages)))
+
+    def close(self):
+        self.f.close()
+
+
+def openOutput(spec: str = defaultOutput, clock=None):
+    spec = spec or defaultOutput
+    base, _, baud = spec.rpartition("@")
+    if base and baud.isdigit():
+        from wirerate import WireRateOutput
+        return WireRateOutput(openOutput(base, clock), int(baud), clock)
+    kind, _, argument = spec.partition(":")
+    kind, _, option = kind.partition("+")
+    if kind == "rtmidi":
+        return RtMidiOutput(argument or "midi-curse")
+    if kind == "null":
+        return NullOutput()
+    if kind == "record":
+        return RecordingOutput(clock)
+    if kind == "file" and argument:
+        return RawFileOutput(argument, option == "rs")
+    raise ValueError(f"unknown midi output: {spec}")
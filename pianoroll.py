@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Piano roll and channel activity view.
+
+The view is drawn by the UI thread from what the player already keeps: the
+compiled song (event times), the active notes and the playback position.
+The player thread never calls into it, and frames are limited to fps.
+"""
+
+import curses
+import time
+from bisect import bisect_left
+
+maxLookahead = 4000
+
+
+class PianoRoll:
+    def __init__(self, wh, fps: float = 15, window: float = 4.0):
+        self.wh = wh
+        self.fps = fps
+        self.window = window
+        self.rows = 0
+        self.cols = 0
+        self.frame = dict()
+        self.nextFrame = 0
+        self.channelsOf = (None, [])
+
+    def resize(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.invalidate()
+
+    def invalidate(self):
+        self.frame = dict()
+        self.nextFrame = 0
+        self.wh.erase()
+        self.wh.border()
+
+    def frameDue(self) -> float:
+        return max(0.0, self.nextFrame - time.monotonic())
+
+    def songChannels(self, song) -> list:
+        if self.channelsOf[0] is not song:
+            self.channelsOf = (song, song.channels or list(range(16)))
+        return self.channelsOf[1]
+
+    def compose(self, player) -> list:
+        """returns (text, attributes) for every line inside the border"""
+        width = self.cols - 2
+        meterWidth = 8
+        rollWidth = width - meterWidth - 7
+        song = player.song
+        if song is None or rollWidth < 4:
+            return [(f"{'no song':{width}}", curses.A_NORMAL)]
+        now = player.songSeconds()
+        playing = player.playing
+        if playing:
+            state = f"{now:7.2f}s"
+        else:
+            state = "stopped"
+        lines = [(f"{state}  next {self.window:.0f}s"[:width].ljust(width), curses.A_BOLD)]
+        channels = self.songChannels(song)[:self.rows - 3]
+        row = {c: i for i, c in enumerate(channels)}
+        grid = [[' '] * rollWidth for _ in channels]
+        scale = rollWidth / self.window
+        sounding = {}
+        if playing:
+            pending = player.pendingNotes
+            for c in channels:
+                for n in range(128):
+                    if pending[c][n] > 0:
+                        sounding[(c, n)] = 0
+        # what the player sends: muted, soloed or filtered out notes are not shown
+        events = player.events
+        if events is None:
+            events = song.events
+        times, status, data1, data2 = events.times, events.status, events.data1, events.data2
+        first = bisect_left(times, now)
+        end = min(len(times), first + maxLookahead)
+        for index in range(first, end):
+            t = times[index]
+            if t >= now + self.window:
+                break
+            s = status[index]
+            kind = s & 0xF0
+            channel = s & 0x0F
+            if kind not in (0x80, 0x90) or s >= 0xF0 or channel not in row:
+                continue
+            col = min(rollWidth - 1, int((t - now) * scale))
+            key = (channel, data1[index])
+            line = grid[row[channel]]
+            if kind == 0x90 and data2[index] > 0:
+                line[col] = '|'
+                sounding[key] = col + 1
+            elif key in sounding:
+                for x in range(sounding.pop(key), col):
+                    if line[x] == ' ':
+                        line[x] = '='
+        for (c, n), start in sounding.items():
+            line = grid[row[c]]
+            for x in range(start, rollWidth):
+                if line[x] == ' ':
+                    line[x] = '='
+        for c, line in zip(channels, grid):
+            active = 0
+            if playing:
+                active = sum(1 for n in range(128) if player.pendingNotes[c][n] > 0)
+            meter = ('#' * active)[:meterWidth]
+            lines.append((f"{c + 1:2} {meter:{meterWidth}} :{''.join(line)}", curses.A_NORMAL))
+        return lines
+
+    def render(self, player, force: bool = False):
+        """draws a frame if the frame rate allows, only changed lines are sent"""
+        if not force and self.frameDue() > 0:
+            return
+        self.nextFrame = time.monotonic() + 1 / self.fps
+        changed = False
+        lines = self.compose(player)[:max(0, self.rows - 2)]
+        for y, cell in enumerate(lines):
+            if self.frame.get(y) != cell:
+                self.frame[y] = cell
+                self.wh.addnstr(y + 1, 1, cell[0], self.cols - 2, cell[1])
+                changed = True
+        for y in [y for y in self.frame if y >= len(lines)]:
+            del self.frame[y]
+            self.wh.addnstr(y + 1, 1, ' ' * (self.cols - 2), self.cols - 2)
+            changed = True
+        if changed:
+            self.wh.noutrefresh()
+            curses.doupdate()
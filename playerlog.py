@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+Queue-backed log of the player.
+
+    log = PlayerLog("/tmp/player.log", level=INFO)
+    log.info("-> %s", path)
+    log.setTimingPath("/tmp/player-timing.bin")
+    log.timing(TIMING_GROUP, lateness, count)
+
+Callers only append a tuple to a bounded deque: no lock, no formatting, no
+system call, the playing thread is never held up by the log. A writer
+thread sleeps until a record comes in (only the first one after a quiet
+spell sets its event) and then wakes up every interval while there are
+more. It formats text records into the log file (rotated at maxBytes,
+backups old files kept as .1, .2, ...) and packs timing records into a binary file (rotated at maxTimingBytes) of fixed 32
+byte records:
+    double clock time, uint32 code, uint32 spare, double a, double b
+When the queue is full the oldest records are dropped and counted.
+Binary timing files are printed with:
+    playerlog.py /tmp/player-timing.bin
+"""
+
+import os
+import struct
+import sys
+import time
+from collections import deque
+from threading import Thread, Event, Lock
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+levelNames = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+levelOfName = {name.lower(): level for level, name in levelNames.items()}
+
+# timing record codes: a and b per code
+TIMING_GROUP = 1  # lateness of a group of events (s), number of events
+TIMING_MTC = 2    # lateness of a quarter frame (s), quarter frames since start
+TIMING_STEP = 3   # lateness of a wake-up (s), seconds spent in step()
+timingNames = {TIMING_GROUP: "group", TIMING_MTC: "mtc", TIMING_STEP: "step"}
+
+timingRecord = struct.Struct("<dIIdd")
+
+
+def rotate(path: str, backups: int):
+    """path.1 .. path.backups-1 move up one, path becomes path.1"""
+    for n in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{n}"):
+            os.replace(f"{path}.{n}", f"{path}.{n + 1}")
+    if backups > 0 and os.path.exists(path):
+        os.replace(path, f"{path}.1")
+
+
+class PlayerLog:
+    def __init__(self, path: str = "/tmp/player.log", level: int = INFO, maxBytes: int = 1 << 20, backups: int = 3,
+                 maxTimingBytes: int = 16 << 20, capacity: int = 65536, interval: float = 0.05):
+        self.path = path
+        self.level = level
+        self.maxBytes = maxBytes
+        self.maxTimingBytes = maxTimingBytes
+        self.backups = backups
+        self.interval = interval
+        self.records = deque(maxlen=capacity)
+        self.dropped = 0
+        self.timingPath = None
+        self.timingFile = None
+        self.textFile = None
+        self.wake = Event()
+        # the writer waits for put() instead of the interval, nothing to write
+        self.idle = False
+        # only the writer thread and flush() drain, never the callers
+        self.drainLock = Lock()
+        self.running = True
+        self.now = time.time
+        self.thread = Thread(name='log', target=self.worker, daemon=True)
+        self.thread.start()
+
+    def configure(self, settings: dict):
+        """settings file form: {"level": "debug", "path": ..., "maxBytes": ..., "backups": ..., "timing": path}"""
+        self.level = levelOfName.get(str(settings.get("level", "info")).lower(), INFO)
+        self.path = settings.get("path", self.path)
+        self.maxBytes = settings.get("maxBytes", self.maxBytes)
+        self.backups = settings.get("backups", self.backups)
+        if settings.get("timing"):
+            self.setTimingPath(os.path.expanduser(settings["timing"]))
+
+    def put(self, record: tuple):
+        records = self.records
+        if len(records) == records.maxlen:
+            self.dropped += 1
+        records.append(record)
+        if self.idle:
+            self.idle = False
+            self.wake.set()
+
+    def log(self, level: int, text: str, *args):
+        if level >= self.level:
+            self.put((self.now(), level, text, args))
+
+    def debug(self, text: str, *args):
+        self.log(DEBUG, text, *args)
+
+    def info(self, text: str, *args):
+        self.log(INFO, text, *args)
+
+    def warning(self, text: str, *args):
+        self.log(WARNING, text, *args)
+
+    def error(self, text: str, *args):
+        self.log(ERROR, text, *args)
+
+    def setTimingPath(self, path: str):
+        """turns the binary timing records on (or off with None), see timingEnabled()"""
+        self.timingPath = path
+
+    def timingEnabled(self) -> bool:
+        return self.timingPath is not None
+
+    def timing(self, code: int, a: float, b: float, at: float = None):
+        """at is the clock time of the measurement, the wall clock if not given"""
+        self.put((self.now() if at is None else at, 0, code, (a, b)))
+
+    def worker(self):
+        while self.running:
+            if self.records:
+                # more records come in the same batch
+                self.wake.wait(self.interval)
+            else:
+                # idle is set before looking again, a record appended in between is seen here or wakes us
+                self.idle = True
+                if not self.records:
+                    self.wake.wait()
+                self.idle = False
+            self.wake.clear()
+            self.drain()
+        self.drain()
+
+    def drain(self):
+        with self.drainLock:
+            self.drainRecords()
+
+    def drainRecords(self):
+        records = self.records
+        lines = []
+        timings = []
+        while records:
+            at, level, what, args = records.popleft()
+            if level == 0:
+                timings.append(timingRecord.pack(at, what, 0, *args))
+            else:
+                lines.append(self.format(at, level, what, args))
+        if self.dropped:
+            lines.append(self.format(self.now(), WARNING, "%d log records dropped", (self.dropped,)))
+            self.dropped = 0
+        if lines:
+            self.writeText("".join(lines))
+        if timings and self.timingPath is not None:
+            self.writeTiming(b"".join(timings))
+
+    def format(self, at: float, level: int, text: str, args: tuple) -> str:
+        stamp = time.strftime("%H:%M:%S", time.localtime(at))
+        try:
+            text = text % args if args else text
+        except (TypeError, ValueError):
+            text = f"{text} {args}"
+        return f"{stamp}.{int(at % 1 * 1000000):06} {levelNames.get(level, level):7} {text}\n"
+
+    def rotated(self, file, path: str, mode: str, size: int, maxBytes: int):
+        """file opened on path (created on the first record), rotated first when size more would not fit"""
+        if file is not None and file.name != path:
+            file.close()
+            file = None
+        if file is None:
+            file = open(path, mode)
+        if 0 < file.tell() and file.tell() + size > maxBytes:
+            file.close()
+            rotate(path, self.backups)
+            file = open(path, mode)
+        return file
+
+    def writeText(self, text: str):
+        try:
+            self.textFile = self.rotated(self.textFile, self.path, "a", len(text), self.maxBytes)
+            self.textFile.write(text)
+            self.textFile.flush()
+        except OSError:
+            self.textFile = None
+
+    def writeTiming(self, data: bytes):
+        try:
+            self.timingFile = self.rotated(self.timingFile, self.timingPath, "ab", len(data), self.maxTimingBytes)
+            self.timingFile.write(data)
+            self.timingFile.flush()
+        except OSError:
+            self.timingFile = None
+
+    def flush(self):
+        """everything logged so far is in the files when this returns"""
+        self.drain()
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join(1)
+        for f in (self.textFile, self.timingFile):
+            if f is not None:
+                f.close()
+        self.textFile = self.timingFile = None
+
+
+def readTiming(path: str):
+    """(time, code, a, b) of every record of a binary timing file"""
+    with open(path, "rb") as f:
+        data = f.read()
+    for offset in range(0, len(data) - timingRecord.size + 1, timingRecord.size):
+        at, code, spare, a, b = timingRecord.unpack_from(data, offset)
+        yield at, code, a, b
+
+
+def main():
+    for path in sys.argv[1:]:
+        for at, code, a, b in readTiming(path):
+            print(f"{at:.6f} {timingNames.get(code, code):6} {a * 1000:9.3f} ms {b:g}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Speculative parsing of the midi files around the selection.
+
+SongCache keeps a bounded number of compiled songs (least recently used are
+dropped), Prefetcher fills it from a background thread with the files the UI
+announces via want(), nearest to the selection first. Files the UI needs
+itself are asked for with load(), ahead of the wanted ones, and handed back
+from that thread.
+"""
+
+import os
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
+from mido import MidiFile
+from smfplayout import smfsong
+
+
+def compileFile(path: str) -> smfsong:
+    return smfsong(MidiFile(path))
+
+
+class SongCache:
+    def __init__(self, capacity: int = 16):
+        self.capacity = capacity
+        self.songs = OrderedDict()
+        self.lock = Lock()
+
+    def key(self, path: str):
+        try:
+            return path, os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def lookup(self, key):
+        with self.lock:
+            song = self.songs.get(key)
+            if song is not None:
+                self.songs.move_to_end(key)
+            return song
+
+    def store(self, key, song: smfsong):
+        with self.lock:
+            self.songs[key] = song
+            self.songs.move_to_end(key)
+            while len(self.songs) > self.capacity:
+                self.songs.popitem(last=False)
+
+    def __contains__(self, path: str) -> bool:
+        key = self.key(path)
+        with self.lock:
+            return key in self.songs
+
+    def get(self, path: str) -> smfsong:
+        key = self.key(path)
+        song = self.lookup(key)
+        if song is None:
+            song = compileFile(path)
+            if key is not None:
+                self.store(key, song)
+        return song
+
+
+class Prefetcher:
+    def __init__(self, cache: SongCache):
+        self.cache = cache
+        self.wanted = []
+        self.requests = []
+        self.condition = Condition()
+        self.running = True
+        self.thread = Thread(name='prefetch', target=self.worker, daemon=True)
+        self.thread.start()
+
+    def want(self, paths: list):
+        """replaces the pending requests, paths are ordered by priority"""
+        with self.condition:
+            self.wanted = list(paths[:self.cache.capacity])
+            self.condition.notify()
+
+    def get(self, path: str) -> smfsong:
+        return self.cache.get(path)
+
+    def load(self, path: str, done):
+        """compiles path before the wanted files, done(path, song) is called from the prefetch thread,
+        song is None when the file cannot be read"""
+        with self.condition:
+            self.requests.append((path, done))
+            self.condition.notify()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.wanted and not self.requests:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                if self.requests:
+                    path, done = self.requests.pop(0)
+                else:
+                    path, done = self.wanted.pop(0), None
+            if done is not None:
+                try:
+                    song = self.cache.get(path)
+                except Exception:
+                    song = None
+                done(path, song)
+                continue
+            if path in self.cache:
+                continue
+            try:
+                self.cache.get(path)
+            except Exception:
+                # broken files are reported when they are actually played
+                pass
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+Per-file playback profiles, kept in ~/.cursedsmfplay/profiles.sqlite
+
+    store = ProfileStore(os.path.expanduser("~/.cursedsmfplay/profiles.sqlite"))
+    profile = store.get("/songs/intro.mid")
+    store.update("/songs/intro.mid", transpose=-2, tempo=1.05)
+
+A profile is a small dict, the fields the player knows are
+    transpose  semitones
+    tempo      tempo factor, 1.05 plays 5% faster
+    loop       [start, end] in seconds, end null for the end of the song
+    remap      channel mapping as on the command line, "10:11,1:2"
+    mute       channels as on the command line, "1,10"
+One row per file keyed by its absolute path: nothing is read at startup,
+get() is one lookup in the primary key when a file is selected and the
+answer is cached. Changes are collected for delay seconds after the last
+one and written by a thread in a single transaction, so a burst of key
+presses costs one write and a crash leaves either the old or the new rows.
+"""
+
+import json
+import sqlite3
+import time
+from threading import Thread, Event, Lock
+
+schema = "CREATE TABLE IF NOT EXISTS profiles (path TEXT PRIMARY KEY, profile TEXT NOT NULL, changed REAL NOT NULL)"
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=5)
+    # readers do not wait for the writer thread and the other way round
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(schema)
+    return connection
+
+
+class ProfileStore:
+    def __init__(self, path: str, delay: float = 1.0):
+        self.path = path
+        self.delay = delay
+        self.cache = dict()
+        self.pending = dict()
+        self.due = None
+        self.lock = Lock()
+        self.wake = Event()
+        self.reader = None
+        self.writer = None
+        self.running = True
+
+    def get(self, path: str) -> dict:
+        """the profile of a file, {} if it has none; do not change the returned dict, see update()"""
+        profile = self.cache.get(path)
+        if profile is not None:
+            return profile
+        try:
+            if self.reader is None:
+                self.reader = connect(self.path)
+            row = self.reader.execute("SELECT profile FROM profiles WHERE path = ?", (path,)).fetchone()
+            profile = json.loads(row[0]) if row is not None else {}
+        except (sqlite3.Error, ValueError):
+            profile = {}
+        self.cache[path] = profile
+        return profile
+
+    def update(self, path: str, **changes) -> dict:
+        """sets fields of the profile of a file, None removes a field; written after delay seconds"""
+        profile = dict(self.get(path))
+        for key, value in changes.items():
+            if value is None:
+                profile.pop(key, None)
+            else:
+                profile[key] = value
+        self.cache[path] = profile
+        with self.lock:
+            self.pending[path] = profile
+            self.due = time.monotonic() + self.delay
+        if self.writer is None:
+            self.writer = Thread(name='profiles', target=self.worker, daemon=True)
+            self.writer.start()
+        self.wake.set()
+        return profile
+
+    def worker(self):
+        connection = None
+        while True:
+            with self.lock:
+                due = self.due
+            if due is None:
+                if not self.running:
+                    break
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            wait = due - time.monotonic()
+            if wait > 0 and self.running:
+                # a newer change moves the write further out
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            with self.lock:
+                rows, self.pending, self.due = self.pending, dict(), None
+            try:
+                if connection is None:
+                    connection = connect(self.path)
+                self.write(connection, rows)
+            except sqlite3.Error:
+                if not self.running:
+                    break
+                with self.lock:
+                    # tried again later, newer values win
+                    self.pending = {**rows, **self.pending}
+                    self.due = time.monotonic() + self.delay
+        if connection is not None:
+            connection.close()
+
+    def write(self, connection: sqlite3.Connection, rows: dict):
+        now = time.time()
+        with connection:
+            connection.executemany("DELETE FROM profiles WHERE path = ?",
+                                   [(path,) for path, profile in rows.items() if not profile])
+            connection.executemany("INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                                   [(path, json.dumps(profile), now) for path, profile in rows.items() if profile])
+
+    def close(self):
+        """writes what is pending now"""
+        self.running = False
+        if self.writer is not None:
+            self.wake.set()
+            self.writer.join(5)
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
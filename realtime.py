@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in real-time treatment of the playing thread (Linux).
+
+    "realtime": {"cpus": [2, 3], "policy": "fifo", "priority": 50, "lockMemory": true}
+
+in the settings file (or --cpus, --sched, --priority, --mlock on the command
+line) pins the thread that calls applyRealtime() to those CPUs, asks for
+SCHED_FIFO or SCHED_RR and locks the pages of the process into memory.
+Without CAP_SYS_NICE / CAP_IPC_LOCK (or rtprio / memlock limits) a step just
+fails and the player runs as before; the report says what was granted.
+Only the pages present at the time are locked (MCL_CURRENT): locking future
+allocations too would turn a small memlock limit into MemoryErrors.
+"""
+
+import os
+
+MCL_CURRENT = 1
+
+policyNames = {"fifo": "SCHED_FIFO", "rr": "SCHED_RR"}
+
+try:
+    startCpus = sorted(os.sched_getaffinity(0))
+except (AttributeError, OSError):
+    startCpus = None
+
+
+class RealtimeOptions:
+    def __init__(self, cpus: set = None, policy: str = None, priority: int = 10, lockMemory: bool = False):
+        self.cpus = set(cpus) if cpus else None
+        if policy is not None and policy not in policyNames:
+            raise ValueError(f"unknown scheduling policy: {policy}")
+        self.policy = policy
+        self.priority = priority
+        self.lockMemory = lockMemory
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'RealtimeOptions':
+        return cls(data.get("cpus"), data.get("policy"), data.get("priority", 10), data.get("lockMemory", False))
+
+    def enabled(self) -> bool:
+        return bool(self.cpus or self.policy or self.lockMemory)
+
+
+def lockMemory():
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.mlockall(MCL_CURRENT) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def currentPolicy() -> tuple:
+    """(policy name, priority) of the calling thread"""
+    try:
+        policy = os.sched_getscheduler(0)
+        priority = os.sched_getparam(0).sched_priority
+    except (AttributeError, OSError):
+        return "other", 0
+    for name, constant in policyNames.items():
+        if policy == getattr(os, constant, None):
+            return name, priority
+    return "other", priority
+
+
+def applyRealtime(options: RealtimeOptions) -> dict:
+    """applies what is permitted to the calling thread, returns what it got and what failed"""
+    errors = []
+    if options.cpus:
+        try:
+            os.sched_setaffinity(0, options.cpus)
+        except (AttributeError, OSError, ValueError) as e:
+            errors.append(f"affinity: {e}")
+    if options.policy:
+        try:
+            policy = getattr(os, policyNames[options.policy])
+            priority = max(os.sched_get_priority_min(policy), min(os.sched_get_priority_max(policy), options.priority))
+            os.sched_setscheduler(0, policy, os.sched_param(priority))
+        except (AttributeError, OSError) as e:
+            errors.append(f"{options.policy}: {e}")
+    locked = False
+    if options.lockMemory:
+        try:
+            lockMemory()
+            locked = True
+        except (AttributeError, OSError) as e:
+            errors.append(f"mlock: {e}")
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = None
+    policy, priority = currentPolicy()
+    return {"cpus": cpus, "policy": policy, "priority": priority, "locked": locked, "errors": errors}
+
+
+def describe(report: dict) -> str:
+    """short form for the status view, e.g. 'fifo 50 cpu 2,3 mlock'"""
+    if report is None:
+        return "off"
+    text = report["policy"]
+    if report["policy"] != "other":
+        text += f" {report['priority']}"
+    if report["cpus"] is not None and report["cpus"] != startCpus:
+        text += " cpu " + ",".join(map(str, report["cpus"]))
+    if report["locked"]:
+        text += " mlock"
+    if report["errors"]:
+        text += f" ({len(report['errors'])} denied)"
+    return text
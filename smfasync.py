@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+asyncio interface of the player for embedding it in a service.
+
+    player = asyncplayer(output)
+    await player.load("song.mid")
+    await player.play(loops=2)
+    async for status in player.status():
+        ...
+
+The engine is the same smfplayout the curses player uses, driven by a task
+that awaits the event loop's timers instead of a thread sleeping on its own.
+Timers of the event loop are only good to a millisecond or so: with
+precise=True the last stretch before every deadline is waited in a worker
+thread of the default executor.
+"""
+
+import asyncio
+from functools import partial
+from prefetch import compileFile
+from smfplayout import smfplayout, smfsong
+from smfevents import smftransform
+
+preciseMargin = 0.002
+
+
+class asyncplayer:
+    def __init__(self, output, precise: bool = False, clock=None):
+        self.engine = smfplayout(output, clock)
+        self.precise = precise
+        self.song = None
+        self.task = None
+        self.snapshot = None
+        self.changed = asyncio.Condition()
+        self.wake = asyncio.Event()
+
+    async def load(self, path: str) -> smfsong:
+        """parses and compiles the file in the default executor"""
+        loop = asyncio.get_running_loop()
+        self.song = await loop.run_in_executor(None, compileFile, path)
+        return self.song
+
+    @property
+    def playing(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def play(self, loops: int = 1, transpose: int = 0, bars: int = None) -> asyncio.Task:
+        """starts the loaded song, a playing one is stopped first"""
+        if self.song is None:
+            raise RuntimeError("no song loaded")
+        await self.stop()
+        self.task = asyncio.get_running_loop().create_task(self.run(self.song, loops, transpose, bars))
+        return self.task
+
+    async def stop(self):
+        """returns when the task playing has sent its note offs, the engine is free for the next song then"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.wait([self.task])
+
+    def seek(self, seconds: float):
+        if self.playing:
+            self.engine.seek(seconds)
+            self.wake.set()
+
+    def setTransform(self, transform: smftransform):
+        self.engine.setTransform(transform)
+        self.wake.set()
+
+    def setTranspose(self, transpose: int):
+        self.setTransform(self.engine.transform.copy(transpose=transpose))
+
+    def update(self, task: asyncio.Task, info: dict):
+        self.snapshot = (task, info)
+        asyncio.get_running_loop().create_task(self.notify())
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def status(self):
+        """status snapshots (the dataInfo() dict) of the song playing, ends when it stops"""
+        task = self.task
+        while self.playing:
+            async with self.changed:
+                await self.changed.wait()
+            owner, info = self.snapshot
+            if owner is not task:
+                # the last status of the song played before
+                continue
+            yield info
+            if not info["playing"]:
+                return
+
+    async def waitUntil(self, deadline: float):
+        clock = self.engine.clock
+        delay = deadline - clock.now()
+        if self.precise:
+            delay -= preciseMargin
+        if delay > 0:
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+                # seek or a new transform, the deadline has moved
+                return
+            except asyncio.TimeoutError:
+                pass
+        if self.precise:
+            await asyncio.get_running_loop().run_in_executor(None, clock.sleepUntil, deadline)
+
+    async def run(self, song: smfsong, loops: int, transpose: int, bars: int):
+        engine = self.engine
+        update = partial(self.update, asyncio.current_task())
+        engine.loop = loops
+        engine.begin(song, transpose, bars)
+        try:
+            for i in range(loops):
+                engine.rewind()
+                while not engine.finished():
+                    await self.waitUntil(engine.nextDeadline())
+                    engine.step(update)
+        finally:
+            engine.finish(update)
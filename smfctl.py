@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Command line client of the player's control socket.
+
+    smfctl.py play ~/songs/intro.mid
+    smfctl.py --all stop
+    smfctl.py -s ~/.cursedsmfplay/control-1234.sock seek 30
+    smfctl.py transpose -2 ; smfctl.py tempo 1.05 ; smfctl.py loop on
+    smfctl.py profile '{"mute": "10", "loop": [8, 24]}'
+    smfctl.py layer '{"path": "bass.mid", "transpose": -12, "port": "rtmidi:bass"}'
+    smfctl.py layer '{"id": 1, "mute": "10"}' ; smfctl.py layers
+    smfctl.py watch
+
+Without -s the default socket of the first player is used, --all sends the
+command to every running player.
+"""
+
+import argparse
+import glob
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+defaultSocket = f"{Path.home()}/.cursedsmfplay/control.sock"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('-s', '--socket', dest='sockets', action='append', default=[], help='control socket, may be repeated')
+    arg('--all', dest='all', action='store_true', default=False, help='every player found in ~/.cursedsmfplay')
+    arg('command', choices=['load', 'play', 'stop', 'seek', 'transpose', 'tempo', 'loop', 'profile', 'layer',
+                            'layers', 'status', 'watch'])
+    arg('value', nargs='?', default=None,
+        help='file, seconds, semitones, tempo factor, on/off, profile fields or a layer as JSON')
+    return parser.parse_args()
+
+
+def buildCommand(name: str, value: str) -> dict:
+    command = {"cmd": name}
+    if name in ('load', 'play') and value is not None:
+        command["path"] = os.path.abspath(os.path.expanduser(value))
+    elif name == 'seek':
+        command["seconds"] = float(value)
+    elif name == 'transpose':
+        command["value"] = int(value)
+    elif name == 'tempo':
+        command["factor"] = float(value)
+    elif name == 'loop' and value is not None:
+        command["value"] = value
+    elif name == 'profile' and value is not None:
+        command["fields"] = json.loads(value)
+    elif name == 'layer' and value is not None:
+        command.update(json.loads(value))
+        if "path" in command:
+            command["path"] = os.path.abspath(os.path.expanduser(command["path"]))
+    return command
+
+
+def request(path: str, command: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(path)
+        sock.sendall(json.dumps(command).encode() + b"\n")
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def watch(paths: list):
+    """prints the status events of all players until interrupted"""
+    import selectors
+    selector = selectors.DefaultSelector()
+    for path in paths:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        sock.sendall(b'{"cmd": "subscribe"}\n')
+        selector.register(sock, selectors.EVENT_READ, [path, b""])
+    while selector.get_map():
+        for key, mask in selector.select():
+            data = key.fileobj.recv(65536)
+            if not data:
+                selector.unregister(key.fileobj)
+                continue
+            key.data[1] += data
+            while b"\n" in key.data[1]:
+                line, key.data[1] = key.data[1].split(b"\n", 1)
+                print(f"{key.data[0]}: {line.decode()}", flush=True)
+
+
+def main():
+    args = parse_args()
+    paths = args.sockets
+    if args.all:
+        paths += sorted(glob.glob(f"{Path.home()}/.cursedsmfplay/control*.sock"))
+    if not paths:
+        paths = [defaultSocket]
+    if args.command == 'watch':
+        try:
+            watch(paths)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        return 0
+    command = buildCommand(args.command, args.value)
+    failed = 0
+    for path in paths:
+        try:
+            reply = request(path, command)
+        except OSError as e:
+            reply = {"ok": False, "error": str(e)}
+        if not reply.get("ok"):
+            failed += 1
+        print(f"{path}: {json.dumps(reply)}" if len(paths) > 1 else json.dumps(reply))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
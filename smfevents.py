@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""
+Compact event store of a compiled song.
+
+Every event is one slot in parallel typed arrays (time in seconds, status,
+data1, data2, track), about 13 bytes instead of a mido object per event.
+Sysex, meta and the rare system messages keep their payload in a side table
+indexed by event number.
+The transforms work on whole arrays at once with bytes.translate() and big
+integer masks, so they run in C and never touch events one by one.
+Events sharing a time form a group (a chord, a drum hit), the player sends a
+group as one burst without looking at the clock in between.
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from operator import ne
+
+
+def statusTable(low: int, high: int) -> bytes:
+    """translation table giving 0xff for status bytes in low..high and 0 otherwise"""
+    return bytes(0xFF if low <= s <= high else 0 for s in range(256))
+
+
+noteTable = statusTable(0x80, 0xAF)
+noteOnTable = statusTable(0x90, 0x9F)
+systemTable = bytes(1 if s >= 0xF0 else 0 for s in range(256))
+
+
+def blend(original: bytes, changed: bytes, mask: bytes) -> bytes:
+    """takes the bytes of changed where mask is 0xff, of original elsewhere"""
+    a = int.from_bytes(original, 'little')
+    b = int.from_bytes(changed, 'little')
+    m = int.from_bytes(mask, 'little')
+    return (a ^ ((a ^ b) & m)).to_bytes(len(original), 'little')
+
+
+def clampTable(function) -> bytes:
+    return bytes(max(0, min(127, int(function(v)))) for v in range(256))
+
+
+class smfevents:
+    def __init__(self, times: array = None, status: array = None, data1: array = None, data2: array = None,
+                 track: array = None, payloads: dict = None):
+        self.times = times if times is not None else array('d')
+        self.status = status if status is not None else array('B')
+        self.data1 = data1 if data1 is not None else array('B')
+        self.data2 = data2 if data2 is not None else array('B')
+        self.track = track if track is not None else array('H')
+        self.payloads = payloads if payloads is not None else dict()
+        self.masks = dict()
+        self.groupStarts = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, seconds: float, status: int, data1: int, data2: int, track: int, payload=None):
+        if payload is not None:
+            self.payloads[len(self.times)] = payload
+        self.times.append(seconds)
+        self.status.append(status)
+        self.data1.append(data1)
+        self.data2.append(data2)
+        self.track.append(track)
+
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.times, self.status, self.data1, self.data2, self.track))
+
+    def mask(self, table: bytes) -> bytes:
+        if table not in self.masks:
+            self.masks[table] = self.status.tobytes().translate(table)
+        return self.masks[table]
+
+    def groups(self) -> array:
+        """index of the first event of every run of equal times, len(self) as the last entry"""
+        if self.groupStarts is None or self.groupStarts[-1] != len(self.times):
+            times = self.times
+            starts = array('L', [0] if times else [])
+            starts.extend(compress(range(1, len(times)), map(ne, times[1:], times)))
+            starts.append(len(times))
+            self.groupStarts = starts
+        return self.groupStarts
+
+    def derive(self, status: bytes = None, data1: bytes = None, data2: bytes = None) -> 'smfevents':
+        """a new store sharing times, tracks and payloads with replaced byte columns"""
+        derived = smfevents(self.times,
+                            self.status if status is None else array('B', status),
+                            self.data1 if data1 is None else array('B', data1),
+                            self.data2 if data2 is None else array('B', data2),
+                            self.track, self.payloads)
+        derived.groupStarts = self.groupStarts
+        return derived
+
+    def transposed(self, semitones: int) -> 'smfevents':
+        """note on/off and polyphonic pressure moved by semitones, clamped to 0..127"""
+        if semitones == 0:
+            return self
+        original = self.data1.tobytes()
+        changed = original.translate(clampTable(lambda v: v + semitones))
+        return self.derive(data1=blend(original, changed, self.mask(noteTable)))
+
+    def velocityScaled(self, table: bytes) -> 'smfevents':
+        """note on velocities mapped through a 256 byte table, velocity 0 stays a note off"""
+        table = b"\0" + table[1:]
+        original = self.data2.tobytes()
+        return self.derive(data2=blend(original, original.translate(table), self.mask(noteOnTable)))
+
+    def channelRemapped(self, mapping: dict) -> 'smfevents':
+        """mapping of channel (0..15) to channel, system messages are kept"""
+        table = bytearray(range(256))
+        for s in range(0x80, 0xF0):
+            table[s] = (s & 0xF0) | mapping.get(s & 0x0F, s & 0x0F)
+        return self.derive(status=self.status.tobytes().translate(bytes(table)))
+
+    def filtered(self, keep: bytes) -> 'smfevents':
+        """only the events where keep is 1, the payload table follows the new numbering"""
+        if keep.count(0) == 0:
+            return self
+        kept = array('L', compress(range(len(keep)), keep))
+        payloads = dict()
+        for index, payload in self.payloads.items():
+            if keep[index]:
+                payloads[bisect_left(kept, index)] = payload
+        return smfevents(array('d', compress(self.times, keep)),
+                         array('B', compress(self.status, keep)),
+                         array('B', compress(self.data1, keep)),
+                         array('B', compress(self.data2, keep)),
+                         array('H', compress(self.track, keep)),
+                         payloads)
+
+
+def velocityTable(scale: float = 1.0, curve: float = 1.0) -> bytes:
+    """256 byte velocity mapping, curve < 1 lifts soft notes, > 1 lowers them"""
+    return bytes([0] + [max(1, min(127, round(127 * (v / 127) ** curve * scale))) for v in range(1, 256)])
+
+
+channelOfTable = bytes(s & 0x0F if 0x80 <= s < 0xF0 else 16 for s in range(256))
+
+
+def maskAnd(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'little') & int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def maskOr(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, 'little') | int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+class smftransform:
+    """
+    output shaping of the player: every step works on whole event arrays, the
+    result is a new smfevents store the player swaps in as one reference.
+    Meta, sysex and system messages always pass.
+    """
+    def __init__(self, transpose: int = 0, mute: set = None, solo: set = None, channelMap: dict = None,
+                 velocityScale: float = 1.0, velocityCurve: float = 1.0, noteRange: tuple = (0, 127),
+                 disabledTracks: set = None):
+        self.transpose = transpose
+        self.mute = set(mute or ())
+        self.solo = set(solo or ())
+        self.channelMap = dict(channelMap or {})
+        self.velocityScale = velocityScale
+        self.velocityCurve = velocityCurve
+        self.noteRange = noteRange
+        self.disabledTracks = set(disabledTracks or ())
+
+    def copy(self, **changes) -> 'smftransform':
+        values = dict(vars(self))
+        values.update(changes)
+        return smftransform(**values)
+
+    def channelKeep(self, events: smfevents) -> bytes:
+        """1 for events of audible channels, judged before the remapping"""
+        table = bytearray(256)
+        for channel in range(16):
+            audible = channel not in self.mute and (not self.solo or channel in self.solo)
+            table[channel] = 1 if audible else 0
+        table[16] = 1
+        return events.status.tobytes().translate(channelOfTable).translate(bytes(table))
+
+    def apply(self, events: smfevents) -> smfevents:
+        notes = events.mask(noteTable)
+        keep = None
+        if self.mute or self.solo:
+            keep = self.channelKeep(events)
+        low, high = self.noteRange
+        if low > 0 or high < 127:
+            inRange = bytes(1 if low <= v <= high else 0 for v in range(256))
+            # the range applies to notes only, everything else passes
+            passing = events.data1.tobytes().translate(inRange)
+            passing = maskOr(passing, notes.translate(bytes([1] + [0] * 255)))
+            keep = passing if keep is None else maskAnd(keep, passing)
+        if self.disabledTracks:
+            disabled = bytes(map(self.disabledTracks.__contains__, events.track))
+            passing = maskOr(disabled.translate(bytes([1, 0] + [0] * 254)), events.mask(systemTable))
+            keep = passing if keep is None else maskAnd(keep, passing)
+        if keep is not None:
+            events = events.filtered(keep)
+        events = events.transposed(self.transpose)
+        if self.velocityScale != 1.0 or self.velocityCurve != 1.0:
+            events = events.velocityScaled(velocityTable(self.velocityScale, self.velocityCurve))
+        if self.channelMap:
+            events = events.channelRemapped(self.channelMap)
+        # grouped here, off the playing thread
+        events.groups()
+        return events
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+Batch export of processed midi files.
+
+Every file is compiled like for playing, run through the player's transform
+(transpose, mute/solo, remap, velocity, note range, tracks), optionally tempo
+scaled and unrolled for a number of loops, and written as SMF type 0.
+Files are handled by a pool of worker processes, each one streams its events
+straight into the output file and renames it into place when complete.
+
+    smfexport.py -o ~/tour --transpose -2 --loops 4 smf-explore/
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from mido import MidiFile
+from smfindex import midiRegex
+from smfplayout import smfsong, addTransformArgs, transformFromArgs
+from smfevents import smftransform
+
+
+def varlen(value: int) -> bytes:
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+class smfwriter:
+    """writes a type 0 file event by event, the track length is patched in on close"""
+    def __init__(self, path: str, ticks_per_beat: int):
+        self.path = path
+        self.tmpName = path + ".tmp"
+        self.f = open(self.tmpName, "wb")
+        self.f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, ticks_per_beat))
+        self.f.write(b"MTrk\0\0\0\0")
+        self.trackStart = self.f.tell()
+        self.tick = 0
+
+    def write(self, tick: int, data: bytes):
+        self.f.write(varlen(tick - self.tick) + data)
+        self.tick = tick
+
+    def close(self, tick: int = 0):
+        """ends the track at tick or at the last event, whatever comes later"""
+        self.f.write(varlen(max(0, tick - self.tick)) + b"\xFF\x2F\0")
+        length = self.f.tell() - self.trackStart
+        self.f.seek(self.trackStart - 4)
+        self.f.write(struct.pack(">I", length))
+        self.f.close()
+        os.replace(self.tmpName, self.path)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.tmpName)
+
+
+def exportSong(song: smfsong, path: str, transform: smftransform = None, tempoFactor: float = 1.0,
+               loops: int = 1) -> int:
+    """writes the song as heard, returns the number of events written"""
+    events = song.events if transform is None else transform.apply(song.events)
+    tpb = song.ticks_per_beat
+    times, status, data1, data2, payloads = events.times, events.status, events.data1, events.data2, events.payloads
+    writer = smfwriter(path, tpb)
+    count = 0
+    tempoAtStart = any(times[i] == 0 and getattr(p, 'type', None) == 'set_tempo' for i, p in payloads.items())
+    try:
+        loopStart = 0
+        for loop in range(loops):
+            if not tempoAtStart:
+                # the song relies on the default tempo, which has to be scaled and restored every loop
+                writer.write(loopStart, b"\xFF\x51\x03" + round(500000 / tempoFactor).to_bytes(3, 'big'))
+            # seconds back to ticks from the last tempo change, so rounding never adds up
+            tempo = 500000
+            tempoSeconds = 0.0
+            tempoTick = loopStart
+            tick = loopStart
+            for index in range(len(times)):
+                tick = tempoTick + round((times[index] - tempoSeconds) * 1000000 / tempo * tpb)
+                s = status[index]
+                if s < 0xF0:
+                    if s >= 0xC0 and s < 0xE0:
+                        data = bytes((s, data1[index]))
+                    else:
+                        data = bytes((s, data1[index], data2[index]))
+                elif s == 0xFF:
+                    msg = payloads[index]
+                    if msg.type == 'set_tempo':
+                        tempo = msg.tempo
+                        tempoSeconds = times[index]
+                        tempoTick = tick
+                        data = b"\xFF\x51\x03" + round(msg.tempo / tempoFactor).to_bytes(3, 'big')
+                    else:
+                        data = bytes(msg.bytes())
+                elif s == 0xF0:
+                    data = b"\xF0" + varlen(len(payloads[index]) - 1) + payloads[index][1:]
+                else:
+                    # system common and real time messages have no place in a file
+                    continue
+                writer.write(tick, data)
+                count += 1
+            # the next pass starts where the longest track of the source ends
+            loopStart += song.lengthTicks
+        writer.close(loopStart)
+    except BaseException:
+        writer.abort()
+        raise
+    return count
+
+
+def exportFile(job: tuple) -> tuple:
+    source, target, transform, tempoFactor, loops = job
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        count = exportSong(smfsong(MidiFile(source)), target, transform, tempoFactor, loops)
+    except Exception as e:
+        return source, target, f"failed: {e}"
+    return source, target, f"{count} events in {time.perf_counter() - start:.3f}s"
+
+
+def collectJobs(paths: list, outDir: str, transform: smftransform, tempoFactor: float, loops: int) -> list:
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if d[0] != '.')
+                for name in sorted(filenames):
+                    if midiRegex.match(name):
+                        source = os.path.join(dirpath, name)
+                        target = os.path.join(outDir, os.path.relpath(source, path))
+                        jobs.append((source, target, transform, tempoFactor, loops))
+        else:
+            jobs.append((path, os.path.join(outDir, os.path.basename(path)), transform, tempoFactor, loops))
+    return jobs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('-o', '--output', dest='output', required=True, help='directory for the exported files')
+    arg('-j', '--jobs', dest='jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    arg('--tempo', dest='tempoFactor', type=float, default=1.0, help='tempo factor, 1.1 is 10%% faster')
+    arg('--loops', dest='loops', type=int, default=1, help='number of times the song is written out')
+    addTransformArgs(parser)
+    arg('files', metavar='FILE', nargs='+', help='MIDI files or directories to export')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    jobs = collectJobs(args.files, args.output, transformFromArgs(args), args.tempoFactor, args.loops)
+    for job in jobs:
+        if os.path.abspath(job[0]) == os.path.abspath(job[1]):
+            print(f"{job[0]}: refusing to overwrite the source", file=sys.stderr)
+            return 1
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for source, target, result in pool.map(exportFile, jobs, chunksize=4):
+            print(f"{source} -> {target}: {result}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+"""
+In-memory index of a midi library for incremental searching.
+
+The metadata (tempo, signature, key, length) of every midi file below a root
+directory is extracted once and kept in ~/.cursedsmfplay/index.json keyed by
+path and mtime, so only new or changed files are parsed again.
+A search query is a list of terms separated by blanks:
+    rhodes var      fuzzy match on the path (characters in order)
+    7/8             time signature
+    bpm:80-100      tempo range, bpm:120 for +-1 bpm
+    key:Em          key signature
+    len:<90         length in seconds, also len:>60 or len:60-120
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from copy import copy
+from heapq import merge
+from itertools import compress, repeat
+from pathlib import Path
+from threading import Thread, Lock
+from mido import MidiFile, tempo2bpm
+
+midiRegex = re.compile(r".*\.(midi?|kar)$", re.IGNORECASE)
+
+
+def extractInfo(path: str) -> dict:
+    midi_data = MidiFile(path)
+    info = {"bpm": 120.0, "signature": "4/4", "key": "", "length": 0.0}
+    tempoFound = signatureFound = False
+    for track in midi_data.tracks:
+        for msg in track:
+            if msg.type == 'set_tempo' and not tempoFound:
+                info["bpm"] = round(tempo2bpm(msg.tempo), 2)
+                tempoFound = True
+            elif msg.type == 'time_signature' and not signatureFound:
+                info["signature"] = f"{msg.numerator}/{msg.denominator}"
+                signatureFound = True
+            elif msg.type == 'key_signature' and not info["key"]:
+                info["key"] = msg.key
+    try:
+        info["length"] = round(midi_data.length, 2)
+    except ValueError:
+        pass
+    return info
+
+
+bitDigits = bytes.maketrans(b"\x00\x01", b"01")
+
+
+def bitsOf(flags) -> int:
+    """packs an iterable of booleans (index 0 first) into an int used as bitset"""
+    digits = bytes(flags).translate(bitDigits)
+    if not digits:
+        return 0
+    return int(digits[::-1], 2)
+
+
+bitTable = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def setBits(bits: int) -> list:
+    digits = bin(bits)[:1:-1].encode().translate(bitTable)
+    return list(compress(range(len(digits)), digits))
+
+
+def laneInt(values: array) -> int:
+    """an array of 16 bit values as one int, value i in bits 16 * i to 16 * i + 15"""
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return int.from_bytes(values.tobytes(), 'little')
+
+
+carryDigits = bytes.maketrans(b"\x00\x80", b"01")
+
+
+def firstPositions(text: str) -> dict:
+    # a dict keeps the last value given for a key, so the text goes backwards
+    return dict(zip(reversed(text), range(len(text) - 1, -1, -1)))
+
+
+def lastPositions(text: str) -> dict:
+    return dict(zip(text, range(len(text))))
+
+
+def parseRange(text: str, tolerance: float):
+    if text.startswith('<'):
+        return float('-inf'), float(text[1:])
+    if text.startswith('>'):
+        return float(text[1:]), float('inf')
+    if '-' in text:
+        low, high = text.split('-', 1)
+        return float(low), float(high)
+    value = float(text)
+    return value - tolerance, value + tolerance
+
+
+class IndexSnapshot:
+    """
+    immutable search structures, replaced as a whole when the index changes.
+    Every filter is a python int used as bitset over the entries, so combining
+    terms costs a few big integer ANDs regardless of the library size.
+    For the order of the characters of a fuzzy term every character has two
+    ints with a 16 bit lane per entry, 0x7FFF minus its first position and its
+    last position (0 where it is missing). Adding those of a and b carries
+    into the top bit of a lane exactly where a comes before b, one addition
+    checks a pair of characters in all entries at once.
+    Entries are in path order, updated() appends changed entries behind them
+    and masks out the old ones until the next full build.
+    """
+    bpmBuckets = 400
+    lengthBuckets = 1801
+
+    def __init__(self, entries: dict):
+        self.paths = sorted(entries)
+        self.infos = [entries[p] for p in self.paths]
+        self.lowered = [p.lower() for p in self.paths]
+        self.slots = {p: i for i, p in enumerate(self.paths)}
+        self.sortedCount = len(self.paths)
+        self.all = (1 << len(self.paths)) - 1
+        self.count = len(self.paths)
+        self.signatureBits = {}
+        self.keyBits = {}
+        self.bpmBits = [0] * self.bpmBuckets
+        self.lengthBits = [0] * self.lengthBuckets
+        signatures = {}
+        keys = {}
+        bpms = {}
+        lengths = {}
+        for i, info in enumerate(self.infos):
+            signatures.setdefault(info["signature"], []).append(i)
+            keys.setdefault(info["key"].lower(), []).append(i)
+            bpms.setdefault(self.bucket(info["bpm"], self.bpmBuckets), []).append(i)
+            lengths.setdefault(self.bucket(info["length"], self.lengthBuckets), []).append(i)
+        for table, groups in ((self.signatureBits, signatures), (self.keyBits, keys),
+                              (self.bpmBits, bpms), (self.lengthBits, lengths)):
+            for name, indices in groups.items():
+                table[name] = self.indexBits(indices)
+        self.setLanes()
+        self.firsts, self.lasts = self.positions()
+
+    def __len__(self):
+        return self.count
+
+    def positions(self) -> tuple:
+        """the lane ints of every character, see the class comment"""
+        lowered = self.lowered
+        low = self.present
+        ones = int.from_bytes(b"\x01\x00" * len(lowered), 'little')
+        firsts = {}
+        lasts = {}
+        for c in set().union(*lowered):
+            # find() gives -1 (0xFFFF in a lane) where c is missing, those lanes become 0
+            found = laneInt(array('h', map(str.find, lowered, repeat(c))))
+            firsts[c] = (found ^ low) & low
+            found = laneInt(array('h', map(str.rfind, lowered, repeat(c))))
+            lasts[c] = (found & low) - (found >> 15 & ones) * 0x7FFF
+        return firsts, lasts
+
+    def setLanes(self):
+        n = len(self.paths)
+        self.carries = int.from_bytes(b"\x00\x80" * n, 'little')
+        # 0x7FFF in every lane, carries where a first position is there
+        self.present = int.from_bytes(b"\xff\x7f" * n, 'little')
+
+    def updated(self, paths, entries: dict) -> 'IndexSnapshot':
+        """a copy without paths, then with the entries appended; this snapshot stays as it is"""
+        snapshot = copy(self)
+        slots = snapshot.slots = dict(self.slots)
+        live = self.all
+        for path in paths:
+            slot = slots.pop(path, None)
+            if slot is not None:
+                live &= ~(1 << slot)
+        snapshot.paths = self.paths + list(entries)
+        snapshot.infos = self.infos + list(entries.values())
+        snapshot.lowered = self.lowered + [p.lower() for p in entries]
+        snapshot.signatureBits = dict(self.signatureBits)
+        snapshot.keyBits = dict(self.keyBits)
+        snapshot.bpmBits = list(self.bpmBits)
+        snapshot.lengthBits = list(self.lengthBits)
+        snapshot.firsts = firsts = dict(self.firsts)
+        snapshot.lasts = lasts = dict(self.lasts)
+        for i, (path, info) in enumerate(entries.items(), len(self.paths)):
+            bit = 1 << i
+            slots[path] = i
+            live |= bit
+            signature = info["signature"]
+            snapshot.signatureBits[signature] = snapshot.signatureBits.get(signature, 0) | bit
+            key = info["key"].lower()
+            snapshot.keyBits[key] = snapshot.keyBits.get(key, 0) | bit
+            snapshot.bpmBits[self.bucket(info["bpm"], self.bpmBuckets)] |= bit
+            snapshot.lengthBits[self.bucket(info["length"], self.lengthBuckets)] |= bit
+            text = path.lower()
+            shift = 16 * i
+            for c, at in firstPositions(text).items():
+                firsts[c] = firsts.get(c, 0) | (0x7FFF - at) << shift
+            for c, at in lastPositions(text).items():
+                lasts[c] = lasts.get(c, 0) | at << shift
+        snapshot.all = live
+        snapshot.count = live.bit_count()
+        snapshot.setLanes()
+        return snapshot
+
+    def appended(self) -> int:
+        return len(self.paths) - self.sortedCount
+
+    def bucket(self, value: float, buckets: int) -> int:
+        return max(0, min(buckets - 1, int(round(value))))
+
+    def indexBits(self, indices: list) -> int:
+        flags = bytearray(len(self.paths))
+        for i in indices:
+            flags[i] = 1
+        return bitsOf(flags)
+
+    def rangeBits(self, table: list, low: float, high: float) -> int:
+        if low > high:
+            return 0
+        bits = 0
+        first = self.bucket(max(low, 0), len(table))
+        last = self.bucket(min(high, len(table) - 1), len(table))
+        for bucket in table[first:last + 1]:
+            if bucket:
+                bits |= bucket
+        return bits
+
+    def fuzzyLanes(self, term: str) -> int:
+        """lanes with the top bit set for the entries with the characters of term in order, exact up to two
+        characters; longer terms are checked again in matches()"""
+        firsts, lasts = self.firsts, self.lasts
+        if len(term) == 1:
+            return firsts.get(term, 0) + self.present
+        lanes = -1
+        for a, b in zip(term, term[1:]):
+            lanes &= firsts.get(a, 0) + lasts.get(b, 0)
+        return lanes
+
+    def laneBits(self, lanes: int) -> int:
+        """the top bits of the lanes as a bitset over the entries"""
+        digits = (lanes & self.carries).to_bytes(2 * len(self.paths), 'little')[1::2].translate(carryDigits)
+        if not digits:
+            return 0
+        return int(digits[::-1], 2)
+
+    def matches(self, indices: list, term: str) -> list:
+        # every character at its first place after the one before: no backtracking, one pass over the path
+        pattern = re.compile("".join(f"[^{re.escape(c)}]*{re.escape(c)}" for c in term))
+        lowered = self.lowered
+        return [i for i in indices if pattern.match(lowered[i])]
+
+    def ordered(self, bits: int, block: int = 4096):
+        """the entries of bits in path order, a list per block of entries"""
+        paths = self.paths
+        head = bits & ((1 << self.sortedCount) - 1)
+        tail = sorted((i + self.sortedCount for i in setBits(bits >> self.sortedCount)), key=paths.__getitem__)
+        mask = (1 << block) - 1
+        for first in range(0, self.sortedCount, block):
+            chunk = (head >> first) & mask
+            if not chunk:
+                continue
+            indices = [first + i for i in setBits(chunk)]
+            if tail:
+                # appended entries go in between
+                k = bisect_right(tail, paths[indices[-1]], key=paths.__getitem__)
+                if k:
+                    indices = list(merge(indices, tail[:k], key=paths.__getitem__))
+                    tail = tail[k:]
+            yield indices
+        if tail:
+            yield tail
+
+
+class SearchResult:
+    """
+    matching entries of one search, found block by block as rows are shown.
+    Without terms longer than two characters every candidate matches and
+    len() is exact from the start, otherwise it counts the rows found so far
+    until complete.
+    """
+    firstRows = 200
+
+    def __init__(self, snapshot: IndexSnapshot, bits: int = 0, terms: list = ()):
+        self.snapshot = snapshot
+        self.indices = []
+        self.blocks = snapshot.ordered(bits)
+        self.terms = list(terms)
+        self.total = None if self.terms else bits.bit_count()
+        self.complete = False
+        self.find(self.firstRows)
+
+    def find(self, rows: int):
+        """checks candidates until there are rows matches or none are left"""
+        while len(self.indices) < rows and not self.complete:
+            indices = next(self.blocks, None)
+            if indices is None:
+                self.complete = True
+                break
+            for term in self.terms:
+                indices = self.snapshot.matches(indices, term)
+            self.indices.extend(indices)
+
+    def exact(self) -> bool:
+        return self.complete or self.total is not None
+
+    def __len__(self):
+        if self.total is not None:
+            return self.total
+        return len(self.indices)
+
+    def __getitem__(self, row: int) -> str:
+        self.find(row + 1)
+        return self.snapshot.paths[self.indices[row]]
+
+    def info(self, row: int) -> dict:
+        self.find(row + 1)
+        return self.snapshot.infos[self.indices[row]]
+
+
+class SmfIndex:
+    def __init__(self, root: str, cacheFileName: str = None):
+        self.root = os.path.abspath(root)
+        if cacheFileName is None:
+            cacheFileName = f"{Path.home()}/.cursedsmfplay/index.json"
+        self.cacheFileName = cacheFileName
+        self.entries = {}
+        self.mtimes = {}
+        self.lock = Lock()
+        self.snapshot = IndexSnapshot({})
+        self.building = False
+        self.onPublish = None
+
+    def loadCache(self):
+        try:
+            with open(self.cacheFileName, "r") as f:
+                data = json.load(f)
+            if data.get("root") == self.root:
+                return data["files"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return {}
+
+    def saveCache(self):
+        with self.lock:
+            files = {p: [self.mtimes[p], self.entries[p]] for p in self.entries}
+        tmpName = f"{self.cacheFileName}.tmp"
+        try:
+            with open(tmpName, "w") as f:
+                json.dump({"root": self.root, "files": files}, f)
+            os.replace(tmpName, self.cacheFileName)
+        except OSError:
+            pass
+
+    def walk(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d[0] != '.']
+            for name in filenames:
+                if midiRegex.match(name):
+                    yield os.path.join(dirpath, name)
+
+    def build(self):
+        cached = self.loadCache()
+        entries = {}
+        mtimes = {}
+        for path in self.walk():
+            rel = os.path.relpath(path, self.root)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if rel in cached and cached[rel][0] == mtime:
+                    info = cached[rel][1]
+                else:
+                    info = extractInfo(path)
+            except Exception:
+                continue
+            entries[rel] = info
+            mtimes[rel] = mtime
+        with self.lock:
+            self.entries = entries
+            self.mtimes = mtimes
+            self.publish()
+        self.saveCache()
+
+    def buildInBackground(self):
+        def worker():
+            self.building = True
+            try:
+                self.build()
+            finally:
+                self.building = False
+        Thread(name='indexer', target=worker, daemon=True).start()
+
+    def publish(self, paths=None, entries: dict = None):
+        """a new snapshot: built from scratch, or with paths taken out and entries added to the current one"""
+        snapshot = self.snapshot
+        if paths is None or snapshot.appended() + len(entries) > max(1024, len(snapshot) // 16):
+            self.snapshot = IndexSnapshot(self.entries)
+        else:
+            self.snapshot = snapshot.updated(paths, entries)
+        if self.onPublish is not None:
+            self.onPublish()
+
+    def refresh(self, paths):
+        """re-reads the given absolute paths, e.g. the stale entries reported by the directory watcher"""
+        changed = []
+        added = {}
+        for path in paths:
+            if not path.startswith(self.root + os.sep):
+                continue
+            rel = os.path.relpath(path, self.root)
+            with self.lock:
+                self.entries.pop(rel, None)
+                self.mtimes.pop(rel, None)
+            changed.append(rel)
+            if os.path.isfile(path) and midiRegex.match(path):
+                try:
+                    info = extractInfo(path)
+                    mtime = os.stat(path).st_mtime_ns
+                except Exception:
+                    continue
+                with self.lock:
+                    self.entries[rel] = info
+                    self.mtimes[rel] = mtime
+                added[rel] = info
+        if changed:
+            with self.lock:
+                self.publish(changed, added)
+
+    def refreshInBackground(self, paths):
+        paths = list(paths)
+        if paths:
+            Thread(name='indexer', target=self.refresh, args=(paths,), daemon=True).start()
+
+    def search(self, query: str) -> SearchResult:
+        """returns the matching paths relative to root"""
+        snapshot = self.snapshot
+        bits = snapshot.all
+        lanes = -1
+        ordered = []
+        for term in query.lower().split():
+            try:
+                if term.startswith("bpm:"):
+                    low, high = parseRange(term[4:], 1)
+                    bits &= snapshot.rangeBits(snapshot.bpmBits, low, high)
+                elif term.startswith("len:"):
+                    low, high = parseRange(term[4:], 5)
+                    bits &= snapshot.rangeBits(snapshot.lengthBits, low, high)
+                elif term.startswith("key:"):
+                    bits &= snapshot.keyBits.get(term[4:], 0)
+                elif re.fullmatch(r"\d+/\d+", term):
+                    bits &= snapshot.signatureBits.get(term, 0)
+                else:
+                    lanes &= snapshot.fuzzyLanes(term)
+                    if len(term) > 2:
+                        ordered.append(term)
+            except ValueError:
+                # incomplete range while typing, e.g. "bpm:80-"
+                continue
+            if not bits:
+                return SearchResult(snapshot)
+        if lanes != -1:
+            bits &= snapshot.laneBits(lanes)
+        return SearchResult(snapshot, bits, ordered)
+
+    def info(self, rel: str) -> dict:
+        return self.entries.get(rel)
+
+
+if __name__ == '__main__':
+    index = SmfIndex(sys.argv[1] if len(sys.argv) > 1 else os.getcwd())
+    start = time.time()
+    index.build()
+    print(f"indexed {len(index.snapshot)} files in {time.time() - start:.3f}s")
+    for query in sys.argv[2:]:
+        start = time.time()
+        result = index.search(query)
+        more = "" if result.exact() else "+"
+        print(f"{query!r}: {len(result)}{more} matches in {1000 * (time.time() - start):.2f}ms")
+        for row in range(min(20, len(result))):
+            print(f"    {result[row]} {result.info(row)}")
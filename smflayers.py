@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+"""
+Several songs played at once as layers.
+
+All layers share one scheduler thread with a deadline heap: the thread sleeps
+until the earliest event of any layer, sends what is due and goes back to
+sleep, adding or removing a layer wakes it up.
+A synced layer starts on the next bar of the master, is stretched to the
+master's tempo and loops on whole bars: the master is the player given to
+follow() while it plays a song, else the first layer. Other layers run on
+their own clock from the moment they are added.
+Every layer has its own transform (transpose, mute, ...) and output port.
+"""
+
+import heapq
+from bisect import bisect_right
+from threading import Thread, Condition
+from smfevents import smftransform
+from smfplayout import smfsong, wallclock
+from realtime import RealtimeOptions, applyRealtime
+
+startLead = 0.05
+
+
+def initialTempo(song: smfsong) -> int:
+    events = song.events
+    for index in sorted(events.payloads):
+        if events.times[index] > 0:
+            break
+        msg = events.payloads[index]
+        if getattr(msg, 'type', None) == 'set_tempo':
+            return msg.tempo
+    return 500000
+
+
+def tempoRatio(masterTempo: int, tempo: int) -> float:
+    """time stretch to the master's beat, half and double time songs are locked to every other beat"""
+    ratio = masterTempo / tempo
+    while ratio >= 1.5:
+        ratio /= 2
+    while ratio < 0.75:
+        ratio *= 2
+    return ratio
+
+
+def barLoopLength(song: smfsong) -> float:
+    """the song length rounded up to a whole bar"""
+    bars = song.barTimes
+    if len(bars) < 2:
+        return song.length
+    barLength = bars[-1] - bars[-2]
+    end = bars[-1]
+    while end + 1e-6 < song.length:
+        end += barLength
+    return end
+
+
+class smflayer:
+    def __init__(self, song: smfsong, output, transform: smftransform, loops: int, sync: bool, name: str = None):
+        self.song = song
+        self.name = name
+        self.number = 0
+        self.output = output
+        self.transform = transform or smftransform()
+        self.events = self.transform.apply(song.events)
+        self.loops = loops
+        self.sync = sync
+        self.scale = 1.0
+        self.start = 0.0
+        self.loopLength = song.length
+        self.index = 0
+        self.pendingNotes = [[0] * 128 for c in range(16)]
+
+    def due(self) -> float:
+        return self.start + self.events.times[self.index] * self.scale
+
+    def position(self, now: float) -> float:
+        """seconds into the song"""
+        return (now - self.start) / self.scale
+
+    def sendDue(self, now: float):
+        """sends every event up to now, returns False when the layer has ended"""
+        events = self.events
+        times, status, data1, data2 = events.times, events.status, events.data1, events.data2
+        sendBurst = getattr(self.output, 'sendBurst', None)
+        burst = []
+        send = burst.append if sendBurst is not None else self.output.send_message
+        limit = (now - self.start) / self.scale
+        index = self.index
+        while True:
+            while index < len(times) and times[index] <= limit:
+                s = status[index]
+                if s < 0xF0:
+                    note = data1[index]
+                    kind = s & 0xF0
+                    if kind == 0x90 and data2[index] > 0:
+                        self.pendingNotes[s & 0x0F][note] += 1
+                    elif kind <= 0x90 and self.pendingNotes[s & 0x0F][note] > 0:
+                        self.pendingNotes[s & 0x0F][note] -= 1
+                    if 0xC0 <= s < 0xE0:
+                        send([s, note])
+                    else:
+                        send([s, note, data2[index]])
+                elif s == 0xF0:
+                    send(events.payloads[index])
+                index += 1
+            if index < len(times):
+                break
+            self.loops -= 1
+            if self.loops <= 0 or not len(times):
+                break
+            self.start += self.loopLength * self.scale
+            limit = (now - self.start) / self.scale
+            index = 0
+        if burst:
+            sendBurst(burst)
+        self.index = index
+        return index < len(times)
+
+    def releaseNotes(self):
+        for c in range(16):
+            for n in range(128):
+                while self.pendingNotes[c][n] > 0:
+                    self.output.send_message([0x80 | c, n, 0x40])
+                    self.pendingNotes[c][n] -= 1
+
+
+class smflayers:
+    def __init__(self, clock=None, realtime: RealtimeOptions = None):
+        self.clock = clock or wallclock()
+        self.realtime = realtime if realtime is not None and realtime.enabled() else None
+        self.realtimeReport = None
+        self.layers = []
+        self.heap = []
+        self.sequence = 0
+        self.count = 0
+        self.player = None
+        self.condition = Condition()
+        self.running = True
+        self.thread = Thread(name='layers', target=self.worker, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.layers)
+
+    def master(self) -> smflayer:
+        return self.layers[0] if self.layers else None
+
+    def follow(self, player):
+        """synced layers keep to the song player plays, while it plays one"""
+        self.player = player
+
+    def grid(self):
+        """song, clock time of its start, clock seconds per song second and loop length synced layers keep to"""
+        player = self.player
+        if player is not None and player.playing and player.song is not None:
+            return player.song, player.start_time, 1 / player.tempoFactor, player.endSeconds
+        master = self.master()
+        if master is not None:
+            return master.song, master.start, master.scale, master.loopLength
+        return None
+
+    def layer(self, number: int) -> smflayer:
+        for layer in self.layers:
+            if layer.number == number:
+                return layer
+        raise KeyError(number)
+
+    def schedule(self, layer: smflayer):
+        self.sequence += 1
+        heapq.heappush(self.heap, (layer.due(), self.sequence, layer))
+
+    def add(self, song: smfsong, output, transform: smftransform = None, loops: int = 1,
+            sync: bool = True, name: str = None) -> smflayer:
+        layer = smflayer(song, output, transform, loops, sync, name)
+        if not len(layer.events):
+            return layer
+        with self.condition:
+            now = self.clock.now()
+            grid = self.grid() if sync else None
+            self.count += 1
+            layer.number = self.count
+            if grid is not None:
+                masterSong, masterStart, masterScale, masterLength = grid
+                layer.scale = tempoRatio(initialTempo(masterSong), initialTempo(song)) * masterScale
+                layer.loopLength = barLoopLength(song)
+                barTimes = masterSong.barTimes
+                position = max(0.0, (now + startLead - masterStart) / masterScale)
+                bar = bisect_right(barTimes, position)
+                nextBar = barTimes[bar] if bar < len(barTimes) else masterLength
+                layer.start = masterStart + nextBar * masterScale
+            else:
+                if sync:
+                    layer.loopLength = barLoopLength(song)
+                layer.start = now + startLead
+            self.layers.append(layer)
+            self.schedule(layer)
+            self.condition.notify()
+        return layer
+
+    def remove(self, layer: smflayer):
+        with self.condition:
+            if layer in self.layers:
+                self.layers.remove(layer)
+                self.heap = [entry for entry in self.heap if entry[2] is not layer]
+                heapq.heapify(self.heap)
+                layer.releaseNotes()
+                self.condition.notify()
+
+    def clear(self):
+        for layer in list(self.layers):
+            self.remove(layer)
+
+    def setTransform(self, layer: smflayer, transform: smftransform):
+        """the events are swapped between two sends, the layer continues at the same position"""
+        events = transform.apply(layer.song.events)
+        with self.condition:
+            times = events.times
+            position = layer.events.times[layer.index - 1] if layer.index > 0 else -1.0
+            layer.releaseNotes()
+            layer.transform = transform
+            layer.events = events
+            layer.index = bisect_right(times, position)
+            if layer in self.layers:
+                self.heap = [entry for entry in self.heap if entry[2] is not layer]
+                heapq.heapify(self.heap)
+                if layer.index < len(times):
+                    self.schedule(layer)
+                else:
+                    self.layers.remove(layer)
+                self.condition.notify()
+
+    def setOutput(self, layer: smflayer, output):
+        """notes sounding on the old port are released there, the layer goes on on the new one"""
+        with self.condition:
+            layer.releaseNotes()
+            layer.output = output
+
+    def worker(self):
+        if self.realtime is not None:
+            self.realtimeReport = applyRealtime(self.realtime)
+        with self.condition:
+            while self.running:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                due, sequence, layer = self.heap[0]
+                delay = due - self.clock.now()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                if layer.sendDue(self.clock.now()):
+                    self.schedule(layer)
+                else:
+                    layer.releaseNotes()
+                    self.layers.remove(layer)
+
+    def stop(self):
+        self.clear()
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -9,24 +9,91 @@ TODO (JS):
 """
 
 import argparse
-import rtmidi
 import sys
+import heapq
+import json
+import os
 import time
+from bisect import bisect_left, bisect_right
 from threading import Thread, Event
-from mido import MidiFile, Message, tempo2bpm, merge_tracks, tick2second, second2tick
+from mido import MidiFile, MidiTrack, Message, MetaMessage, tempo2bpm, tick2second, second2tick
+from smfevents import smfevents, smftransform
+from midiout import openOutput, defaultOutput
+from realtime import RealtimeOptions, applyRealtime
+from playerlog import PlayerLog, TIMING_GROUP, TIMING_MTC, TIMING_STEP
+from enginetrace import EngineTrace, SPAN_WAIT, SPAN_SEND, SPAN_MTC, SPAN_STATUS
 
 
-def parse_args():
+def channelList(text: str) -> set:
+    """'1,2,10' as 0 based channel numbers"""
+    return {int(c) - 1 for c in text.split(',') if c}
+
+
+def channelMapping(text: str) -> dict:
+    """'10:11,1:2' as 0 based channel mapping"""
+    mapping = dict()
+    for pair in text.split(','):
+        source, target = pair.split(':')
+        mapping[int(source) - 1] = int(target) - 1
+    return mapping
+
+
+def cpuList(text: str) -> set:
+    """'2,3' as a set of CPU numbers"""
+    return {int(c) for c in text.split(',') if c}
+
+
+def noteRange(text: str) -> tuple:
+    low, high = text.split('-')
+    return int(low), int(high)
+
+
+def addTransformArgs(parser):
+    arg = parser.add_argument
+    arg('--transpose', dest='transpose', type=int, default=0, help='transpose notes by semitones')
+    arg('--mute', dest='mute', type=channelList, default=set(), help='channels to mute, e.g. 1,10')
+    arg('--solo', dest='solo', type=channelList, default=set(), help='only play these channels')
+    arg('--remap', dest='channelMap', type=channelMapping, default=dict(), help='channel mapping, e.g. 10:11,1:2')
+    arg('--velocity-scale', dest='velocityScale', type=float, default=1.0, help='velocity factor')
+    arg('--velocity-curve', dest='velocityCurve', type=float, default=1.0,
+        help='velocity exponent, < 1 lifts soft notes')
+    arg('--range', dest='noteRange', type=noteRange, default=(0, 127), help='notes to play, e.g. 36-96')
+    arg('--disable-track', dest='disabledTracks', type=int, action='append', default=[],
+        help='track number (0 based) not to play, may be repeated')
+
+
+def transformFromArgs(args) -> smftransform:
+    return smftransform(args.transpose, args.mute, args.solo, args.channelMap, args.velocityScale,
+                        args.velocityCurve, args.noteRange, set(args.disabledTracks))
+
+
+def parse_args(argv: list = None):
     parser = argparse.ArgumentParser(description=__doc__)
     arg = parser.add_argument
 
     # arg('-p', '--virtual-port', help='Mido port name to send output to (midi-curse)')
     # arg('-c', '--clock', dest='midi_clock', action='store_true', default=False, help='Send midi clock messages')
-    arg('-t', '--timecode', dest='midi_timecode', action='store_true', default=False, help='Send midi time_code')
+    arg('-t', '--timecode', dest='midi_timecode', action='store_true', default=False,
+        help='Send midi time_code, when playing and with --render')
     arg('-l', '--loop', dest='loop', action='store_true', default=False, help='loop loop ')
     arg('-q', '--quiet', dest='quiet', action='store_true', default=False, help='print nothing')
+    addTransformArgs(parser)
+    arg('--output', dest='output', default=defaultOutput,
+        help='midi output: rtmidi:PORTNAME, null, record or file:PATH (default %(default)s)')
+    arg('--loops', dest='loops', type=int, default=None, help='number of times to play every file')
+    arg('--render', dest='render', default=None,
+        help='render on a virtual clock to this trace file (.jsonl or .mid) or directory instead of playing')
+    arg('--format', dest='format', choices=['jsonl', 'mid'], default=None, help='trace format, default from --render')
+    arg('--cpus', dest='cpus', type=cpuList, default=None, help='pin the playing thread to these CPUs, e.g. 2,3')
+    arg('--sched', dest='sched', choices=['fifo', 'rr'], default=None, help='real-time scheduling policy if permitted')
+    arg('--priority', dest='priority', type=int, default=10, help='real-time priority (default %(default)s)')
+    arg('--mlock', dest='mlock', action='store_true', default=False, help='lock the player in memory if permitted')
+    arg('--timing-log', dest='timingLog', default=None,
+        help='binary timing records of every event group, wake-up and quarter frame (see playerlog.py)')
+    arg('--trace', dest='trace', default=None,
+        help='Chrome trace event JSON of waits, sends and quarter frames, for chrome://tracing or ui.perfetto.dev')
     arg('files', metavar='FILE', nargs='+', help='MIDI file to play')
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 '''
@@ -61,14 +128,48 @@ Byte 3
 7	0111 0rrh	Rate and hour msbit'''
 
 
+class wallclock:
+    def now(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def sleepUntil(self, deadline: float):
+        self.sleep(deadline - time.time())
+
+
+class virtualclock:
+    """a clock that only moves when slept on, for rendering faster than real time"""
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.time += seconds
+
+    def sleepUntil(self, deadline: float):
+        self.time = max(self.time, deadline)
+
+
 class miditimecode:
-    def __init__(self, output):
+    def __init__(self, output, clock=None):
         self.midi_out = output
+        self.clock = clock or wallclock()
+        # a setting, reset() for every song keeps it
+        self.sendMTC = True
         self.reset()
-        #self.flog = open("/tmp/mtc.log", "w")
+        # a PlayerLog and its timing() if binary timing records are on, see smfplayout.setLog()
+        self.log = None
+        self.timing = None
+        # the span ring of the playing thread if tracing, see smfplayout.setTrace()
+        self.trace = None
 
     def reset(self):
-        self.sendMTC = True
         self.framesSinceReset = 0
         self.framesPerSec = 24
         self.subframe = 0
@@ -94,16 +195,24 @@ class miditimecode:
         if self.sendMTC:
             msgTimeCode = Message('sysex', data=[0x7F, 0x7F, 0x01, 0x01, self.rr + self.h, self.m, self.s, self.f])
             self.midi_out.send_message(msgTimeCode.bytes())
-        self.start_time = time.time()
+        self.start_time = self.clock.now()
         self.framesSinceReset = 0
         self.next_time = self.start_time
 
     def writeTolog(self, comment):
-        self.flog.write(f"{comment} {time.time() - self.next_time} {self.__str__()}\n")
+        if self.log is not None:
+            self.log.debug("%s %.6f %s", comment, self.clock.now() - self.next_time, str(self))
 
     def next(self):
-        if time.time() < self.next_time:
+        now = self.clock.now()
+        if now < self.next_time:
             return
+        if self.timing is not None:
+            self.timing(TIMING_MTC, now - self.next_time, self.framesSinceReset, now)
+        trace = self.trace
+        if trace is not None:
+            started = trace.now()
+            late = now - self.next_time
         self.subframe += 1
         if self.subframe == 4:
             self.subframe = 0
@@ -117,7 +226,8 @@ class miditimecode:
                     if self.m >= 60:
                         self.m = 0
                         self.h += 1
-            # self.writeTolog(f"{time.time() - self.start_time}")
+            if self.log is not None:
+                self.writeTolog(f"{now - self.start_time:.6f}")
         if self.sendMTC:
             if self.ft == 0:
                 quarterFrame = Message('quarter_frame', frame_type=self.ft, frame_value=self.f & 0xf)
@@ -141,6 +251,8 @@ class miditimecode:
                 self.ft = 0
             b = quarterFrame.bytes()
             self.midi_out.send_message(b)
+        if trace is not None:
+            trace.span(SPAN_MTC, started, late, self.framesSinceReset)
         self.framesSinceReset += 1
         self.next_time = self.start_time + self.framesSinceReset * 1 / self.framesPerSec / 4
 
@@ -151,20 +263,183 @@ class miditimecode:
         return {"hour": self.h, "min": self.m, "sec": self.s, "frame": self.f, "rate": self.framesPerSec}
 
 
+class smflyrics:
+    """
+    lyric syllables with their time in seconds, grouped into lines.
+    Karaoke conventions: '/' starts a line, '\\' a paragraph, '@' marks header
+    fields, a trailing line feed ends the line.
+    """
+    def __init__(self, events: list):
+        self.times = []
+        self.syllables = []
+        self.lineOf = []
+        self.lines = []
+        lineBreak = True
+        for seconds, text in events:
+            if text.startswith('@'):
+                continue
+            if text[:1] in ('/', '\\'):
+                lineBreak = True
+                text = text[1:]
+            breakAfter = text.endswith(('\r', '\n'))
+            text = text.rstrip('\r\n')
+            if lineBreak or not self.lines:
+                self.lines.append([len(self.syllables), len(self.syllables)])
+                lineBreak = False
+            self.times.append(seconds)
+            self.syllables.append(text)
+            self.lineOf.append(len(self.lines) - 1)
+            self.lines[-1][1] = len(self.syllables)
+            lineBreak = breakAfter
+
+    def __len__(self):
+        return len(self.syllables)
+
+    def syllableAt(self, seconds: float) -> int:
+        """index of the last syllable sung at seconds, -1 before the first one"""
+        return bisect_right(self.times, seconds) - 1
+
+    def lineText(self, line: int, end: int = None) -> str:
+        first, last = self.lines[line]
+        if end is not None:
+            last = min(last, end)
+        return ''.join(self.syllables[first:last])
+
+
+def absoluteTicks(track, index: int):
+    tick = 0
+    for order, msg in enumerate(track):
+        tick += msg.time
+        yield tick, index, order, msg
+
+
+channelLengths = bytes([3] * 0x40 + [2] * 0x20 + [3] * 0x10)
+
+
+class smfsong:
+    """
+    a parsed midi file prepared for playing: the merged tracks as an smfevents
+    store with the absolute time in seconds of every event and of every bar start
+    """
+    def __init__(self, midi_data: MidiFile):
+        self.filename = getattr(midi_data, 'filename', None) or ''
+        self.ticks_per_beat = tpb = midi_data.ticks_per_beat
+        self.events = events = smfevents()
+        tempo = 500000
+        seconds = 0.0
+        tick = 0
+        barTick = 0
+        barTicks = tpb * 4
+        self.barTimes = [0.0]
+        channels = set()
+        lyricEvents = []
+        textEvents = []
+        tracks = [absoluteTicks(track, index) for index, track in enumerate(midi_data.tracks)]
+        for target, track, order, msg in heapq.merge(*tracks):
+            while barTick + barTicks <= target:
+                barTick += barTicks
+                self.barTimes.append(seconds + tick2second(barTick - tick, tpb, tempo))
+            seconds += tick2second(target - tick, tpb, tempo)
+            tick = target
+            if msg.type == 'end_of_track':
+                # not an event, but the song and every loop of it last until the longest track ends
+                continue
+            if msg.is_meta:
+                events.append(seconds, 0xFF, 0, 0, track, msg)
+                if msg.type == 'lyrics':
+                    lyricEvents.append((seconds, msg.text))
+                elif msg.type == 'text':
+                    textEvents.append((seconds, msg.text))
+                elif msg.type == 'set_tempo':
+                    tempo = msg.tempo
+                elif msg.type == 'time_signature':
+                    barTick = tick
+                    barTicks = tpb * 4 * msg.numerator / msg.denominator
+            else:
+                data = msg.bytes()
+                if data[0] < 0xF0:
+                    events.append(seconds, data[0], data[1], data[2] if len(data) > 2 else 0, track)
+                    if data[0] & 0xF0 == 0x90:
+                        channels.add(data[0] & 0x0F)
+                else:
+                    events.append(seconds, data[0], 0, 0, track, bytes(data))
+        self.times = events.times
+        events.groups()
+        self.length = seconds
+        self.lengthTicks = tick
+        self.channels = sorted(channels)
+        if not lyricEvents and self.filename.lower().endswith('.kar'):
+            lyricEvents = textEvents
+        self.lyrics = smflyrics(lyricEvents)
+
+    def __len__(self):
+        return len(self.events)
+
+    def secondsAtBar(self, bar: int) -> float:
+        if bar < len(self.barTimes):
+            return self.barTimes[bar]
+        return self.length
+
+
 class smfplayout:
-    def __init__(self, output):
+    def __init__(self, output, clock=None):
         self.midi_out = output
-        self.mtc = miditimecode(output)
+        self.clock = clock or wallclock()
+        self.mtc = miditimecode(output, self.clock)
+        # outputs with a bandwidth model hold messages back and want to be pumped
+        self.outputPump = getattr(output, 'pump', None)
+        # outputs that can take all messages of one time in a single call
+        self.outputBurst = getattr(output, 'sendBurst', None)
         self.sendMTC = True
         self.loop = 1
         self.playing = False
+        self.song = None
+        self.events = None
+        self.transform = smftransform()
+        self.pendingEvents = None
+        self.transpose = 0
+        self.tempoFactor = 1.0
+        self.newTempoFactor = None
+        self.seekTo = None
+        self.loopStart = 0.0
+        self.loopEnd = None
+        self.position = (self.clock.now(), 0.0)
+        self.realtime = None
+        self.realtimeReport = None
+        self.log = None
+        self.timing = None
+        self.tracer = None
+        self.trace = None
 
     def dataInfo(self):
+        seconds = self.songSeconds()
         infoDict = {"playing": self.playing, "beat": self.beat+1, "bar": self.bar+1, "key": self.keysignature,
-                    "signature": [self.numerator, self.denominator], "tempo": self.tempo, "lengthSeconds": self.midi_data.length}
+                    "signature": [self.numerator, self.denominator], "tempo": self.tempo, "lengthSeconds": self.song.length,
+                    "seconds": seconds, "tempoFactor": self.tempoFactor}
+        # where the beat is at which clock time, for followers like the arpeggiator of the keyboard player
+        infoDict["barQuarters"] = (seconds - self.song.barTimes[self.bar]) / (self.tempo / 1000000)
+        infoDict["clock"] = self.clock.now()
         infoDict["mtc"] = self.mtc.currentValues()
+        if hasattr(self.midi_out, 'stats'):
+            infoDict["wire"] = self.midi_out.stats()
+        if self.realtimeReport is not None:
+            infoDict["realtime"] = self.realtimeReport
         return infoDict
 
+    def setLog(self, log: PlayerLog):
+        """timing records of event groups, wake-ups and quarter frames go to log if it has a timing file"""
+        self.log = self.mtc.log = log
+        self.timing = self.mtc.timing = log.timing if log is not None and log.timingEnabled() else None
+
+    def setTrace(self, tracer: EngineTrace):
+        """spans of waits, sends, quarter frames and status updates, the trace is saved whenever playing stops"""
+        self.tracer = tracer
+        self.trace = self.mtc.trace = tracer.ring("player") if tracer is not None else None
+
+    def setRealtime(self, options: RealtimeOptions):
+        """applied to the playing thread every time play_out() starts"""
+        self.realtime = options if options is not None and options.enabled() else None
+
     def setSendMTC(self, value:bool):
         self.sendMTC = value
         self.mtc.setSendMTC(value)
@@ -177,19 +452,38 @@ class smfplayout:
         self.beat = 0
         self.bar = 0
         self.barAdd = 0
-        self.currentTick = 0
         self.keysignature = ""
         self.nextClockTick = 0
-        self.newTranspose = None
         self.mtc.reset()
 
-    def barbeatFromTicks(self, tick):
-        beat = tick * self.denominator / self.midi_data.ticks_per_beat / 4
-        self.bar = int(beat / self.numerator)
-        self.beat = int(beat % self.numerator)
+    def barbeatFromSeconds(self, seconds: float):
+        barTimes = self.song.barTimes
+        self.bar = max(0, bisect_right(barTimes, seconds) - 1)
+        beatSeconds = self.tempo / 1000000 * 4 / self.denominator
+        self.beat = min(self.numerator - 1, int((seconds - barTimes[self.bar]) / beatSeconds))
+
+    def songSeconds(self) -> float:
+        """the playback position in song time, other threads read it instead of getting callbacks"""
+        wall, seconds = self.position
+        if not self.playing:
+            return seconds
+        return seconds + (self.clock.now() - wall) * self.tempoFactor
+
+    def setTempoFactor(self, factor: float):
+        """may be called from any thread, 1.1 plays 10% faster"""
+        self.newTempoFactor = factor
+
+    def setLoopPoints(self, start: float = 0.0, end: float = None):
+        """the part of the song play_out() plays (and loops) from its next start on, end None for the whole song"""
+        self.loopStart = start or 0.0
+        self.loopEnd = end
+
+    def requestSeek(self, seconds: float):
+        """may be called from any thread, the playing thread does the seek"""
+        self.seekTo = seconds
 
     def setTranspose(self, newTranspose:int):
-        self.newTranspose = newTranspose
+        self.setTransform(self.transform.copy(transpose=newTranspose))
 
     def stopPendingNotes(self):
         for c in range(16):
@@ -205,86 +499,201 @@ class smfplayout:
                     self.midi_out.send_message(msg.bytes())
                     self.pendingNotes[c][n] -= 1
 
-    def play_out(self, midi_data, eventStop: Event, updateMessage, loopCnt:int, transpose:int):
-        self.loop = loopCnt
+    def applyMeta(self, msg):
+        if msg.type == 'set_tempo':
+            self.tempo = msg.tempo
+            self.bpm = tempo2bpm(msg.tempo)
+        elif msg.type == 'time_signature':
+            self.numerator = msg.numerator
+            self.denominator = msg.denominator
+        elif msg.type == 'key_signature':
+            self.keysignature = msg.key
+
+    def setTransform(self, transform: smftransform):
+        """the new events are prepared by the calling thread, the player swaps them in between two sends"""
+        self.transform = transform
+        self.transpose = transform.transpose
+        song = self.song
+        events = transform.apply(song.events) if song is not None else None
+        # one assignment, the player never sees the transform without its events
+        self.pendingEvents = (song, transform, events)
+
+    def begin(self, song: smfsong, transpose: int, bars: int = None):
+        """prepares playing song, the loop around it calls rewind(), nextDeadline() and step()"""
         self.restart()
-        self.midi_data = midi_data
-        self.mt = merge_tracks(midi_data.tracks)
+        # a transform set from here on is for this song, see step()
+        self.pendingEvents = None
+        self.transform = self.transform.copy(transpose=transpose)
+        self.transpose = transpose
+        self.applied = self.transform
+        self.events = self.applied.apply(song.events)
+        self.prewarm()
+        self.song = song
+        self.stopAt = None
+        self.seekTo = None
+        if bars is not None:
+            self.stopAt = song.secondsAtBar(bars)
+        elif self.loopEnd is not None:
+            self.stopAt = self.loopEnd
         self.mtc.start()
         self.pendingNotes = []
         for c in range(16):
             self.pendingNotes.append( [0] * 128)
         self.playing = True
-        self.newTranspose = None
-        for i in range(self.loop):
-            if eventStop.isSet():
+        if self.outputPump is not None:
+            # from here on deferrable messages wait for step() to pump them
+            self.outputPump()
+        self.rewind()
+
+    def prewarm(self):
+        """touches the compiled schedule so the first deadlines neither fault pages in nor build caches"""
+        events = self.events
+        for column in (events.times, events.status, events.data1, events.data2):
+            column.tobytes()
+        events.groups()
+
+    def setEnd(self):
+        times = self.events.times
+        if self.stopAt is None:
+            self.end = len(times)
+            self.endSeconds = self.song.length
+        else:
+            self.end = bisect_left(times, self.stopAt)
+            self.endSeconds = self.stopAt
+
+    def rewind(self, seconds: float = 0.0):
+        """continues playing at seconds into the song"""
+        now = self.clock.now()
+        self.start_time = now - seconds / self.tempoFactor
+        self.position = (now, seconds)
+        self.index = bisect_left(self.events.times, seconds)
+        self.sent = self.events.times[self.index - 1] if self.index > 0 else -1.0
+        self.nextUpdate = seconds
+        self.setEnd()
+
+    def seek(self, seconds: float):
+        """jumps to seconds, called from the thread or task driving the player"""
+        self.stopPendingNotes()
+        self.tempo = 500000
+        self.numerator = 4
+        self.denominator = 4
+        events = self.events
+        for index in sorted(events.payloads):
+            if events.times[index] >= seconds:
                 break
-            ms = 0
-            mfIndex = 0
-            tick = 0
-            msg = self.mt[mfIndex]
-            #msg.time += self.midi_data.ticks_per_beat * 4
-            nextMsecItem = 1000 * tick2second(msg.time, self.midi_data.ticks_per_beat, self.tempo)
-            #print(nextMsecItem)
-            self.start_time = time.time()
-
-            self.nextUpdate = 0
-            while mfIndex < len(self.mt):
-                if eventStop.isSet():
-                    break
-                time.sleep(0.0001)
-                delta = (time.time() - self.start_time) * 1000
-                if delta > ms:
-                    self.mtc.next()
-                    lastBeat = self.beat
-                    virtualTick = second2tick(delta / 1000, self.midi_data.ticks_per_beat, self.tempo)
-                    self.barbeatFromTicks(virtualTick)
-                    if ms > self.nextUpdate:
-                        updateMessage(self.dataInfo())
-                        self.nextUpdate = ms+100
-                        if self.newTranspose is not None:
-                            transpose = self.newTranspose
-                            self.stopPendingNotes()
-                            self.newTranspose = None
-                    ms += 1
-
-                    # self.mtc.writeTolog(f"{str(ms)} {nextMsecItem}:")
-                    if ms >= nextMsecItem:
-                        if msg.type == 'set_tempo':
-                            self.tempo = msg.tempo
-                            self.bpm = tempo2bpm(msg.tempo)
-                            # reset time for new BPM
-                            self.barbeatFromTicks(tick)
-                            self.barAdd = self.bar
-                            tick = 0
-                            self.start_time = time.time()
-                            ms = 0
-
-                        elif msg.type == 'time_signature':
-                            self.numerator = msg.numerator
-                            self.denominator = msg.denominator
-                        elif msg.type == 'key_signature':
-                            self.keysignature = msg.key
-
-                        if isinstance(msg, Message):
-                            if msg.type == 'note_on':
-                                if transpose != 0:
-                                    msg.note += transpose
-                                self.pendingNotes[msg.channel][msg.note] += 1
-                            else:
-                                if msg.type == 'note_off':
-                                    if transpose != 0:
-                                        msg.note += transpose
-                                    self.pendingNotes[msg.channel][msg.note] -= 1
-                            self.midi_out.send_message(msg.bytes())
-
-                        mfIndex += 1
-                        if mfIndex < len(self.mt):
-                            msg = self.mt[mfIndex]
-                            tick += msg.time
-                            nextMsecItem = 1000 * tick2second(tick, self.midi_data.ticks_per_beat, self.tempo)
-
-                self.currentTick += msg.time
+            if events.status[index] == 0xFF:
+                self.applyMeta(events.payloads[index])
+        self.rewind(max(0.0, seconds))
+
+    def finished(self) -> bool:
+        """every event sent and the end of the song (or of the part played) reached, loops wrap only here"""
+        return self.index >= self.end and self.clock.now() >= self.start_time + self.endSeconds / self.tempoFactor
+
+    def nextDeadline(self) -> float:
+        """clock time of the next event, quarter frame or status update, whatever comes first"""
+        start = self.start_time
+        factor = self.tempoFactor
+        # after the last event the end of the song is still to come
+        due = self.events.times[self.index] if self.index < self.end else self.endSeconds
+        deadline = min(start + due / factor, start + self.nextUpdate / factor, self.mtc.next_time)
+        if self.outputPump is not None:
+            pending = self.midi_out.pending()
+            if pending is not None:
+                deadline = min(deadline, pending)
+        return deadline
+
+    def step(self, updateMessage):
+        """does everything that is due at the current clock time"""
+        song = self.song
+        now = self.clock.now()
+        if self.newTempoFactor is not None:
+            # keep the song position, only what follows moves
+            seconds = (now - self.start_time) * self.tempoFactor
+            self.tempoFactor = max(0.05, self.newTempoFactor)
+            self.newTempoFactor = None
+            self.start_time = now - seconds / self.tempoFactor
+        if self.seekTo is not None:
+            seconds = self.seekTo
+            self.seekTo = None
+            self.seek(seconds)
+        start = self.start_time
+        factor = self.tempoFactor
+        elapsed = (now - start) * factor
+        self.mtc.next()
+        # all deadlines are absolute clock times so a virtual clock lands on them exactly
+        if now >= start + self.nextUpdate / factor:
+            if self.trace is not None:
+                started = self.trace.now()
+            self.barbeatFromSeconds(elapsed)
+            updateMessage(self.dataInfo())
+            if self.trace is not None:
+                self.trace.span(SPAN_STATUS, started)
+            self.nextUpdate = elapsed + 0.1
+        pending = self.pendingEvents
+        if pending is not None:
+            self.pendingEvents = None
+            transformed, transform, events = pending
+            if transformed is not song:
+                # set while this song was starting, before there were its events to transform
+                events = transform.apply(song.events)
+            self.applied = transform
+            self.events = events
+            self.setEnd()
+            self.index = bisect_right(self.events.times, self.sent)
+            self.stopPendingNotes()
+        self.sendDue(now)
+        if self.outputPump is not None and self.index < self.end:
+            self.outputPump(self.start_time + self.events.times[self.index] / self.tempoFactor)
+
+    def sendDue(self, now: float):
+        """sends every due group of events sharing a time, each group without looking at the clock again"""
+        events = self.events
+        times, status, data1, data2, payloads = events.times, events.status, events.data1, events.data2, events.payloads
+        groups = events.groups()
+        pendingNotes = self.pendingNotes
+        start = self.start_time
+        factor = self.tempoFactor
+        index = self.index
+        end = self.end
+        burst = []
+        send = burst.append if self.outputBurst is not None else self.midi_out.send_message
+        timing = self.timing
+        trace = self.trace
+        group = bisect_right(groups, index)
+        while index < end and start + times[index] / factor <= now:
+            last = min(groups[group], end)
+            group += 1
+            if timing is not None:
+                timing(TIMING_GROUP, now - (start + times[index] / factor), last - index, now)
+            if trace is not None:
+                started = trace.now()
+                late = now - (start + times[index] / factor)
+            for i, s, note, value in zip(range(index, last), status[index:last], data1[index:last], data2[index:last]):
+                if s < 0xF0:
+                    if s < 0xA0:
+                        notes = pendingNotes[s & 0x0F]
+                        if s >= 0x90 and value > 0:
+                            notes[note] += 1
+                        elif notes[note] > 0:
+                            notes[note] -= 1
+                    send([s, note, value][:channelLengths[s - 0x80]])
+                elif s == 0xFF:
+                    self.applyMeta(payloads[i])
+                else:
+                    send(payloads[i])
+            if burst:
+                self.outputBurst(burst)
+                burst = []
+                send = burst.append
+            if trace is not None:
+                trace.span(SPAN_SEND, started, late, last - index)
+            index = last
+            self.position = (now, times[index - 1])
+        if index > self.index:
+            self.sent = times[index - 1]
+        self.index = index
+
+    def finish(self, updateMessage):
         for c in range(16):
             for n in range(128):
                 if self.pendingNotes[c][n] > 0:
@@ -293,43 +702,182 @@ class smfplayout:
         self.playing = False
         updateMessage(self.dataInfo())
         self.stopAll()
+        if self.outputPump is not None:
+            self.midi_out.flush()
+        if self.tracer is not None:
+            self.tracer.save()
+
+    def play_out(self, song: smfsong, eventStop: Event, updateMessage, loopCnt:int, transpose:int, bars:int = None):
+        self.loop = loopCnt
+        self.begin(song, transpose, bars)
+        if self.realtime is not None:
+            # after begin() so the memory lock covers the compiled schedule
+            self.realtimeReport = applyRealtime(self.realtime)
+        clock = self.clock
+        # auditions always start at the beginning
+        loopStart = self.loopStart if bars is None else 0.0
+        for i in range(self.loop):
+            if eventStop.is_set():
+                break
+            if loopStart > 0:
+                self.seek(loopStart)
+            else:
+                self.rewind()
+            while not self.finished():
+                if eventStop.is_set():
+                    break
+                deadline = self.nextDeadline()
+                if self.timing is None and self.trace is None:
+                    clock.sleepUntil(deadline)
+                    self.step(updateMessage)
+                    continue
+                self.observedStep(deadline, updateMessage)
+        self.finish(updateMessage)
+
+    def observedStep(self, deadline: float, updateMessage):
+        """sleeps until deadline and steps like play_out(), recording the wake-up in the timing log and the trace"""
+        clock = self.clock
+        trace = self.trace
+        if trace is not None:
+            slept = trace.now()
+        clock.sleepUntil(deadline)
+        woken = clock.now()
+        if trace is not None:
+            trace.span(SPAN_WAIT, slept, woken - deadline)
+        self.step(updateMessage)
+        if self.timing is not None:
+            self.timing(TIMING_STEP, woken - deadline, clock.now() - woken, woken)
 
     def play_file(self, filename: str, eventStop: Event, updateMessage, loopcnt:int, transpose:int):
         midi_data = MidiFile(filename)
-        self.play_out(midi_data, eventStop, updateMessage, loopcnt, transpose)
+        self.play_out(smfsong(midi_data), eventStop, updateMessage, loopcnt, transpose)
 
     def stopAll(self):
         for i in range(16):
-            self.midi_out.send_message([0xB0 + i, 7, 0x80])
             self.midi_out.send_message([0xB0 + i, 120, 0])
             self.midi_out.send_message([0xB0 + i, 121, 0])
             self.midi_out.send_message([0xB0 + i, 123, 0])
             self.midi_out.send_message([0xB0 + i, 127, 0])
 
+class smftrace:
+    """an output recording every message and status update with its clock time"""
+    def __init__(self, clock):
+        self.clock = clock
+        self.origin = clock.now()
+        self.records = []
+
+    def send_message(self, data):
+        self.records.append((self.clock.now() - self.origin, 'msg', list(data)))
+
+    def status(self, info: dict):
+        self.records.append((self.clock.now() - self.origin, 'status', info))
+
+    def writeJsonl(self, path: str):
+        with open(path, 'w') as f:
+            for seconds, kind, value in self.records:
+                f.write(json.dumps({"t": round(seconds, 6), kind: value}) + "\n")
+
+    def writeSmf(self, path: str, ticks_per_beat: int = 960):
+        """type 0 at a fixed 120 bpm, so ticks are plain time (about 0.5 ms)"""
+        tempo = 500000
+        track = MidiTrack()
+        track.append(MetaMessage('set_tempo', tempo=tempo))
+        last = 0
+        for seconds, kind, value in self.records:
+            if kind != 'msg':
+                continue
+            tick = round(second2tick(seconds, ticks_per_beat, tempo))
+            track.append(Message.from_bytes(value, time=tick - last))
+            last = tick
+        MidiFile(type=0, ticks_per_beat=ticks_per_beat, tracks=[track]).save(path)
+
+    def write(self, path: str, format: str = None):
+        if format is None:
+            format = 'mid' if path.lower().endswith(('.mid', '.midi')) else 'jsonl'
+        if format == 'mid':
+            self.writeSmf(path)
+        else:
+            self.writeJsonl(path)
+
+
+def renderSong(song: smfsong, loopCnt: int = 1, transform: smftransform = None, sendMTC: bool = False,
+               bars: int = None) -> smftrace:
+    """runs the whole engine on a virtual clock, as fast as the cpu allows"""
+    clock = virtualclock()
+    trace = smftrace(clock)
+    player = smfplayout(trace, clock)
+    player.setSendMTC(sendMTC)
+    if transform is not None:
+        player.setTransform(transform)
+    player.play_out(song, Event(), trace.status, loopCnt, player.transform.transpose, bars)
+    return trace
+
+
+def renderFiles(files: list, target: str, format: str, loopCnt: int, transform: smftransform, sendMTC: bool):
+    if len(files) > 1 or os.path.isdir(target):
+        os.makedirs(target, exist_ok=True)
+        suffix = '.mid' if format == 'mid' else '.jsonl'
+        paths = [os.path.join(target, os.path.splitext(os.path.basename(f))[0] + suffix) for f in files]
+    else:
+        paths = [target]
+    for filename, path in zip(files, paths):
+        start = time.perf_counter()
+        trace = renderSong(smfsong(MidiFile(filename)), loopCnt, transform, sendMTC)
+        trace.write(path, format)
+        print(f"{filename} -> {path}: {len(trace.records)} records in {time.perf_counter() - start:.3f}s")
+
+
+def livePlayer(args, midiout) -> smfplayout:
+    """the player main() plays with, timecode and transform as --render gets them"""
+    smfPlayer = smfplayout(midiout)
+    smfPlayer.setSendMTC(args.midi_timecode)
+    smfPlayer.setTransform(transformFromArgs(args))
+    smfPlayer.setRealtime(RealtimeOptions(args.cpus, args.sched, args.priority, args.mlock))
+    return smfPlayer
+
+
 def quiet(m:dict):
     pass
 
 def main():
+    if args.loops is not None:
+        loopcnt = args.loops
+    elif args.loop:
+        loopcnt = 99999
+    else:
+        loopcnt = 1
+    if args.render is not None:
+        renderFiles(args.files, args.render, args.format, loopcnt, transformFromArgs(args), args.midi_timecode)
+        return
+    log = None
+    tracer = None
     try:
-        midiout = rtmidi.MidiOut()
-        midiout.open_virtual_port("midi-curse")
-        smfPlayer = smfplayout(midiout)
+        midiout = openOutput(args.output)
+        smfPlayer = livePlayer(args, midiout)
+        if args.timingLog is not None:
+            log = PlayerLog()
+            log.setTimingPath(args.timingLog)
+            smfPlayer.setLog(log)
+        if args.trace is not None:
+            tracer = EngineTrace(args.trace)
+            smfPlayer.setTrace(tracer)
         e = Event()
         time.sleep(1)
 
         for filename in args.files:
-            if args.loop:
-                loopcnt = 99999
-            else:
-                loopcnt = 1
             if args.quiet:
-                smfPlayer.play_file(filename, e, quiet, loopcnt, 0)
+                smfPlayer.play_file(filename, e, quiet, loopcnt, args.transpose)
             else:
-                smfPlayer.play_file(filename, e, print, loopcnt, 0)
+                smfPlayer.play_file(filename, e, print, loopcnt, args.transpose)
         del midiout
 
     except KeyboardInterrupt:
         pass
+    finally:
+        if log is not None:
+            log.close()
+        if tracer is not None:
+            tracer.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+Cold start benchmark of the curses player.
+
+    startbench.py smf-explore/on-the-rhodes-var2.mid
+    startbench.py -n 20 --player main.py song.mid
+
+Starts the player in a pseudo terminal with a scratch home whose settings
+send midi to a file, in a scratch directory holding only the given song.
+As soon as the song shows up in the listing the right arrow plays it.
+Reported per run, in milliseconds from starting the interpreter:
+    frame    first frame drawn (the info screen)
+    listing  the directory listing is on screen
+    note     the first note on reaches the output
+"""
+
+import argparse
+import json
+import os
+import pty
+import select
+import shutil
+import signal
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+channelLengths = [3] * 0x40 + [2] * 0x20 + [3] * 0x10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('-n', '--runs', dest='runs', type=int, default=10, help='number of starts (default %(default)s)')
+    arg('--player', dest='player', default=os.path.join(here, 'curses-smf-player.py'), help='script to start')
+    arg('--timeout', dest='timeout', type=float, default=10.0, help='seconds to give up a run after')
+    arg('song', help='MIDI file to play')
+    return parser.parse_args()
+
+
+def firstNoteOn(data: bytes) -> bool:
+    """whether a raw midi stream (no running status) contains a note on"""
+    i = 0
+    while i < len(data):
+        status = data[i]
+        if 0x80 <= status < 0xF0:
+            if status & 0xF0 == 0x90 and i + 2 < len(data) and data[i + 2] > 0:
+                return True
+            i += channelLengths[status - 0x80]
+        elif status == 0xF0:
+            end = data.find(b"\xF7", i)
+            if end < 0:
+                return False
+            i = end + 1
+        else:
+            i += {0xF1: 2, 0xF2: 3, 0xF3: 2}.get(status, 1)
+    return False
+
+
+def prepare(song: str) -> tuple:
+    """scratch home with settings and a directory holding only the song"""
+    root = tempfile.mkdtemp(prefix='startbench-')
+    songs = os.path.join(root, 'songs')
+    os.makedirs(os.path.join(root, '.cursedsmfplay'))
+    os.makedirs(songs)
+    shutil.copy(song, songs)
+    midi = os.path.join(root, 'out.mid.raw')
+    settings = {"home": root, "lastworkingdirectory": songs, "mtc": False, "loop": False,
+                "output": f"file:{midi}", "controlsocket": os.path.join(root, 'control.sock')}
+    with open(os.path.join(root, '.cursedsmfplay', 'settings.json'), 'w') as f:
+        json.dump(settings, f)
+    return root, songs, midi
+
+
+def startOnce(player: str, root: str, songs: str, midi: str, name: bytes, timeout: float) -> dict:
+    open(midi, 'wb').close()
+    start = time.perf_counter()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ['HOME'] = root
+        os.environ['TERM'] = 'xterm'
+        os.chdir(songs)
+        os.execvp(sys.executable, [sys.executable, player])
+    import fcntl
+    import termios
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', 30, 100, 0, 0))
+    times = dict()
+    screen = b""
+    try:
+        while 'note' not in times and time.perf_counter() - start < timeout:
+            ready, _, _ = select.select([fd], [], [], 0.0005)
+            if ready:
+                screen += os.read(fd, 65536)
+            now = time.perf_counter()
+            if 'frame' not in times and b"STOPPED" in screen:
+                times['frame'] = now - start
+            if 'listing' not in times and name in screen:
+                times['listing'] = now - start
+                os.write(fd, b"\x1bOC")
+            if 'listing' in times:
+                with open(midi, 'rb') as f:
+                    if firstNoteOn(f.read()):
+                        times['note'] = time.perf_counter() - start
+    except OSError:
+        # the player has died, the run counts as incomplete
+        pass
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(fd)
+    return times
+
+
+def main():
+    args = parse_args()
+    root, songs, midi = prepare(args.song)
+    name = os.path.basename(args.song).encode()
+    results = {'frame': [], 'listing': [], 'note': []}
+    try:
+        for run in range(args.runs):
+            times = startOnce(os.path.abspath(args.player), root, songs, midi, name, args.timeout)
+            for key in results:
+                if key in times:
+                    results[key].append(times[key] * 1000)
+            print(f"run {run + 1}: " + "  ".join(f"{key} {times[key] * 1000:.1f}" for key in results if key in times),
+                  flush=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    for key, values in results.items():
+        if values:
+            print(f"{key:8} median {statistics.median(values):7.1f} ms  min {min(values):7.1f} ms  "
+                  f"({len(values)}/{args.runs} runs)")
+    return 0 if len(results['note']) == args.runs else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import json
+import os
+import socket
+import tempfile
+import unittest
+from control import ControlServer, flagValue, numberValue
+from tests.test_screen import Terminal, here
+
+
+def ask(path: str, line: bytes) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(path)
+        sock.sendall(line + b"\n")
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = ControlServer(os.path.join(self.directory.name, "control.sock"), self.handle)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.server.path)
+        self.sock.settimeout(5)
+        self.replies = self.sock.makefile('rb')
+
+    def tearDown(self):
+        self.replies.close()
+        self.sock.close()
+        self.server.close()
+        self.directory.cleanup()
+
+    def handle(self, command: dict) -> dict:
+        if command["cmd"] == "transpose":
+            return {"transpose": int(command["value"])}
+        if command["cmd"] == "fail":
+            raise RuntimeError("the handler failed")
+        return {}
+
+    def command(self, line: bytes) -> dict:
+        self.sock.sendall(line + b"\n")
+        # the first poll accepts the connection, the next one reads the line
+        for i in range(3):
+            self.server.poll()
+        return json.loads(self.replies.readline())
+
+    def test_every_error_is_answered(self):
+        self.assertEqual(self.command(b'{"cmd": "transpose", "value": 1e400}'),
+                         {"ok": False, "error": "cannot convert float infinity to integer"})
+        self.assertEqual(self.command(b'{"cmd": "fail"}'), {"ok": False, "error": "the handler failed"})
+        self.assertEqual(self.command(b'{"cmd": "transpose"}'), {"ok": False, "error": "missing 'value'"})
+        self.assertFalse(self.command(b'[1, 2]')["ok"])
+        self.assertEqual(self.command(b'{"cmd": "transpose", "value": -2}'), {"ok": True, "transpose": -2})
+
+
+class ValueTest(unittest.TestCase):
+    def test_flags(self):
+        for value in (True, 1, "1", "on", "Yes", "true"):
+            self.assertIs(flagValue(value), True, value)
+        for value in (False, 0, "0", "off", "no", "False"):
+            self.assertIs(flagValue(value), False, value)
+        for value in ("maybe", 2, None, [True]):
+            self.assertRaises(ValueError, flagValue, value)
+
+    def test_numbers(self):
+        self.assertEqual(numberValue("1.5"), 1.5)
+        self.assertEqual(numberValue(-3), -3.0)
+        for value in (float("inf"), float("-inf"), float("nan"), "1e400"):
+            self.assertRaises(ValueError, numberValue, value)
+        self.assertRaises(TypeError, numberValue, None)
+
+
+class PlayerTest(unittest.TestCase):
+    def test_bad_commands_leave_the_player_running(self):
+        with tempfile.TemporaryDirectory() as directory:
+            home = os.path.join(directory, ".cursedsmfplay")
+            os.mkdir(home)
+            terminal = Terminal(home, 24)
+            terminal.pump(2.0)
+            path = os.path.join(home, "control.sock")
+            song = json.dumps(os.path.join(here, "smf-explore", "angel-verse-var4.mid")).encode()
+            for line in (b'{"cmd": "transpose", "value": 1e400}', b'{"cmd": "tempo", "factor": NaN}',
+                         b'{"cmd": "seek", "seconds": "soon"}', b'{"cmd": "loop", "value": "maybe"}',
+                         b'{"cmd": "profile", "path": %s, "fields": {"tempo": "fast"}}' % song,
+                         b'{"cmd": "profile", "path": %s, "fields": {"loop": 8}}' % song):
+                self.assertFalse(ask(path, line)["ok"], line)
+            profile = ask(path, b'{"cmd": "profile", "path": %s, "fields": {"tempo": "1.5", "loop": [2, null]}}' % song)
+            self.assertEqual(profile["profile"], {"tempo": 1.5, "loop": [2.0, None]})
+            self.assertTrue(ask(path, b'{"cmd": "loop", "value": "true"}')["loop"])
+            self.assertFalse(ask(path, b'{"cmd": "loop", "value": "false"}')["loop"])
+            self.assertEqual(ask(path, b'{"cmd": "transpose", "value": 3}')["transpose"], 3)
+            self.assertEqual(terminal.exit(), 0)
+
+    def test_layers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            home = os.path.join(directory, ".cursedsmfplay")
+            os.mkdir(home)
+            terminal = Terminal(home, 24)
+            terminal.pump(2.0)
+            path = os.path.join(home, "control.sock")
+            bass = os.path.join(here, "smf-explore", "bass", "bass-82bpm-pop-E-1.mid")
+            self.assertTrue(ask(path, b'{"cmd": "loop", "value": true}')["loop"])
+            for line in (b'{"cmd": "layer", "path": "/no/such.mid"}', b'{"cmd": "layer", "id": 1}',
+                         b'{"cmd": "layer", "path": %s, "port": "nowhere"}' % json.dumps(bass).encode()):
+                self.assertFalse(ask(path, line)["ok"], line)
+            added = ask(path, b'{"cmd": "layer", "path": %s, "transpose": -12, "mute": "10", "port": "null"}'
+                        % json.dumps(bass).encode())
+            self.assertEqual(added, {"ok": True, "loading": bass})
+            layers = []
+            for i in range(50):
+                layers = ask(path, b'{"cmd": "layers"}')["layers"]
+                if layers:
+                    break
+                terminal.pump(0.1)
+            self.assertEqual(layers, [{"id": 1, "file": bass, "transpose": -12, "mute": "10", "port": "null",
+                                       "sync": True}])
+            changed = ask(path, b'{"cmd": "layer", "id": 1, "transpose": 0, "mute": "", "port": "record"}')
+            self.assertEqual(changed["layer"], {"id": 1, "file": bass, "transpose": 0, "mute": "", "port": "record",
+                                                "sync": True})
+            self.assertEqual(ask(path, b'{"cmd": "layer", "id": 1, "remove": true}')["removed"], 1)
+            self.assertEqual(ask(path, b'{"cmd": "layers"}')["layers"], [])
+            self.assertEqual(terminal.exit(), 0)
+            self.assertNotIn(b"Traceback", terminal.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from mido import Message, MidiFile, MidiTrack
+from midiout import NullOutput
+from pianoroll import PianoRoll
+from smfevents import smftransform
+from smfplayout import smfplayout, smfsong, virtualclock
+
+
+def twoChannelSong() -> smfsong:
+    """a note every beat on channel 1 and on the drum channel 10"""
+    source = MidiFile(type=0, ticks_per_beat=480)
+    track = MidiTrack()
+    for beat in range(8):
+        track += [Message('note_on', channel=0, note=60, velocity=100),
+                  Message('note_on', channel=9, note=36, velocity=100),
+                  Message('note_off', channel=0, note=60, time=240), Message('note_off', channel=9, note=36)]
+        track.append(Message('control_change', channel=0, control=1, value=0, time=240))
+    source.tracks.append(track)
+    return smfsong(source)
+
+
+class ComposeTest(unittest.TestCase):
+    def compose(self, transform: smftransform) -> dict:
+        clock = virtualclock()
+        player = smfplayout(NullOutput(), clock)
+        player.setTransform(transform)
+        player.begin(twoChannelSong(), transform.transpose)
+        roll = PianoRoll(None)
+        roll.rows, roll.cols = 10, 60
+        return {line[:2].strip(): line[11:] for line, attributes in roll.compose(player)[1:]}
+
+    def test_muted_channel_is_not_shown(self):
+        rows = self.compose(smftransform(mute={9}))
+        self.assertEqual(set(rows), {"1", "10"})
+        self.assertIn("|", rows["1"])
+        self.assertEqual(rows["10"].strip(" :"), "")
+
+    def test_every_channel_shown_unmuted(self):
+        rows = self.compose(smftransform())
+        self.assertIn("|", rows["1"])
+        self.assertIn("|", rows["10"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import tempfile
+import time
+import unittest
+from playerlog import PlayerLog
+
+
+class WriterTest(unittest.TestCase):
+    def test_idle_writer_waits_for_a_record(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "player.log")
+            log = PlayerLog(path, interval=0.01)
+            wakes = []
+            drain = log.drain
+            log.drain = lambda: (wakes.append(1), drain())
+            time.sleep(0.2)
+            self.assertLessEqual(len(wakes), 1)
+            log.info("played %s", "a song")
+            deadline = time.monotonic() + 2
+            while not os.path.exists(path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            log.close()
+            with open(path) as f:
+                self.assertIn("played a song", f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
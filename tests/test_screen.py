@@ -0,0 +1,126 @@
+import fcntl
+import json
+import os
+import pty
+import select
+import signal
+import struct
+import sys
+import tempfile
+import termios
+import time
+import unittest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Terminal:
+    """the player in a pseudo terminal of rows x cols, playing to the record backend"""
+    program = "main.py"
+    quitKey = "q"
+
+    def __init__(self, home: str, rows: int, cols: int = 80):
+        self.writeSettings(home)
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+            os.environ.update(HOME=os.path.dirname(home), TERM="xterm", PYTHONPATH=here)
+            os.chdir(os.path.join(here, "smf-explore"))
+            os.execvp(sys.executable, [sys.executable, os.path.join(here, self.program)])
+        self.output = b""
+        self.closed = False
+
+    def writeSettings(self, home: str):
+        with open(os.path.join(home, "settings.json"), "w") as f:
+            json.dump({"home": home, "lastworkingdirectory": os.path.join(here, "smf-explore"),
+                       "output": "record", "log": {"path": os.path.join(home, "player.log")}}, f)
+
+    def resize(self, rows: int, cols: int = 80):
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+        os.kill(self.pid, signal.SIGWINCH)
+
+    def pump(self, seconds: float):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            if select.select([self.fd], [], [], 0.05)[0]:
+                try:
+                    self.output += os.read(self.fd, 65536)
+                except OSError:
+                    # the player has closed the terminal
+                    self.closed = True
+                    return
+
+    def send(self, keys: str, seconds: float = 0.5):
+        os.write(self.fd, keys.encode())
+        self.pump(seconds)
+
+    def exit(self) -> int:
+        """sends the quit key, the exit status of the program"""
+        self.send(self.quitKey, 1.0)
+        end = time.monotonic() + 5
+        while time.monotonic() < end:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid:
+                return os.waitstatus_to_exitcode(status)
+            if self.closed:
+                time.sleep(0.05)
+            else:
+                self.pump(0.05)
+        os.kill(self.pid, signal.SIGKILL)
+        os.waitpid(self.pid, 0)
+        return None
+
+
+class SmallScreenTest(unittest.TestCase):
+    def test_playing_on_a_shrinking_screen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            home = os.path.join(directory, ".cursedsmfplay")
+            os.mkdir(home)
+            terminal = Terminal(home, 15)
+            terminal.pump(2.0)
+            # past the two directories to angel-verse-var4.mid, cursor keys in keypad transmit mode
+            terminal.send("\x1bOB\x1bOB\x1bOC", 1.0)
+            for rows in (12, 8, 15, 4, 24):
+                terminal.resize(rows)
+                terminal.pump(0.5)
+            # the piano roll instead of the listing
+            terminal.send("v", 0.5)
+            for rows in (9, 5, 15):
+                terminal.resize(rows)
+                terminal.pump(0.5)
+            self.assertEqual(terminal.exit(), 0, terminal.output.decode(errors="replace"))
+            self.assertNotIn(b"Traceback", terminal.output)
+            with open(os.path.join(home, "player.log")) as f:
+                self.assertIn("angel-verse-var4.mid", f.read())
+
+
+class KeyboardTerminal(Terminal):
+    """CursesKeyBoard.py in the pseudo terminal, home is its ~/.curseskeyplay"""
+    program = "CursesKeyBoard.py"
+    quitKey = "\x1b"
+
+    def writeSettings(self, home: str):
+        with open(os.path.join(home, "settings.json"), "w") as f:
+            json.dump({"home": home, "lastworkingdirectory": here, "output": "null", "gate": 0.1}, f)
+
+
+class KeyboardScreenTest(unittest.TestCase):
+    def test_playing_on_a_shrinking_screen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            home = os.path.join(directory, ".curseskeyplay")
+            os.mkdir(home)
+            terminal = KeyboardTerminal(home, 6)
+            terminal.pump(1.0)
+            # notes released by their gate redraw the keyboard on their own
+            terminal.send("asdf", 0.5)
+            for rows in (3, 1, 12, 2):
+                terminal.resize(rows)
+                terminal.send("gh12", 0.5)
+            terminal.send("z", 0.5)
+            self.assertEqual(terminal.exit(), 0, terminal.output.decode(errors="replace"))
+            self.assertNotIn(b"Traceback", terminal.output)
+            self.assertIn(b"back to shell", terminal.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
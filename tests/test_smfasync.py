@@ -0,0 +1,74 @@
+import asyncio
+import os
+import unittest
+from midiout import RecordingOutput
+from smfasync import asyncplayer
+
+songs = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smf-explore")
+
+# the last message stopAll() sends
+allStopped = bytes([0xBF, 127, 0])
+
+
+class RestartTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.output = RecordingOutput()
+        self.player = asyncplayer(self.output)
+        await self.player.load(os.path.join(songs, "angel-verse-var4.mid"))
+
+    async def asyncTearDown(self):
+        await self.player.stop()
+
+    def sentSince(self, count: int) -> list:
+        return [data for seconds, data in self.output.messages[count:]]
+
+    async def firstStatus(self) -> dict:
+        async for info in self.player.status():
+            return info
+
+    async def test_play_while_playing(self):
+        await self.player.play()
+        await asyncio.sleep(0.2)
+        await self.player.play()
+        # the first song has stopped its notes before the second began
+        started = len(self.output.messages)
+        self.assertIn(allStopped, self.sentSince(0))
+        info = await asyncio.wait_for(self.firstStatus(), 2)
+        self.assertTrue(info["playing"])
+        self.assertLess(info["seconds"], 0.5)
+        await asyncio.sleep(0.2)
+        self.assertTrue(self.player.engine.playing)
+        self.assertTrue(self.player.playing)
+        self.assertNotIn(allStopped, self.sentSince(started))
+        self.assertTrue([data for data in self.sentSince(started) if data[0] == 0x90])
+
+    async def test_seek_while_playing(self):
+        await self.player.play()
+        await asyncio.sleep(0.2)
+        started = len(self.output.messages)
+        self.player.seek(10.0)
+        info = await asyncio.wait_for(self.firstStatus(), 2)
+        self.assertTrue(info["playing"])
+        self.assertGreaterEqual(info["seconds"], 10.0)
+        self.assertTrue(self.player.engine.playing)
+        self.assertNotIn(allStopped, self.sentSince(started))
+
+    async def test_stop_ends_status(self):
+        await self.player.play()
+        statuses = []
+
+        async def follow():
+            async for info in self.player.status():
+                statuses.append(info)
+
+        following = asyncio.get_running_loop().create_task(follow())
+        await asyncio.sleep(0.2)
+        await self.player.stop()
+        await asyncio.wait_for(following, 2)
+        self.assertFalse(self.player.engine.playing)
+        self.assertFalse(statuses[-1]["playing"])
+        self.assertEqual(self.sentSince(0)[-1], allStopped)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+from smfexport import exportSong
+from smfplayout import smfsong
+
+songs = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smf-explore")
+
+
+def noteOnTicks(midi_data: MidiFile) -> list:
+    ticks = []
+    for track in midi_data.tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if msg.type == 'note_on' and msg.velocity > 0:
+                ticks.append(tick)
+    return sorted(ticks)
+
+
+class LoopTest(unittest.TestCase):
+    def assertSecondPass(self, source: MidiFile, endTick: int):
+        song = smfsong(source)
+        self.assertEqual(song.lengthTicks, endTick)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "loop.mid")
+            exportSong(song, path, loops=2)
+            exported = MidiFile(path)
+        first = noteOnTicks(source)
+        notes = noteOnTicks(exported)
+        self.assertEqual(notes, first + [endTick + tick for tick in first])
+        self.assertAlmostEqual(exported.length, 2 * source.length, places=3)
+
+    def test_second_pass_starts_at_end_of_track(self):
+        self.assertSecondPass(MidiFile(os.path.join(songs, "angel-verse-var4.mid")), 230399)
+        self.assertSecondPass(MidiFile(os.path.join(songs, "jazz_and_wine_60_bpm-C_Variation_04.mid")), 307199)
+
+    def test_second_pass_starts_at_end_of_the_longest_track(self):
+        source = MidiFile(type=1, ticks_per_beat=480)
+        source.tracks.append(MidiTrack([MetaMessage('set_tempo', tempo=600000),
+                                        MetaMessage('end_of_track', time=960)]))
+        source.tracks.append(MidiTrack([Message('note_on', note=60, velocity=100),
+                                        Message('note_off', note=60, time=480),
+                                        MetaMessage('end_of_track', time=1440)]))
+        self.assertSecondPass(source, 1920)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from threading import Event
+from mido import MidiFile
+from midiout import RecordingOutput
+from prefetch import Prefetcher, SongCache
+from smflayers import smflayers, initialTempo, tempoRatio, startLead
+from smfplayout import smfplayout, smfsong, virtualclock
+
+songs = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smf-explore")
+
+
+def loadSong(name: str) -> smfsong:
+    return smfsong(MidiFile(os.path.join(songs, name)))
+
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = virtualclock(100.0)
+        self.output = RecordingOutput(self.clock)
+        self.layers = smflayers(self.clock)
+        self.player = smfplayout(self.output, self.clock)
+        self.layers.follow(self.player)
+
+    def tearDown(self):
+        self.layers.stop()
+
+    def test_synced_to_the_song_playing(self):
+        bass = loadSong(os.path.join("bass", "bass-82bpm-pop-E-1.mid"))
+        first = self.layers.add(bass, self.output, sync=True)
+        self.assertAlmostEqual(first.start, 100.0 + startLead)
+        self.clock.time = 101.3
+        song = loadSong("angel-verse-var4.mid")
+        self.player.begin(song, 0)
+        self.player.tempoFactor = 2.0
+        self.player.rewind(6.0)
+        layer = self.layers.add(loadSong("on-the-rhodes-var2.mid"), self.output, sync=True)
+        # the next bar of the song playing, at its tempo factor, not one of the first layer's bars
+        nextBar = min(t for t in song.barTimes if t > 6.0 + startLead * 2)
+        self.assertAlmostEqual(layer.start, 101.3 + (nextBar - 6.0) / 2.0)
+        self.assertAlmostEqual(layer.scale, tempoRatio(initialTempo(song), initialTempo(layer.song)) / 2.0)
+        self.player.playing = False
+        # without a song playing the first layer leads again
+        layer = self.layers.add(loadSong("on-the-rhodes-var2.mid"), self.output, sync=True)
+        self.assertAlmostEqual(layer.scale, tempoRatio(initialTempo(bass), initialTempo(layer.song)))
+        self.assertEqual([layer.number for layer in self.layers.layers], [1, 2, 3])
+
+    def test_moved_to_another_port(self):
+        layer = self.layers.add(loadSong("on-the-rhodes-var2.mid"), self.output, sync=False)
+        layer.pendingNotes[9][36] = 1
+        other = RecordingOutput(self.clock)
+        self.layers.setOutput(self.layers.layer(layer.number), other)
+        self.assertEqual([data for seconds, data in self.output.messages], [bytes([0x89, 36, 0x40])])
+        self.assertIs(layer.output, other)
+        self.assertRaises(KeyError, self.layers.layer, layer.number + 1)
+
+
+class LoadTest(unittest.TestCase):
+    def test_loaded_on_the_prefetch_thread(self):
+        prefetcher = Prefetcher(SongCache(4))
+        loaded = []
+        done = Event()
+
+        def ready(path, song):
+            loaded.append((path, song))
+            if len(loaded) == 2:
+                done.set()
+
+        with tempfile.NamedTemporaryFile(suffix=".mid") as broken:
+            broken.write(b"not a midi file")
+            broken.flush()
+            path = os.path.join(songs, "angel-verse-var4.mid")
+            prefetcher.load(path, ready)
+            prefetcher.load(broken.name, ready)
+            self.assertTrue(done.wait(10))
+        prefetcher.stop()
+        self.assertEqual(loaded[0][0], path)
+        self.assertIsInstance(loaded[0][1], smfsong)
+        self.assertIn(path, prefetcher.cache)
+        self.assertEqual(loaded[1], (broken.name, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import unittest
+from threading import Event
+from mido import MidiFile
+from smfevents import smftransform
+from midiout import NullOutput
+from smfplayout import smfplayout, smfsong, smftrace, virtualclock, renderSong, livePlayer, parse_args
+
+songs = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "smf-explore")
+
+
+def loadSong(name: str) -> smfsong:
+    return smfsong(MidiFile(os.path.join(songs, name)))
+
+
+def timecode(trace: smftrace) -> list:
+    """quarter frames and full frame messages"""
+    return [value for seconds, kind, value in trace.records
+            if kind == 'msg' and (value[0] == 0xF1 or value[:5] == [0xF0, 0x7F, 0x7F, 0x01, 0x01])]
+
+
+class StopAllTest(unittest.TestCase):
+    def test_stop_leaves_channel_volume_alone(self):
+        clock = virtualclock()
+        trace = smftrace(clock)
+        smfplayout(trace, clock).stopAll()
+        messages = [value for seconds, kind, value in trace.records]
+        self.assertEqual(len(messages), 16 * 4)
+        self.assertFalse([m for m in messages if m[0] & 0xF0 == 0xB0 and m[1] == 7])
+        for message in messages:
+            self.assertTrue(all(byte < 0x80 for byte in message[1:]), message)
+
+
+class TimecodeTest(unittest.TestCase):
+    def test_render_sends_timecode_when_asked(self):
+        trace = renderSong(loadSong("on-the-rhodes-var2.mid"), sendMTC=True)
+        self.assertTrue(timecode(trace))
+
+    def test_render_without_timecode(self):
+        trace = renderSong(loadSong("on-the-rhodes-var2.mid"), sendMTC=False)
+        self.assertEqual(timecode(trace), [])
+
+    def test_command_line_playing_and_rendering_agree(self):
+        for argv, sendMTC in ((["song.mid"], False), (["-t", "song.mid"], True)):
+            args = parse_args(argv)
+            player = livePlayer(args, NullOutput())
+            self.assertIs(player.sendMTC, sendMTC, argv)
+            self.assertIs(player.mtc.sendMTC, sendMTC, argv)
+        # without -t neither plays nor renders timecode
+        self.assertEqual(timecode(renderSong(loadSong("on-the-rhodes-var2.mid"))), [])
+
+    def test_switched_off_stays_off_for_the_next_song(self):
+        song = loadSong("fusion-latin-verse-var3.mid")
+        clock = virtualclock()
+        trace = smftrace(clock)
+        player = smfplayout(trace, clock)
+        player.setSendMTC(False)
+        for i in range(2):
+            player.play_out(song, Event(), trace.status, 1, 0, bars=1)
+        self.assertEqual(timecode(trace), [])
+
+
+class TransformTest(unittest.TestCase):
+    def setUp(self):
+        self.song = loadSong("on-the-rhodes-var2.mid")
+        self.clock = virtualclock()
+        self.trace = smftrace(self.clock)
+        self.player = smfplayout(self.trace, self.clock)
+
+    def resets(self) -> int:
+        """the reset all controllers stopPendingNotes() sends for every channel"""
+        return len([value for seconds, kind, value in self.trace.records
+                    if kind == 'msg' and value[0] & 0xF0 == 0xB0 and value[1] == 121])
+
+    def stepAfter(self, seconds: float):
+        self.clock.sleep(seconds)
+        self.player.step(self.trace.status)
+
+    def test_applied_once_while_a_step_runs_in_between(self):
+        player = self.player
+        player.begin(self.song, 0)
+        self.stepAfter(1.0)
+        transform = smftransform(transpose=5)
+        applied = []
+
+        def apply(events):
+            applied.append(events)
+            if len(applied) == 1:
+                # the playing thread gets a status update in while the calling thread works
+                self.stepAfter(0.2)
+            return smftransform.apply(transform, events)
+
+        transform.apply = apply
+        player.setTransform(transform)
+        self.assertIs(player.pendingEvents[1], transform)
+        self.stepAfter(0.1)
+        self.stepAfter(0.2)
+        self.assertEqual(len(applied), 1)
+        self.assertEqual(self.resets(), 16)
+        self.assertIs(player.applied, transform)
+        self.assertEqual(player.events.data1.tobytes(), smftransform(transpose=5).apply(self.song.events).data1.tobytes())
+
+    def test_set_while_the_song_starts(self):
+        player = self.player
+        player.begin(self.song, 0)
+        # as if it came before begin() had the song
+        transform = smftransform(mute={0})
+        player.pendingEvents = (None, transform, None)
+        self.stepAfter(0.1)
+        self.assertIs(player.applied, transform)
+        self.assertFalse([s for s in player.events.status if s & 0xF0 == 0x90 and s & 0x0F == 0])
+
+    def test_set_before_begin(self):
+        player = self.player
+        player.setTransform(smftransform(mute={0}))
+        player.begin(self.song, 2)
+        self.assertIsNone(player.pendingEvents)
+        self.assertEqual((player.applied.mute, player.applied.transpose), ({0}, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from midiout import RecordingOutput
+from smfplayout import virtualclock
+from wirerate import WireRateOutput
+
+
+def sent(output: RecordingOutput) -> list:
+    return [list(data) for seconds, data in output.messages]
+
+
+class ParameterTest(unittest.TestCase):
+    def test_rpn_sequences_keep_every_message_in_order(self):
+        clock = virtualclock()
+        output = RecordingOutput(clock)
+        wire = WireRateOutput(output, clock=clock)
+        # the sweep keeps the link busy, its second value waits
+        wire.send_message([0xB0, 1, 10])
+        wire.send_message([0xB0, 1, 20])
+        sequence = []
+        for parameter, value in ((0, 12), (2, 64)):
+            # pitch bend range, then coarse tuning, each with data entry and increment
+            sequence += [[0xB0, 101, 0], [0xB0, 100, parameter], [0xB0, 6, value], [0xB0, 38, 0], [0xB0, 96, 0]]
+        sequence += [[0xB0, 99, 1], [0xB0, 98, 8], [0xB0, 6, 70], [0xB0, 97, 0], [0xB0, 101, 127], [0xB0, 100, 127]]
+        for data in sequence:
+            wire.send_message(data)
+        wire.flush()
+        self.assertEqual([data for data in sent(output) if data[1] != 1], sequence)
+        self.assertEqual(wire.coalesced, 0)
+
+
+class CoalesceTest(unittest.TestCase):
+    def test_a_new_value_keeps_its_place_in_the_queue(self):
+        clock = virtualclock()
+        output = RecordingOutput(clock)
+        wire = WireRateOutput(output, clock=clock)
+        wire.send_message([0xB0, 1, 10])
+        for data in ([0xB0, 1, 20], [0xE0, 0, 64], [0xB0, 7, 100], [0xB0, 11, 90],
+                     [0xB0, 1, 30], [0xE0, 0, 80], [0xB0, 11, 95]):
+            wire.send_message(data)
+        wire.flush()
+        self.assertEqual(sent(output), [[0xB0, 1, 10], [0xB0, 1, 30], [0xE0, 0, 80], [0xB0, 7, 100], [0xB0, 11, 95]])
+        self.assertEqual(wire.coalesced, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
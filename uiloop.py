@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+Blocking main loop for the curses apps.
+
+Instead of sleeping and polling getkey() the apps wait in select() on stdin,
+a wakeup pipe and any other registered file descriptor (e.g. inotify).
+Other threads call wakeup() when they have something to show, SIGWINCH is
+turned into a 'KEY_RESIZE' key.
+"""
+
+import curses
+import os
+import selectors
+import signal
+import sys
+
+
+class UiLoop:
+    def __init__(self, screen):
+        self.screen = screen
+        self.selector = selectors.DefaultSelector()
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        os.set_blocking(self.wakeupRead, False)
+        os.set_blocking(self.wakeupWrite, False)
+        self.selector.register(self.wakeupRead, selectors.EVENT_READ, 'wakeup')
+        self.selector.register(sys.stdin.fileno(), selectors.EVENT_READ, 'input')
+        self.resized = False
+        self.previousWinch = signal.signal(signal.SIGWINCH, self.onResize)
+
+    def onResize(self, signum, frame):
+        self.resized = True
+        self.wakeup()
+
+    def wakeup(self):
+        """may be called from any thread"""
+        try:
+            os.write(self.wakeupWrite, b"\0")
+        except (BlockingIOError, OSError):
+            # the pipe is full, the loop wakes up anyway
+            pass
+
+    def register(self, fileobj, name: str):
+        if fileobj is not None and fileobj.fileno() is not None:
+            self.selector.register(fileobj, selectors.EVENT_READ, name)
+
+    def wait(self, timeout: float = None) -> set:
+        """blocks until input, a wakeup or timeout, returns the names of the ready sources"""
+        ready = set()
+        for key, mask in self.selector.select(timeout):
+            if key.data == 'wakeup':
+                try:
+                    while os.read(self.wakeupRead, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            ready.add(key.data)
+        return ready
+
+    def keys(self) -> list:
+        """all keys curses has buffered, the screen must be in nodelay mode"""
+        keys = []
+        if self.resized:
+            self.resized = False
+            try:
+                size = os.get_terminal_size(sys.stdout.fileno())
+                curses.resizeterm(size.lines, size.columns)
+            except (OSError, curses.error):
+                pass
+            keys.append('KEY_RESIZE')
+        while True:
+            try:
+                keys.append(self.screen.getkey())
+            except curses.error:
+                break
+        return keys
+
+    def close(self):
+        if self.previousWinch is None:
+            self.previousWinch = signal.SIG_DFL
+        signal.signal(signal.SIGWINCH, self.previousWinch)
+        self.selector.close()
+        os.close(self.wakeupRead)
+        os.close(self.wakeupWrite)
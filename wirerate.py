@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Bandwidth model of a DIN midi link (31250 baud, 10 bits a byte: 0.32 ms).
+
+WireRateOutput wraps any output backend and keeps track of when the link
+will be free again. Notes, program changes, pedals, channel mode messages,
+(N)RPN parameter numbers and data entry and timing messages are urgent and
+sent at once. Controller sweeps, pitch
+bend, pressure and sysex are deferred while the link is busy: a newer value
+of the same controller replaces a queued older one in its place, and deferred messages
+only go out when they fit before the next urgent event (or have waited
+maxDefer). A sysex is never split: any status byte but real time inside it
+would end it on the receiving side, so it waits for a gap as a whole.
+The engine calls pump() and asks pending() for its next wake-up; stats() is
+shown in the status view.
+"""
+
+import time
+from collections import OrderedDict
+
+# data entry (6, 38, 96, 97) goes to the parameter selected before (98-101): neither may be dropped or reordered
+urgentControllers = {0, 6, 32, 38, 64, 65, 66, 67, 68, 69} | set(range(96, 102)) | set(range(120, 128))
+
+
+def isUrgent(data) -> bool:
+    status = data[0]
+    kind = status & 0xF0
+    if kind in (0x80, 0x90, 0xC0):
+        return True
+    if kind == 0xB0:
+        return data[1] in urgentControllers
+    if status == 0xF0:
+        return False
+    # system common and real time (MTC, clock, transport) are about timing
+    return status > 0xF0 or kind not in (0xA0, 0xD0, 0xE0)
+
+
+class WireRateOutput:
+    def __init__(self, output, baud: int = 31250, clock=None, maxDefer: float = 0.05):
+        self.output = output
+        self.baud = baud
+        self.byteTime = 10 / baud
+        self.now = clock.now if clock is not None else time.time
+        self.maxDefer = maxDefer
+        self.busyUntil = 0.0
+        self.blockedUntil = 0.0
+        self.deferred = OrderedDict()
+        # once someone pumps, every deferrable message waits for a gap that fits
+        self.pumped = False
+        self.sequence = 0
+        self.bytes = 0
+        self.coalesced = 0
+        self.noteDelay = 0.0
+        self.windowStart = self.now()
+        self.windowBusy = 0.0
+
+    def transmit(self, data, now: float):
+        cost = len(data) * self.byteTime
+        start = max(now, self.busyUntil)
+        self.busyUntil = start + cost
+        self.bytes += len(data)
+        self.windowBusy += cost
+        self.output.send_message(data)
+
+    def send_message(self, data):
+        now = self.now()
+        if isUrgent(data):
+            if data[0] & 0xF0 == 0x90:
+                self.noteDelay = max(self.noteDelay, self.busyUntil - now)
+            self.transmit(data, now)
+        elif self.busyUntil <= now and not self.deferred and not self.pumped:
+            self.transmit(data, now)
+        else:
+            self.defer(data, now)
+
+    def defer(self, data, now: float):
+        status = data[0]
+        if status == 0xF0:
+            self.sequence += 1
+            self.deferred[('sysex', self.sequence)] = (now, bytes(data))
+            return
+        key = (status, data[1]) if status & 0xF0 in (0xA0, 0xB0) else (status,)
+        if key in self.deferred:
+            # only the latest value of a controller matters, it keeps the queued one's turn
+            self.coalesced += 1
+            self.deferred[key] = (self.deferred[key][0], bytes(data))
+        else:
+            self.deferred[key] = (now, bytes(data))
+
+    def pump(self, nextUrgent: float = None):
+        """sends deferred messages that fit before nextUrgent (a clock time) or have waited long enough"""
+        now = self.now()
+        self.pumped = True
+        self.blockedUntil = 0.0
+        while self.deferred and self.busyUntil <= now + self.byteTime:
+            key, (queued, data) = next(iter(self.deferred.items()))
+            cost = len(data) * self.byteTime
+            fits = nextUrgent is None or max(now, self.busyUntil) + cost <= nextUrgent
+            if not fits and now - queued < self.maxDefer:
+                self.blockedUntil = nextUrgent
+                break
+            del self.deferred[key]
+            self.transmit(data, now)
+
+    def pending(self) -> float:
+        """clock time pump() should be called again, None if nothing waits"""
+        if not self.deferred:
+            return None
+        return max(self.busyUntil, self.blockedUntil)
+
+    def flush(self):
+        now = self.now()
+        while self.deferred:
+            key, (queued, data) = self.deferred.popitem(last=False)
+            self.transmit(data, now)
+
+    def stats(self) -> dict:
+        """link load since the previous call, worst delay of a note on since the start"""
+        now = self.now()
+        elapsed = max(now - self.windowStart, 1e-6)
+        load = min(1.0, self.windowBusy / elapsed)
+        self.windowStart = now
+        self.windowBusy = 0.0
+        return {"baud": self.baud, "load": round(load, 3), "bytes": self.bytes, "queued": len(self.deferred),
+                "coalesced": self.coalesced, "noteDelay": round(self.noteDelay * 1000, 2)}
+
+    def close(self):
+        self.flush()
+        self.output.close()